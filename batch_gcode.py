@@ -0,0 +1,254 @@
+"""Chuyển hàng loạt ảnh sang G-code không cần giao diện (không dùng Tk/matplotlib)
+
+Ví dụ:
+    python batch_gcode.py ./jobs -o ./gcode --workers 4
+    python batch_gcode.py "scans/*.png" --method canny --threshold 80
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from path_buffer import (close_strokes, interpolate_strokes, resample_strokes, image_to_robot, workspace_scale,
+                         pen_up_length, pen_down_length)
+from stroke_order import order_strokes, choose_entry_points
+from stroke_merge import merge_strokes, join_adjacent, MERGE_GAP
+from stroke_dedup import dedup_strokes, PEN_WIDTH
+from kinematics import ARM_LENGTHS, fit_to_reach, clip_to_reach
+from image_pipeline import ExtractionPipeline, METHODS, THRESHOLD_MODES
+from tiled_extraction import TiledExtractor, image_pixel_count, image_dimensions
+from path_cache import PathCache, make_key
+from gcode import generate_gcode, JUNCTION_DEVIATION
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.npy']
+
+# Mặc định giống giao diện RobotArmController
+DEFAULTS = {
+    'threshold': 100,
+    'invert': True,
+    'method': "contour",
+    'detail_level': 0.5,
+    'threshold_mode': "manual",
+    'target_fraction': 0.1,
+    'step_size': 5.0,
+    'chord_error_mm': None,
+    'workspace_size': 300,
+    'offset_x': 150.0,
+    'offset_y': 100.0,
+    'auto_fit': False,
+    'tiled_min_pixels': 16_000_000,
+    'tolerance_mm': None,
+    'order': True,
+    'merge_gap': MERGE_GAP,
+    'pen_width': PEN_WIDTH,
+    'junction_deviation': JUNCTION_DEVIATION,
+    'cache_dir': None,
+}
+
+
+def find_images(inputs):
+    """Danh sách file ảnh từ các thư mục hoặc mẫu glob"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in sorted(os.listdir(item))]
+        else:
+            candidates = sorted(glob.glob(item))
+        files.extend(f for f in candidates
+                     if os.path.isfile(f) and os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+    # Bỏ trùng nhưng giữ thứ tự
+    return list(dict.fromkeys(files))
+
+
+def robot_path_from_drawing(drawing_path, width, height, options):
+    """optimize_path + convert_to_robot_coords của giao diện, không cần Tk"""
+    scale = workspace_scale(width, height, options['workspace_size'])
+    if options['chord_error_mm']:
+        drawing_path = resample_strokes(close_strokes(drawing_path), options['chord_error_mm'] / scale)
+    else:
+        drawing_path = interpolate_strokes(close_strokes(drawing_path), options['step_size'])
+    return image_to_robot(drawing_path, width, height, scale, options['offset_x'], options['offset_y'])
+
+
+def convert_image(image_path, output_path, options):
+    """Ảnh -> đường nét -> tọa độ robot -> G-code (chạy trong tiến trình con)"""
+    start = time.perf_counter()
+    record = {'image': image_path, 'gcode': output_path}
+    try:
+        o = options
+        tolerance = None
+        if o['tolerance_mm']:
+            # Sai số đơn giản hóa tính bằng mm trên giấy, đổi sang điểm ảnh gốc
+            width, height = image_dimensions(image_path)
+            tolerance = o['tolerance_mm'] / workspace_scale(width, height, o['workspace_size'])
+        cache = PathCache(disk_dir=o['cache_dir']) if o['cache_dir'] else None
+        key = None
+        cached = None
+        if cache is not None:
+            key_threshold = o['threshold'] if o['threshold_mode'] == "manual" else -1
+            key = make_key(cache.image_hash(image_path), key_threshold, o['invert'], o['method'],
+                           o['detail_level'], o['threshold_mode'], tolerance)
+            cached = cache.get(key)
+
+        if cached is not None:
+            (height, width), drawing_path = cached
+            record['threshold'] = None
+        else:
+            # Đã chạy song song theo ảnh, nên xử lý các ô ngay trong tiến trình này
+            extractor = TiledExtractor(cache_dir=os.path.join(o['cache_dir'] or '.path_cache', 'tiles'),
+                                       max_workers=1)
+            if not (extractor.supports(o['method']) and image_pixel_count(image_path) >= o['tiled_min_pixels']):
+                extractor = ExtractionPipeline()
+            img, drawing_path = extractor.extract(image_path, o['threshold'], o['invert'], o['method'],
+                                                  o['detail_level'], o['threshold_mode'], o['target_fraction'],
+                                                  tolerance)
+            height, width = img.shape[:2]
+            record['threshold'] = extractor.threshold_info['chosen']
+            if cache is not None:
+                cache.put(key, (height, width), drawing_path)
+
+        robot_path = robot_path_from_drawing(drawing_path, width, height, o)
+        if o['auto_fit']:
+            robot_path, record['fit_scale'], record['fit_center'] = fit_to_reach(robot_path, *ARM_LENGTHS)
+        robot_path, record['clipped_mm'] = clip_to_reach(robot_path, *ARM_LENGTHS)
+        drawn_before = pen_down_length(robot_path)
+        robot_path = dedup_strokes(robot_path, o['pen_width'])
+        drawn_after = pen_down_length(robot_path)
+        # Bỏ nét trùng có thể tách nét, nên số lần nhấc bút và quãng nhấc bút đo sau bước này
+        travel_before = pen_up_length(robot_path)
+        lifts_before = robot_path.num_strokes
+        robot_path = merge_strokes(robot_path, o['merge_gap'])
+        if o['order']:
+            # Đã chạy song song theo ảnh, nên không mở thêm tiến trình khi sắp xếp nét
+            robot_path = choose_entry_points(order_strokes(robot_path, workers=1))
+        robot_path = join_adjacent(robot_path, o['merge_gap'])
+        gcode = generate_gcode(robot_path, deviation=o['junction_deviation'])
+
+        with open(output_path, 'w') as f:
+            f.write("\n".join(gcode))
+
+        record.update({
+            'ok': True,
+            'size': [width, height],
+            'strokes': robot_path.num_strokes,
+            'points': robot_path.num_commands,
+            'gcode_lines': len(gcode),
+            'pen_up_mm_before': travel_before,
+            'pen_up_mm': pen_up_length(robot_path),
+            'lifts_removed': lifts_before - robot_path.num_strokes,
+            'duplicate_removed_pct': 100 * (1 - drawn_after / drawn_before) if drawn_before else 0.0,
+            'cached': cached is not None,
+        })
+    except Exception as e:
+        record.update({'ok': False, 'error': str(e)})
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def run_batch(images, output_dir, options, workers=None):
+    """Xử lý song song, trả về bản tổng kết (dict)"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    records = []
+
+    # Tên file G-code theo tên ảnh; thêm số thứ tự nếu trùng tên
+    outputs = {}
+    used = set()
+    for image_path in images:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        name = stem
+        n = 1
+        while name in used:
+            n += 1
+            name = f"{stem}_{n}"
+        used.add(name)
+        outputs[image_path] = name
+    jobs = [(p, os.path.join(output_dir, outputs[p] + ".gcode")) for p in images]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_image, p, out, options) for p, out in jobs]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            if record['ok']:
+                print(f"{record['image']}: {record['points']} điểm, nhấc bút {record['pen_up_mm_before']:.0f} -> "
+                      f"{record['pen_up_mm']:.0f} mm, bỏ {record['lifts_removed']} lần nhấc bút, "
+                      f"nét trùng -{record['duplicate_removed_pct']:.1f}%, "
+                      f"cắt {record['clipped_mm']:.0f} mm ngoài tầm với, "
+                      f"{record['seconds']:.2f}s -> {record['gcode']}")
+            else:
+                print(f"{record['image']}: LỖI {record['error']} ({record['seconds']:.2f}s)")
+
+    wall_time = time.perf_counter() - start
+    order = {p: i for i, p in enumerate(images)}
+    records.sort(key=lambda r: order[r['image']])
+    done = sum(r['ok'] for r in records)
+    return {
+        'options': options,
+        'workers': workers or os.cpu_count(),
+        'images': len(images),
+        'succeeded': done,
+        'failed': len(images) - done,
+        'wall_seconds': wall_time,
+        'cpu_seconds': sum(r['seconds'] for r in records),
+        'images_per_second': len(images) / wall_time if wall_time > 0 else 0.0,
+        'results': records,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chuyển hàng loạt ảnh sang G-code (không cần giao diện)")
+    parser.add_argument('inputs', nargs='+', help="thư mục hoặc mẫu glob chứa ảnh")
+    parser.add_argument('-o', '--output', default='gcode_out', help="thư mục lưu file .gcode")
+    parser.add_argument('--summary', help="file JSON tổng kết (mặc định: <output>/summary.json)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="số tiến trình (mặc định: số CPU)")
+    parser.add_argument('--threshold', type=int, default=DEFAULTS['threshold'])
+    parser.add_argument('--no-invert', dest='invert', action='store_false', help="không đảo màu")
+    parser.add_argument('--method', choices=METHODS, default=DEFAULTS['method'])
+    parser.add_argument('--detail', dest='detail_level', type=float, default=DEFAULTS['detail_level'])
+    parser.add_argument('--threshold-mode', choices=THRESHOLD_MODES, default=DEFAULTS['threshold_mode'])
+    parser.add_argument('--target-fraction', type=float, default=DEFAULTS['target_fraction'])
+    parser.add_argument('--step-size', type=float, default=DEFAULTS['step_size'])
+    parser.add_argument('--chord-error-mm', type=float, default=DEFAULTS['chord_error_mm'],
+                        help="lấy mẫu theo độ cong với sai số dây cung này (mm) thay cho --step-size")
+    parser.add_argument('--workspace-size', type=float, default=DEFAULTS['workspace_size'])
+    parser.add_argument('--offset-x', type=float, default=DEFAULTS['offset_x'])
+    parser.add_argument('--offset-y', type=float, default=DEFAULTS['offset_y'])
+    parser.add_argument('--auto-fit', action='store_true',
+                        help="tự co giãn/dời hình cho vừa vùng với (bỏ qua --offset-x/--offset-y)")
+    parser.add_argument('--tiled-min-pixels', type=int, default=DEFAULTS['tiled_min_pixels'])
+    parser.add_argument('--tolerance-mm', type=float, default=DEFAULTS['tolerance_mm'],
+                        help="đơn giản hóa với sai số tuyệt đối (mm trên giấy) thay cho --detail")
+    parser.add_argument('--no-order', dest='order', action='store_false',
+                        help="giữ thứ tự nét như khi trích xuất (không giảm quãng đường nhấc bút)")
+    parser.add_argument('--merge-gap', type=float, default=DEFAULTS['merge_gap'],
+                        help="nối các nét có đầu mút cách nhau không quá khoảng này (mm); 0 để tắt")
+    parser.add_argument('--pen-width', type=float, default=DEFAULTS['pen_width'],
+                        help="bỏ đoạn nét vẽ lại đường đã vẽ trong khoảng này (mm); 0 để tắt")
+    parser.add_argument('--junction-deviation', type=float, default=DEFAULTS['junction_deviation'],
+                        help="giảm feedrate khi vẽ qua góc gắt theo độ lệch cho phép này (mm); 0 để tắt")
+    parser.add_argument('--cache-dir', default=DEFAULTS['cache_dir'], help="dùng chung cache đường nét trên đĩa")
+    args = parser.parse_args(argv)
+
+    images = find_images(args.inputs)
+    if not images:
+        print("Không tìm thấy ảnh nào.")
+        return 1
+
+    options = {key: getattr(args, key) for key in DEFAULTS}
+    summary = run_batch(images, args.output, options, args.workers)
+
+    summary_path = args.summary or os.path.join(args.output, 'summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"Xong {summary['succeeded']}/{summary['images']} ảnh trong {summary['wall_seconds']:.2f}s "
+          f"({summary['images_per_second']:.2f} ảnh/giây) - tổng kết: {summary_path}")
+    return 0 if summary['failed'] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""Đo hiệu năng và so sánh các bước xử lý (không cần giao diện)
+
+Ví dụ:
+    python bench.py methods sample.png
+    python bench.py startup
+    python bench.py order --strokes 10000 100000
+    python bench.py interpolate --points 10000 100000 1000000
+    python bench.py ik --points 100000 1000000
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from image_pipeline import ExtractionPipeline, METHODS
+from path_buffer import PathBuffer, interpolate_strokes, pen_down_length, pen_up_length
+from stroke_order import order_strokes, choose_entry_points
+from batch_gcode import DEFAULTS, robot_path_from_drawing
+from gcode import estimate_draw_time
+from kinematics import ARM_LENGTHS, inverse_kinematics
+
+
+def compare_methods(image_path, options=DEFAULTS):
+    """So sánh số điểm và thời gian vẽ ước lượng của các phương pháp trích xuất trên cùng một ảnh"""
+    rows = []
+    for method in METHODS:
+        pipeline = ExtractionPipeline()
+        start = time.perf_counter()
+        try:
+            img, drawing_path = pipeline.extract(image_path, options['threshold'], options['invert'], method,
+                                                 options['detail_level'])
+        except ValueError as e:
+            rows.append({'method': method, 'error': str(e)})
+            continue
+        extract_time = time.perf_counter() - start
+        height, width = img.shape[:2]
+        robot_path = choose_entry_points(order_strokes(robot_path_from_drawing(drawing_path, width, height, options)))
+        rows.append({
+            'method': method,
+            'strokes': robot_path.num_strokes,
+            'points': robot_path.num_commands,
+            'pen_down_mm': pen_down_length(robot_path),
+            'pen_up_mm': pen_up_length(robot_path),
+            'draw_seconds': estimate_draw_time(robot_path),
+            'extract_seconds': extract_time,
+        })
+    return rows
+
+
+def print_methods(rows):
+    print(f"{'Phương pháp':<12}{'Nét':>7}{'Điểm':>9}{'Vẽ (mm)':>11}{'Di chuyển (mm)':>16}"
+          f"{'Ước lượng (s)':>15}{'Trích xuất (s)':>16}")
+    for r in rows:
+        if 'error' in r:
+            print(f"{r['method']:<12}  lỗi: {r['error']}")
+            continue
+        print(f"{r['method']:<12}{r['strokes']:>7}{r['points']:>9}{r['pen_down_mm']:>11.1f}"
+              f"{r['pen_up_mm']:>16.1f}{r['draw_seconds']:>15.1f}{r['extract_seconds']:>16.3f}")
+
+
+def random_strokes(count, size=300.0, seed=0):
+    """Nét ngẫu nhiên (2-6 điểm) rải đều trên vùng size x size mm"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 7, count)
+    centers = np.repeat(rng.uniform(0, size, (count, 2)), lengths, axis=0)
+    offsets = np.zeros(count + 1, np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return PathBuffer(centers + rng.normal(0, 1.0, centers.shape), offsets, closed=np.zeros(count, bool))
+
+
+def compare_order(path, workers=None):
+    """Quãng đường nhấc bút trước/sau khi sắp xếp nét, sau khi chọn điểm vào, và thời gian từng bước"""
+    start = time.perf_counter()
+    ordered = order_strokes(path, workers=workers)
+    order_time = time.perf_counter() - start
+    start = time.perf_counter()
+    entered = choose_entry_points(ordered)
+    return {
+        'strokes': path.num_strokes,
+        'before_mm': pen_up_length(path),
+        'ordered_mm': pen_up_length(ordered),
+        'after_mm': pen_up_length(entered),
+        'seconds': order_time,
+        'entry_seconds': time.perf_counter() - start,
+    }
+
+
+def print_order(rows):
+    print(f"{'Nét':>9}{'Trước (mm)':>14}{'Sắp xếp (mm)':>14}{'Điểm vào (mm)':>15}{'Giảm':>8}"
+          f"{'Sắp xếp (s)':>13}{'Điểm vào (s)':>14}")
+    for r in rows:
+        saving = 1 - r['after_mm'] / r['before_mm'] if r['before_mm'] else 0.0
+        print(f"{r['strokes']:>9}{r['before_mm']:>14.0f}{r['ordered_mm']:>14.0f}{r['after_mm']:>15.0f}{saving:>8.1%}"
+              f"{r['seconds']:>13.2f}{r['entry_seconds']:>14.3f}")
+
+
+def interpolate_strokes_loop(buf, step):
+    """Cách nội suy cũ (vòng lặp Python theo từng điểm), giữ lại để so sánh"""
+    strokes = []
+    for stroke in buf.strokes():
+        points = []
+        pts = stroke.tolist()
+        for i in range(len(pts)):
+            points.append(pts[i])
+            if i < len(pts) - 1:
+                x1, y1 = pts[i]
+                x2, y2 = pts[i + 1]
+                distance = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+                if distance > step * 2:
+                    num_points = int(distance / step) - 1
+                    for j in range(1, num_points + 1):
+                        ratio = j / (num_points + 1)
+                        points.append((x1 + (x2 - x1) * ratio, y1 + (y2 - y1) * ratio))
+        strokes.append(points)
+    return PathBuffer.from_strokes(strokes, buf.pen, buf.closed)
+
+
+def random_polylines(num_points, points_per_stroke=50, spacing=8.0, seed=0):
+    """Đường gấp khúc ngẫu nhiên, khoảng cách giữa hai điểm liên tiếp quanh `spacing`"""
+    rng = np.random.default_rng(seed)
+    count = max(1, num_points // points_per_stroke)
+    lengths = np.full(count, num_points // count)
+    lengths[:num_points - lengths.sum()] += 1
+    offsets = np.zeros(count + 1, np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    steps = rng.normal(0, spacing, (num_points, 2))
+    steps[offsets[:-1]] = rng.uniform(0, 4000, (count, 2))
+    coords = np.cumsum(steps, axis=0)
+    # cumsum chạy qua ranh giới các nét: trừ đi phần cộng dồn của các nét trước
+    coords -= np.repeat(coords[offsets[:-1]] - steps[offsets[:-1]], lengths, axis=0)
+    return PathBuffer(coords, offsets, closed=np.zeros(count, bool))
+
+
+def compare_interpolate(num_points, step=DEFAULTS['step_size'], repeat=3):
+    """Số điểm đầu vào xử lý được mỗi giây: vòng lặp cũ so với bản numpy"""
+    path = random_polylines(num_points)
+    row = {'points': num_points}
+    for name, fn in (('loop', interpolate_strokes_loop), ('numpy', interpolate_strokes)):
+        best = float('inf')
+        for _ in range(1 if name == 'loop' else repeat):
+            start = time.perf_counter()
+            out = fn(path, step)
+            best = min(best, time.perf_counter() - start)
+        row[name + '_seconds'] = best
+        row[name + '_points_per_second'] = num_points / best
+        row['output_points'] = len(out)
+    return row
+
+
+def print_interpolate(rows):
+    print(f"{'Điểm vào':>10}{'Điểm ra':>11}{'Vòng lặp (điểm/s)':>20}{'NumPy (điểm/s)':>17}{'Nhanh hơn':>11}")
+    for r in rows:
+        print(f"{r['points']:>10}{r['output_points']:>11}{r['loop_points_per_second']:>20,.0f}"
+              f"{r['numpy_points_per_second']:>17,.0f}{r['loop_seconds'] / r['numpy_seconds']:>10.0f}x")
+
+
+def inverse_kinematics_loop(coords, L1, L2):
+    """Cách tính góc cũ (từng điểm một trong vòng lặp vẽ), giữ lại để so sánh"""
+    angles = []
+    for x, y in coords.tolist():
+        d = (x**2 + y**2 - L1**2 - L2**2) / (2 * L1 * L2)
+        if abs(d) > 1:
+            angles.append(None)
+            continue
+        theta2 = -np.arccos(d)
+        theta1 = np.arctan2(y, x) - np.arctan2(L2 * np.sin(theta2), L1 + L2 * np.cos(theta2))
+        angles.append((np.degrees(theta1), np.degrees(theta2)))
+    return angles
+
+
+def compare_ik(num_points, repeat=3, seed=0):
+    """Số điểm tính được góc khớp mỗi giây: vòng lặp cũ so với bản numpy"""
+    L1, L2 = ARM_LENGTHS
+    rng = np.random.default_rng(seed)
+    r = np.sqrt(rng.uniform((L1 - L2) ** 2, (L1 + L2) ** 2, num_points))
+    a = rng.uniform(-np.pi, np.pi, num_points)
+    coords = np.column_stack([r * np.cos(a), r * np.sin(a)])
+    row = {'points': num_points}
+    for name, fn in (('loop', lambda: inverse_kinematics_loop(coords, L1, L2)),
+                     ('numpy', lambda: inverse_kinematics(coords[:, 0], coords[:, 1], L1, L2))):
+        best = float('inf')
+        for _ in range(1 if name == 'loop' else repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        row[name + '_seconds'] = best
+    return row
+
+
+def print_ik(rows):
+    print(f"{'Điểm':>10}{'Vòng lặp (s)':>14}{'NumPy (s)':>12}{'Nhanh hơn':>11}")
+    for r in rows:
+        print(f"{r['points']:>10}{r['loop_seconds']:>14.3f}{r['numpy_seconds']:>12.4f}"
+              f"{r['loop_seconds'] / r['numpy_seconds']:>10.0f}x")
+
+
+def import_times(module="mainne"):
+    """Thời gian import (ms, gồm cả module con) của các module mà `module` import trực tiếp"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=here, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | <thụt lề 2 dấu cách mỗi cấp>tên module",
+        # module con được in trước module cha
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)", line)
+        if not match:
+            continue
+        depth = len(match.group(3)) // 2
+        if depth == 1:
+            rows.append((match.group(4), int(match.group(2)) / 1000))
+        elif depth == 0:
+            if match.group(4) == module:
+                rows.append((module, int(match.group(2)) / 1000))
+                break
+            rows = []  # module con của module khác (site, encodings...)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return rows
+
+
+def window_time(timeout=60):
+    """Chạy giao diện với --startup-time, trả về (thời gian đến khi cửa sổ hiện ra, tổng thời gian tiến trình)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, 'mainne.py', '--startup-time'], cwd=here,
+                            capture_output=True, text=True, timeout=timeout)
+    wall = time.perf_counter() - start
+    match = re.search(r"Khởi động: cửa sổ hiện ra sau ([\d.]+)s", result.stdout)
+    if not match:
+        raise RuntimeError((result.stderr or result.stdout).strip().splitlines()[-1])
+    return float(match.group(1)), wall
+
+
+def print_startup():
+    rows = import_times()
+    # Module chính trước, sau đó các module import trực tiếp, chậm nhất trước
+    print(f"{'Module':<32}{'Import (ms)':>12}")
+    for name, ms in rows[-1:] + sorted(rows[:-1], key=lambda r: -r[1]):
+        print(f"{name:<32}{ms:>12.1f}")
+    try:
+        shown, wall = window_time()
+    except Exception as e:
+        print(f"Không đo được thời gian hiện cửa sổ: {str(e)}")
+    else:
+        print(f"Cửa sổ hiện ra sau {shown:.3f}s (tiến trình chạy {wall:.3f}s tính cả khởi động Python)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo hiệu năng các bước xử lý")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('methods', help="so sánh các phương pháp trích xuất trên cùng một ảnh")
+    p.add_argument('image')
+    p.add_argument('--threshold', type=int, default=DEFAULTS['threshold'])
+    p.add_argument('--no-invert', dest='invert', action='store_false')
+    p.add_argument('--detail', dest='detail_level', type=float, default=DEFAULTS['detail_level'])
+
+    p = sub.add_parser('order', help="quãng đường nhấc bút trước/sau khi sắp xếp nét")
+    p.add_argument('images', nargs='*', help="ảnh (dùng tham số mặc định của batch_gcode)")
+    p.add_argument('--strokes', type=int, nargs='*', default=[], help="số nét ngẫu nhiên")
+    p.add_argument('-j', '--workers', type=int, default=None)
+
+    p = sub.add_parser('interpolate', help="tốc độ nội suy điểm: vòng lặp cũ so với numpy")
+    p.add_argument('--points', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    p.add_argument('--step', type=float, default=DEFAULTS['step_size'])
+
+    p = sub.add_parser('ik', help="tốc độ động học ngược: từng điểm so với cả mảng")
+    p.add_argument('--points', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+
+    sub.add_parser('startup', help="thời gian import từng module và thời gian đến khi cửa sổ hiện ra")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'methods':
+        options = dict(DEFAULTS, threshold=args.threshold, invert=args.invert, detail_level=args.detail_level)
+        print_methods(compare_methods(args.image, options))
+    elif args.command == 'order':
+        rows = []
+        for image_path in args.images:
+            pipeline = ExtractionPipeline()
+            img, drawing_path = pipeline.extract(image_path, DEFAULTS['threshold'], DEFAULTS['invert'],
+                                                 DEFAULTS['method'], DEFAULTS['detail_level'])
+            height, width = img.shape[:2]
+            rows.append(compare_order(robot_path_from_drawing(drawing_path, width, height, DEFAULTS), args.workers))
+        for count in args.strokes:
+            rows.append(compare_order(random_strokes(count), args.workers))
+        print_order(rows)
+    elif args.command == 'interpolate':
+        print_interpolate([compare_interpolate(n, args.step) for n in args.points])
+    elif args.command == 'ik':
+        print_ik([compare_ik(n) for n in args.points])
+    elif args.command == 'startup':
+        print_startup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Sinh G-code từ đường đi robot"""
+import numpy as np
+
+from path_buffer import pen_down_length, pen_up_length
+
+# Feedrate (tốc độ di chuyển)
+TRAVEL_SPEED = 3000  # mm/min khi di chuyển không vẽ
+DRAWING_SPEED = 4000  # mm/min khi vẽ
+PEN_TIME = 0.06  # giây cho mỗi lần nâng/hạ bút (servo_delay * 3)
+JUNCTION_DEVIATION = 0.05  # mm - độ lệch cho phép khi đi qua góc (kiểu GRBL); 0 = không giới hạn ở góc
+CORNER_ACCEL = 500.0  # mm/s^2 - gia tốc ngang dùng cho mô hình góc
+MIN_CORNER_SPEED = 1.0  # mm/s - feedrate nhỏ nhất khi ghi G-code (F0 không hợp lệ)
+FEED_STEPS = 4  # số bậc feedrate (feedrate / 2^k) khi giảm tốc vào góc
+MIN_FEED_PIECE = 0.1  # mm - không cắt đoạn con ngắn hơn khoảng này ở sát góc
+
+
+def estimate_draw_time(robot_path, drawing_speed=DRAWING_SPEED, travel_speed=TRAVEL_SPEED, pen_time=PEN_TIME):
+    """Ước lượng thời gian vẽ (giây) theo feedrate và số lần nâng/hạ bút"""
+    lifts = int((robot_path.pen != 0).sum())
+    return (pen_down_length(robot_path) / drawing_speed * 60
+            + pen_up_length(robot_path) / travel_speed * 60
+            + 2 * lifts * pen_time)
+
+
+def corner_speeds(x, y, pen, accel=CORNER_ACCEL, deviation=JUNCTION_DEVIATION):
+    """Tốc độ tối đa (mm/s) khi đi qua từng lệnh của chuỗi lệnh robot, tính cho cả mảng
+
+    Mô hình junction deviation của GRBL: ở đỉnh giữa hai đoạn vẽ hợp với nhau góc theta,
+    v^2 = accel * deviation * sin(theta/2) / (1 - sin(theta/2)) - đi thẳng không giới hạn,
+    quay ngược thì dừng. Đỉnh đổi trạng thái bút và hai đầu chuỗi lệnh có tốc độ 0, đỉnh của
+    đường bút nhấc không giới hạn (inf). Các lệnh lặp lại cùng điểm (cùng trạng thái bút) được
+    gộp lại trước, nên góc luôn đo giữa hai đoạn khác 0 gần nhất và các lệnh trùng nhận cùng tốc độ.
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    pen = np.asarray(pen)
+    if len(x) == 0:
+        return np.full(0, np.inf)
+    keep = np.r_[True, (np.diff(x) != 0) | (np.diff(y) != 0) | (pen[1:] != pen[:-1])]
+    if not keep.all():
+        return corner_speeds(x[keep], y[keep], pen[keep], accel, deviation)[np.cumsum(keep) - 1]
+    n = len(x)
+    speed = np.full(n, np.inf)
+    speed[[0, -1]] = 0.0
+    change = np.flatnonzero(pen[1:] != pen[:-1])
+    speed[change] = 0.0
+    speed[change + 1] = 0.0
+    if n < 3 or not deviation or deviation <= 0:
+        return speed
+
+    # Hướng đoạn vào và đoạn ra của các đỉnh trong
+    d = np.column_stack([np.diff(x), np.diff(y)])
+    length = np.hypot(d[:, 0], d[:, 1])
+    unit = d / np.where(length > 0, length, 1)[:, None]
+    inner = (pen[1:-1] == 1) & (pen[:-2] == 1) & (pen[2:] == 1)
+    cos_theta = -np.einsum('ij,ij->i', unit[:-1], unit[1:])
+    sin_half = np.sqrt(np.clip((1 - cos_theta) / 2, 0, 1))
+    with np.errstate(divide='ignore'):
+        limit = np.sqrt(accel * deviation * sin_half / (1 - sin_half))
+    speed[1:-1] = np.where(inner, limit, speed[1:-1])
+    return speed
+
+
+def drawing_moves(x, y, pen, drawing_speed=DRAWING_SPEED, accel=CORNER_ACCEL, deviation=JUNCTION_DEVIATION,
+                  steps=FEED_STEPS):
+    """Chia các lệnh vẽ gần góc gắt thành các đoạn con có feedrate giảm dần theo bậc
+
+    Tốc độ cho phép tại khoảng cách s từ góc là min(feedrate, sqrt(v_góc^2 + 2 accel s)) (giảm tốc
+    với gia tốc accel để đến góc đúng tốc độ qua góc). Đoạn được cắt tại chỗ tốc độ này đi qua các
+    bậc feedrate / 2^k (k < steps); mỗi đoạn con chạy với tốc độ nhỏ nhất trên nó, nên chỉ phần
+    đường sát góc bị chậm lại. Chỗ hạ/nhấc bút không tính là góc (máy tự tăng/giảm tốc từ lúc
+    đứng yên). Trả về (counts, px, py, feed): lệnh i thành counts[i] lệnh liên tiếp đến các điểm
+    (px, py) với feed (mm/min); lệnh không vẽ giữ nguyên một lệnh.
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    pen = np.asarray(pen)
+    n = len(x)
+    counts = np.ones(n, np.int64)
+    feed = np.full(n, float(drawing_speed))
+    if n < 2 or not deviation or deviation <= 0:
+        return counts, x, y, feed
+
+    v_max = drawing_speed / 60
+    speed = np.minimum(corner_speeds(x, y, pen, accel, deviation), v_max)
+    stop = np.zeros(n, bool)
+    stop[[0, -1]] = True
+    change = np.flatnonzero(pen[1:] != pen[:-1])
+    stop[change] = True
+    stop[change + 1] = True
+    speed[stop] = v_max
+    length = np.hypot(np.diff(x), np.diff(y))
+    move = np.flatnonzero((pen[1:] == 1) & (pen[:-1] == 1) & (length > 0)
+                          & (np.minimum(speed[1:], speed[:-1]) < v_max)) + 1
+    if len(move) == 0:
+        return counts, x, y, feed
+
+    # Điểm cắt trên từng đoạn (khoảng cách từ đầu đoạn): phía góc đầu và phía góc cuối
+    vs, ve, L = speed[move - 1], speed[move], length[move - 1]
+    levels = v_max / 2.0 ** np.arange(steps)
+    cut_start = (levels[None, :] ** 2 - vs[:, None] ** 2) / (2 * accel)
+    cut_end = L[:, None] - (levels[None, :] ** 2 - ve[:, None] ** 2) / (2 * accel)
+    cuts = np.hstack([cut_start, cut_end, L[:, None]])
+    cuts[~((cuts > MIN_FEED_PIECE) & (cuts < L[:, None] - MIN_FEED_PIECE))] = np.nan
+    cuts[:, -1] = L
+    cuts = np.sort(cuts, axis=1)
+    prev = np.hstack([np.zeros((len(move), 1)), cuts[:, :-1]])
+    keep = ~np.isnan(cuts) & ((cuts - prev > 1e-6) | (cuts == L[:, None]))
+
+    # Tốc độ nhỏ nhất trên mỗi đoạn con nằm ở một trong hai đầu
+    def allowed(s):
+        return np.minimum(np.sqrt(vs[:, None] ** 2 + 2 * accel * s),
+                          np.sqrt(ve[:, None] ** 2 + 2 * accel * np.maximum(L[:, None] - s, 0)))
+    piece_speed = np.minimum(allowed(np.nan_to_num(prev)), allowed(np.nan_to_num(cuts)))
+    piece_feed = np.clip(piece_speed * 60, MIN_CORNER_SPEED * 60, drawing_speed)
+    t = (cuts / L[:, None])[keep]
+    owner = np.repeat(move, keep.sum(axis=1))
+    counts[move] = keep.sum(axis=1)
+
+    # Ghép: lệnh không bị chia giữ điểm của nó, lệnh bị chia thay bằng các điểm cắt
+    total = int(counts.sum())
+    first = np.cumsum(counts) - counts
+    px, py = np.empty(total), np.empty(total)
+    out_feed = np.full(total, float(drawing_speed))
+    single = np.ones(n, bool)
+    single[move] = False
+    px[first[single]], py[first[single]] = x[single], y[single]
+    slots = np.repeat(first[move], counts[move]) + (np.arange(len(owner)) - np.repeat(
+        np.cumsum(counts[move]) - counts[move], counts[move]))
+    px[slots] = x[owner - 1] + t * (x[owner] - x[owner - 1])
+    py[slots] = y[owner - 1] + t * (y[owner] - y[owner - 1])
+    out_feed[slots] = piece_feed[keep]
+    return counts, px, py, out_feed
+
+
+def generate_gcode(robot_path, accel=CORNER_ACCEL, deviation=JUNCTION_DEVIATION):
+    """Tạo G-code từ đường đi robot (PathBuffer)
+
+    Đoạn vẽ sát góc gắt được chia và ghi kèm feedrate thấp hơn theo bậc (drawing_moves); F chỉ
+    được ghi khi thay đổi.
+    """
+    gcode = []
+
+    # Thêm tiêu đề và các lệnh khởi tạo
+    gcode.append("; Generated G-code for drawing")
+    gcode.append("; Created by Robot Drawing Controller")
+    gcode.append("G21 ; Set units to millimeters")
+    gcode.append("G90 ; Use absolute coordinates")
+    gcode.append("G92 X0 Y0 Z0 ; Reset position")
+    gcode.append("G0 Z5 ; Lift pen to safe height")
+    gcode.append("G0 X0 Y0 ; Move to home position")
+
+    travel_speed = TRAVEL_SPEED
+    drawing_speed = DRAWING_SPEED
+
+    pen_up_position = 5  # mm
+    pen_down_position = 0  # mm
+
+    prev_pen_state = 0  # Bắt đầu với bút lên
+
+    commands = robot_path.commands()
+    counts, px, py, feeds = drawing_moves(commands[:, 0], commands[:, 1], commands[:, 2], drawing_speed,
+                                          accel, deviation)
+    moves = list(zip(px.tolist(), py.tolist(), np.rint(feeds).astype(np.int64).tolist()))
+    k = 0
+    feed = drawing_speed
+    for pen_state, count in zip(commands[:, 2].astype(np.int64).tolist(), counts.tolist()):
+        # Nếu trạng thái bút thay đổi
+        if pen_state != prev_pen_state:
+            if pen_state == 1:  # Hạ bút xuống
+                gcode.append(f"G0 Z{pen_down_position} ; Lower pen")
+                gcode.append(f"G1 F{drawing_speed} ; Set drawing speed")
+                feed = drawing_speed
+            else:  # Nâng bút lên
+                gcode.append(f"G0 Z{pen_up_position} ; Lift pen")
+                gcode.append(f"G0 F{travel_speed} ; Set travel speed")
+            prev_pen_state = pen_state
+
+        # Lệnh di chuyển
+        for x, y, f in moves[k:k + count]:
+            if pen_state == 1:
+                # Bút xuống - vẽ đường (chậm lại khi vào/ra góc gắt)
+                if f != feed:
+                    gcode.append(f"G1 X{x:.2f} Y{y:.2f} F{f}")
+                    feed = f
+                else:
+                    gcode.append(f"G1 X{x:.2f} Y{y:.2f}")
+            else:
+                # Bút lên - di chuyển
+                gcode.append(f"G0 X{x:.2f} Y{y:.2f}")
+        k += count
+
+    # Kết thúc với bút lên và về home
+    gcode.append("G0 Z5 ; Lift pen to safe height")
+    gcode.append("G0 X0 Y0 ; Return to home position")
+
+    return gcode
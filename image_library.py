@@ -0,0 +1,226 @@
+"""Chỉ mục thư mục ảnh (tên file, kích thước, mtime, hash nội dung) và cache ảnh thu nhỏ trên đĩa
+
+Mỗi lần làm mới chỉ đọc lại thông tin os.scandir; ảnh không đổi kích thước/mtime giữ
+nguyên hash và ảnh thu nhỏ. Ảnh thu nhỏ đặt tên theo hash nội dung nên đổi tên hoặc sao
+chép file không phải tạo lại, và được tạo trên các luồng nền (cv2 nhả GIL khi giải mã).
+"""
+import os
+import json
+import threading
+from collections import deque
+
+import cv2
+
+from path_cache import hash_file
+from image_pipeline import decode_reduced
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif']
+THUMB_SIZE = 250
+
+
+def make_thumbnail(img, size=THUMB_SIZE):
+    """Ảnh thu nhỏ size x size từ ảnh xám đã giải mã (có thể là memory-map)"""
+    return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def decode_for_thumbnail(image_path, size=THUMB_SIZE):
+    """Giải mã ảnh xám vừa đủ lớn để làm ảnh thu nhỏ"""
+    try:
+        img, _ = decode_reduced(image_path, size * 2)
+        return img
+    except ValueError:
+        # cv2 không đọc được một số định dạng (GIF) - dùng PIL
+        import numpy as np
+        from PIL import Image
+
+        with Image.open(image_path) as pil_img:
+            pil_img.thumbnail((size * 2, size * 2))
+            return np.asarray(pil_img.convert("L"))
+
+
+class ImageLibrary:
+    """Danh sách ảnh trong thư mục, làm mới tăng dần, kèm ảnh thu nhỏ tạo ở nền"""
+
+    def __init__(self, folder='.', cache_dir=None, thumb_size=THUMB_SIZE, hasher=hash_file, workers=2,
+                 on_thumbnail=None):
+        self.folder = folder
+        self.cache_dir = cache_dir
+        self.thumb_size = thumb_size
+        self.hasher = hasher
+        self.workers = workers
+        self.on_thumbnail = on_thumbnail  # gọi (tên ảnh, file ảnh thu nhỏ) từ luồng nền
+
+        self._entries = {}  # tên file -> [size, mtime_ns, hash hoặc None]
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._queued = set()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._dirty = False
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    # ===== Chỉ mục =====
+    def _index_file(self):
+        return os.path.join(self.cache_dir, "index.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_file(), encoding='utf-8') as f:
+                data = json.load(f)
+            if os.path.abspath(self.folder) == data.get('folder'):
+                self._entries = {name: list(entry) for name, entry in data['entries'].items()}
+        except (OSError, ValueError, KeyError):
+            self._entries = {}
+
+    def save_index(self):
+        """Ghi chỉ mục ra đĩa nếu có thay đổi"""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'folder': os.path.abspath(self.folder), 'entries': dict(self._entries)}
+            self._dirty = False
+        tmp_path = self._index_file() + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._index_file())
+        except OSError as e:
+            print(f"Không ghi được chỉ mục ảnh: {str(e)}")
+
+    def refresh(self):
+        """Quét lại thư mục, chỉ cập nhật file mới/thay đổi; trả về danh sách tên ảnh đã sắp xếp"""
+        found = {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                found[entry.name] = (st.st_size, st.st_mtime_ns)
+
+        with self._lock:
+            for name in list(self._entries):
+                if name not in found:
+                    del self._entries[name]
+                    self._dirty = True
+            for name, (size, mtime) in found.items():
+                old = self._entries.get(name)
+                if old is None or old[0] != size or old[1] != mtime:
+                    # File mới hoặc đã sửa: hash (và ảnh thu nhỏ) tính lại khi cần
+                    self._entries[name] = [size, mtime, None]
+                    self._dirty = True
+            names = sorted(self._entries)
+
+        self.save_index()
+        return names
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def image_hash(self, name):
+        """Hash nội dung ảnh (tính một lần rồi lưu trong chỉ mục)"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[2]:
+                return entry[2]
+        digest = self.hasher(self.path(name))
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[2] != digest:
+                entry[2] = digest
+                self._dirty = True
+        return digest
+
+    # ===== Ảnh thu nhỏ =====
+    def _thumb_file(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}_{self.thumb_size}.png")
+
+    def thumbnail_path(self, name):
+        """File ảnh thu nhỏ đã có trên đĩa, hoặc None (không đọc lại nội dung ảnh)"""
+        if not self.cache_dir:
+            return None
+        with self._lock:
+            entry = self._entries.get(name)
+            digest = entry[2] if entry is not None else None
+        if digest is None:
+            return None
+        thumb = self._thumb_file(digest)
+        return thumb if os.path.exists(thumb) else None
+
+    def save_thumbnail(self, name, img):
+        """Tạo ảnh thu nhỏ từ ảnh đã giải mã sẵn (tránh giải mã lần nữa); trả về đường dẫn file"""
+        if not self.cache_dir:
+            return None
+        thumb = self._thumb_file(self.image_hash(name))
+        if not os.path.exists(thumb):
+            tmp_path = thumb + ".tmp.png"
+            cv2.imwrite(tmp_path, make_thumbnail(img, self.thumb_size))
+            os.replace(tmp_path, thumb)
+        return thumb
+
+    def request_thumbnail(self, name, urgent=False):
+        """Xếp ảnh vào hàng đợi tạo ảnh thu nhỏ; urgent: xử lý trước các ảnh khác"""
+        if not self.cache_dir:
+            return
+        with self._wakeup:
+            if name in self._queued:
+                if urgent:
+                    self._pending.remove(name)
+                    self._pending.appendleft(name)
+                return
+            self._queued.add(name)
+            if urgent:
+                self._pending.appendleft(name)
+            else:
+                self._pending.append(name)
+            self._start_workers()
+            self._wakeup.notify()
+
+    def request_missing(self):
+        """Tạo ảnh thu nhỏ ở nền cho mọi ảnh chưa có"""
+        with self._lock:
+            names = sorted(self._entries)
+        for name in names:
+            if self.thumbnail_path(name) is None:
+                self.request_thumbnail(name)
+
+    def _start_workers(self):
+        # Gọi khi đang giữ khóa
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                if not self._pending:
+                    # Hết việc: lưu chỉ mục (hash mới) rồi dừng luồng sau một lúc chờ
+                    self._wakeup.wait(timeout=5.0)
+                    if not self._pending:
+                        self._threads.remove(threading.current_thread())
+                        break
+                name = self._pending.popleft()
+                self._queued.discard(name)
+
+            thumb = self.thumbnail_path(name)
+            try:
+                if thumb is None and os.path.exists(self.path(name)):
+                    img = decode_for_thumbnail(self.path(name), self.thumb_size)
+                    thumb = self.save_thumbnail(name, img)
+            except Exception as e:
+                print(f"Không tạo được ảnh thu nhỏ {name}: {str(e)}")
+                continue
+            if thumb is not None and self.on_thumbnail is not None:
+                self.on_thumbnail(name, thumb)
+        self.save_index()
@@ -0,0 +1,481 @@
+"""Pipeline trích xuất đường nét theo từng giai đoạn, giữ lại kết quả trung gian"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+from path_buffer import PathBuffer, simplify_strokes
+
+METHODS = ["contour", "canny", "adaptive", "skeleton"]
+# Các phương pháp dùng ngưỡng toàn cục (được thử lại với ngưỡng thấp hơn nếu không ra nét)
+GLOBAL_THRESHOLD_METHODS = ("contour", "skeleton")
+THRESHOLD_MODES = ["manual", "otsu", "triangle", "fraction"]
+# "arc": sai số theo tỉ lệ chu vi (mức chi tiết); "mm": sai số tuyệt đối theo mm trên giấy
+SIMPLIFY_MODES = ["arc", "mm"]
+REDUCED_FLAGS = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def image_size(image_path):
+    """(rộng, cao) của ảnh, chỉ đọc phần header của file"""
+    # PIL chỉ cần cho việc đọc header, import khi dùng để không làm chậm khởi động
+    from PIL import Image
+
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None  # ảnh poster có thể vượt giới hạn chống "decompression bomb"
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def decode_reduced(image_path, max_side):
+    """Đọc ảnh xám thu nhỏ sao cho cạnh dài không quá max_side (mức kim tự tháp)
+
+    Trả về (ảnh thu nhỏ, kích thước ảnh gốc (cao, rộng)).
+    """
+    width, height = image_size(image_path)
+    # Để bộ giải mã thu nhỏ sẵn (nhanh với JPEG), phần còn lại dùng pyrDown
+    factor = 1
+    while factor < 8 and max(width, height) / (factor * 2) >= max_side:
+        factor *= 2
+    img = cv2.imread(image_path, REDUCED_FLAGS[factor])
+    if img is None:
+        raise ValueError(f"Không thể đọc ảnh: {image_path}")
+    while max(img.shape) > max_side:
+        img = cv2.pyrDown(img)
+    return img, (height, width)
+
+
+def gray_histogram(img):
+    """Histogram 256 mức xám của ảnh"""
+    return cv2.calcHist([img], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+
+
+def foreground_counts(hist, invert):
+    """Số điểm ảnh tiền cảnh cho mọi ngưỡng 0..255 (một phép cumsum)"""
+    below = np.cumsum(hist)  # số điểm ảnh có giá trị <= t
+    return below if invert else below[-1] - below
+
+
+def otsu_threshold(hist):
+    """Ngưỡng Otsu: cực đại phương sai giữa hai lớp"""
+    p = hist / max(hist.sum(), 1)
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_b = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    return int(np.argmax(np.nan_to_num(sigma_b)))
+
+
+def triangle_threshold(hist):
+    """Ngưỡng tam giác: điểm xa nhất so với đường nối đỉnh histogram và đuôi dài hơn"""
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) == 0:
+        return 128
+    left, right = nonzero[0], nonzero[-1]
+    peak = int(np.argmax(hist))
+    end = right if right - peak > peak - left else left
+    if end == peak:
+        return peak
+    xs = np.arange(min(peak, end), max(peak, end) + 1)
+    # Khoảng cách (chưa chuẩn hóa) từ các cột histogram tới đường thẳng (peak, hmax) - (end, 0)
+    dist = np.abs(hist[peak] * (xs - end) + (end - peak) * hist[xs])
+    return int(xs[np.argmax(dist)])
+
+
+def fraction_threshold(hist, invert, target_fraction):
+    """Ngưỡng cho tỉ lệ điểm ảnh tiền cảnh gần với target_fraction nhất"""
+    fraction = foreground_counts(hist, invert) / max(hist.sum(), 1)
+    return int(np.argmin(np.abs(fraction - target_fraction)))
+
+
+def enhance_image(img):
+    """Làm mịn và tăng cường cạnh trước khi phân ngưỡng"""
+    # Áp dụng bộ lọc khử nhiễu (làm mịn)
+    img_blur = cv2.GaussianBlur(img, (5, 5), 0)
+    # Áp dụng bộ lọc tăng cường cạnh trước khi phân ngưỡng
+    img_enhanced = cv2.Laplacian(img_blur, cv2.CV_8U, ksize=3)
+    return cv2.addWeighted(img_blur, 0.7, img_enhanced, 0.3, 0)
+
+
+def binarize_image(img_blur, method, threshold, invert):
+    """Phân ngưỡng / tìm cạnh theo phương pháp đã chọn"""
+    if method in GLOBAL_THRESHOLD_METHODS:
+        mode = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
+        _, binary = cv2.threshold(img_blur, threshold, 255, mode)
+        return binary
+    if method == "canny":
+        return cv2.Canny(img_blur, threshold, threshold * 2)
+    if method == "adaptive":
+        # Phương pháp ngưỡng thích ứng
+        block_size = 11  # Kích thước block - cần là số lẻ
+        C = 2  # Hằng số hiệu chỉnh
+        mode = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
+        return cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, mode, block_size, C)
+    raise ValueError(f"Phương pháp không hợp lệ: {method}")
+
+
+def morphology_image(binary, method):
+    """Nối các nét gần nhau (đóng cho ảnh nhị phân, giãn nở cho cạnh Canny)"""
+    kernel = np.ones((2, 2), np.uint8)
+    if method == "canny":
+        return cv2.dilate(binary, kernel, iterations=1)
+    return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+
+
+def _zhang_suen_tables():
+    """Bảng tra 256 phần tử cho hai bước Zhang-Suen: điểm có mã lân cận (bit k = P(k+2)) bị xóa hay không"""
+    ring = (np.arange(256)[:, None] >> np.arange(8)) & 1
+    # Số lân cận và số lần chuyển 0 -> 1 theo vòng P2..P9, P2
+    neighbours = ring.sum(axis=1)
+    transitions = ((ring == 0) & (np.roll(ring, -1, axis=1) == 1)).sum(axis=1)
+    P2, P3, P4, P5, P6, P7, P8, P9 = ring.T
+    base = (neighbours >= 2) & (neighbours <= 6) & (transitions == 1)
+    return (base & (P2 * P4 * P6 == 0) & (P4 * P6 * P8 == 0),
+            base & (P2 * P4 * P8 == 0) & (P2 * P6 * P8 == 0))
+
+
+ZHANG_SUEN_REMOVE = _zhang_suen_tables()
+
+
+def thin_image(binary):
+    """Làm mảnh ảnh nhị phân thành đường tâm rộng 1 điểm ảnh (Zhang-Suen)"""
+    if hasattr(cv2, 'ximgproc'):
+        # Có opencv-contrib: dùng bản cài đặt C++
+        return cv2.ximgproc.thinning(binary, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN)
+
+    out = np.zeros(binary.shape, np.uint8)
+    ys, xs = np.nonzero(binary)
+    if len(ys) == 0:
+        return out
+    # Chỉ xử lý khung bao quanh tiền cảnh, dạng mảng phẳng để lấy 8 lân cận bằng độ lệch chỉ số
+    y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+    img = np.pad((binary[y0:y1, x0:x1] > 0).astype(np.uint8), 1)
+    flat = img.ravel()
+    width = img.shape[1]
+    index_type = np.int32 if flat.size < 2 ** 31 else np.int64
+    # 8 điểm lân cận P2..P9 theo chiều kim đồng hồ bắt đầu từ phía trên
+    ring_offsets = np.array([-width, -width + 1, 1, width + 1, width, width - 1, -1, -width - 1], index_type)
+    # Mỗi bước chỉ xét lại các điểm có lân cận đã thay đổi từ lần xét trước ở bước đó: các điểm
+    # khác cho cùng kết quả như lần trước (không bị xóa), nên kết quả giống hệt quét toàn ảnh
+    dirty = [flat == 1, flat == 1]
+    changed = True
+    while changed:
+        changed = False
+        for step in (0, 1):
+            candidates = np.flatnonzero(dirty[step] & (flat == 1)).astype(index_type)
+            dirty[step][:] = False
+            codes = np.zeros(len(candidates), np.uint8)
+            for bit, offset in enumerate(ring_offsets):
+                codes |= flat[candidates + offset] << bit
+            removed = candidates[ZHANG_SUEN_REMOVE[step][codes]]
+            if len(removed):
+                flat[removed] = 0
+                touched = (removed[:, None] + ring_offsets).ravel()
+                dirty[0][touched] = True
+                dirty[1][touched] = True
+                changed = True
+    out[y0:y1, x0:x1] = img[1:-1, 1:-1] * 255
+    return out
+
+
+def trace_skeleton(skeleton, min_length=5):
+    """Dò đường tâm thành các polyline hở (và vòng khép kín)
+
+    Trả về (danh sách mảng điểm (n, 2) dạng x, y; danh sách cờ khép kín), sắp xếp
+    từ dài đến ngắn.
+    """
+    height, width = skeleton.shape
+    ys, xs = np.nonzero(skeleton)
+    num = len(xs)
+    if num == 0:
+        return [], []
+
+    # Bảng chỉ số lân cận của từng điểm (-1 nếu không có); lân cận 4 hướng đứng trước
+    # để đường đi bám theo bậc thang thay vì cắt chéo
+    ids = np.full((height + 2, width + 2), -1, np.int64)
+    ids[ys + 1, xs + 1] = np.arange(num)
+    offsets = [(-1, 0), (0, 1), (1, 0), (0, -1), (-1, -1), (-1, 1), (1, 1), (1, -1)]
+    table = np.stack([ids[ys + 1 + dy, xs + 1 + dx] for dy, dx in offsets], axis=1)
+    degree = (table >= 0).sum(axis=1)
+    neighbours = table.tolist()
+
+    visited = bytearray(num)
+    polylines, closed = [], []
+
+    def walk(start):
+        path = [start]
+        visited[start] = 1
+        cur = start
+        while True:
+            nxt = -1
+            for cand in neighbours[cur]:
+                if cand >= 0 and not visited[cand]:
+                    nxt = cand
+                    break
+            if nxt < 0:
+                break
+            visited[nxt] = 1
+            path.append(nxt)
+            cur = nxt
+
+        # Nối vào điểm rẽ nhánh đã đi qua để không bị hở ở chỗ giao nhau
+        for cand in neighbours[cur]:
+            if cand >= 0 and cand != start and degree[cand] >= 3 and cand not in path[-3:]:
+                path.append(cand)
+                break
+        return path
+
+    # Bắt đầu từ đầu mút, sau đó từ điểm rẽ nhánh, cuối cùng là các vòng kín còn lại
+    starts = list(np.flatnonzero(degree == 1)) + list(np.flatnonzero(degree >= 3)) + list(range(num))
+    for start in starts:
+        if visited[start] and degree[start] < 3:
+            continue
+        while True:
+            if not any(c >= 0 and not visited[c] for c in neighbours[start]) and visited[start]:
+                break
+            path = walk(start)
+            if len(path) < 2:
+                break
+            is_closed = len(path) > 2 and start in neighbours[path[-1]]
+            if len(path) >= min_length:
+                polylines.append(np.stack([xs[path], ys[path]], axis=1).astype(np.int32))
+                closed.append(is_closed)
+
+    order = sorted(range(len(polylines)), key=lambda i: len(polylines[i]), reverse=True)
+    return [polylines[i] for i in order], [closed[i] for i in order]
+
+
+def simplify_contours(contours, detail_level, closed=None, tolerance=None):
+    """Đơn giản hóa các contour và ghép thành PathBuffer
+
+    tolerance (điểm ảnh): nếu có, dùng Douglas-Peucker với sai số tuyệt đối cho mọi nét
+    thay vì approxPolyDP với sai số tỉ lệ theo chu vi từng contour.
+    """
+    if tolerance is not None:
+        strokes = PathBuffer.from_strokes([c.reshape(-1, 2) for c in contours], closed=closed)
+        return simplify_strokes(strokes, tolerance)
+
+    # Detail level ảnh hưởng đến epsilon trong approxPolyDP
+    epsilon_factor = 0.03 / detail_level  # Càng nhỏ càng chi tiết
+    strokes = []
+    for i, contour in enumerate(contours):
+        is_closed = True if closed is None else bool(closed[i])
+        epsilon = epsilon_factor * cv2.arcLength(contour, is_closed)
+        strokes.append(cv2.approxPolyDP(contour, epsilon, is_closed).reshape(-1, 2))
+    return PathBuffer.from_strokes(strokes, closed=closed)
+
+
+def pick_threshold(hist, mode, invert, target_fraction=0.1):
+    """Chọn ngưỡng tự động từ histogram"""
+    if mode == "otsu":
+        return otsu_threshold(hist)
+    if mode == "triangle":
+        return triangle_threshold(hist)
+    if mode == "fraction":
+        return fraction_threshold(hist, invert, target_fraction)
+    raise ValueError(f"Chế độ chọn ngưỡng không hợp lệ: {mode}")
+
+
+def fallback_thresholds(hist, threshold, invert, min_pixels):
+    """Các ngưỡng thử lại (threshold - 30, - 60, ... khi ngưỡng trước > 50), bỏ qua
+    những ngưỡng mà histogram cho thấy không đủ điểm tiền cảnh"""
+    candidates = []
+    t = threshold
+    while t > 50:
+        t -= 30
+        candidates.append(t)
+    if not candidates:
+        return []
+    candidates = np.array(candidates)
+    counts = foreground_counts(hist, invert)[np.clip(candidates, 0, 255)]
+    total = hist.sum()
+    useful = (counts >= min_pixels) & (counts <= total - min_pixels)
+    return [int(t) for t in candidates[useful]]
+
+
+class ExtractionPipeline:
+    """decode -> enhance -> binarize -> morphology -> contours -> simplify
+
+    Mỗi giai đoạn lưu lại (khóa, kết quả). Khóa của một giai đoạn gồm khóa của
+    giai đoạn trước và các tham số của riêng nó, nên chỉ những giai đoạn có đầu
+    vào thay đổi mới phải tính lại.
+    """
+
+    def __init__(self, min_contour_area=10, min_skeleton_length=5, max_side=None):
+        self.min_contour_area = min_contour_area
+        self.min_skeleton_length = min_skeleton_length
+        # max_side: chạy trên ảnh thu nhỏ (xem trước nhanh), tọa độ trả về vẫn theo ảnh gốc
+        self.max_side = max_side
+        self.full_shape = None  # kích thước (cao, rộng) của ảnh gốc
+        self._stages = {}
+        self.timings = {}  # thời gian chạy gần nhất của từng giai đoạn (giây)
+        self.recomputed = []  # các giai đoạn phải tính lại ở lần chạy gần nhất
+        self.threshold_info = {}  # ngưỡng đã chọn và thời gian tìm ngưỡng ở lần chạy gần nhất
+
+    def _run(self, name, key, compute):
+        """Trả về kết quả đã lưu nếu khóa không đổi, nếu không thì tính lại"""
+        stored = self._stages.get(name)
+        if stored is not None and stored[0] == key:
+            return stored[1]
+        start = time.perf_counter()
+        value = compute()
+        self.timings[name] = time.perf_counter() - start
+        self.recomputed.append(name)
+        self._stages[name] = (key, value)
+        return value
+
+    def reset(self):
+        """Xóa toàn bộ kết quả trung gian"""
+        self._stages.clear()
+
+    # ===== Các giai đoạn =====
+    def decode(self, image_path):
+        """Đọc ảnh xám, chỉ đọc lại khi file thay đổi"""
+        st = os.stat(image_path)
+        key = (os.path.abspath(image_path), st.st_size, st.st_mtime_ns, self.max_side)
+
+        def compute():
+            if self.max_side:
+                return decode_reduced(image_path, self.max_side)
+            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise ValueError(f"Không thể đọc ảnh: {image_path}")
+            return img, img.shape[:2]
+
+        img, self.full_shape = self._run('decode', key, compute)
+        return key, img
+
+    def to_full_resolution(self, img, drawing_path):
+        """Đổi tọa độ từ ảnh thu nhỏ về ảnh gốc"""
+        if not self.max_side or self.full_shape == img.shape[:2]:
+            return drawing_path
+        sy = self.full_shape[0] / img.shape[0]
+        sx = self.full_shape[1] / img.shape[1]
+        return drawing_path.with_coords(drawing_path.coords * np.array([sx, sy], np.float32))
+
+    def enhance(self, decode_key, img):
+        """Làm mịn và tăng cường cạnh - chỉ phụ thuộc vào ảnh"""
+        return decode_key, self._run('enhance', decode_key, lambda: enhance_image(img))
+
+    def histogram(self, enhance_key, img_blur):
+        """Histogram của ảnh đã làm mịn - tính một lần cho mỗi ảnh"""
+        return enhance_key, self._run('histogram', enhance_key, lambda: gray_histogram(img_blur))
+
+    def binarize(self, enhance_key, img_blur, method, threshold, invert):
+        """Phân ngưỡng / tìm cạnh theo phương pháp đã chọn"""
+        # Chỉ đưa vào khóa những tham số mà phương pháp thực sự dùng
+        if method in GLOBAL_THRESHOLD_METHODS:
+            key = (enhance_key, method, threshold, invert)
+        elif method == "canny":
+            key = (enhance_key, method, threshold)
+        elif method == "adaptive":
+            key = (enhance_key, method, invert)
+        else:
+            raise ValueError(f"Phương pháp không hợp lệ: {method}")
+
+        return key, self._run('binarize', key, lambda: binarize_image(img_blur, method, threshold, invert))
+
+    def morphology(self, binarize_key, binary, method):
+        """Nối các nét gần nhau (đóng cho ảnh nhị phân, giãn nở cho cạnh Canny)"""
+        return binarize_key, self._run('morphology', binarize_key, lambda: morphology_image(binary, method))
+
+    def contours(self, morphology_key, binary, method):
+        """Tìm contour (hoặc đường tâm với "skeleton"), bỏ nét quá nhỏ và sắp xếp từ lớn đến nhỏ
+
+        Trả về (danh sách nét, danh sách cờ khép kín hoặc None nếu tất cả đều khép kín).
+        """
+        def compute():
+            if method == "skeleton":
+                return trace_skeleton(thin_image(binary), self.min_skeleton_length)
+            # Tìm tất cả các contour, bao gồm cả contour bên trong
+            contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            areas = [cv2.contourArea(c) for c in contours]
+            order = sorted(range(len(contours)), key=lambda i: areas[i], reverse=True)
+            return [contours[i] for i in order if areas[i] >= self.min_contour_area], None
+
+        return morphology_key, self._run('contours', morphology_key, compute)
+
+    def simplify(self, contours_key, contours, detail_level, tolerance=None):
+        """Đơn giản hóa contour và ghép thành PathBuffer"""
+        key = (contours_key, detail_level if tolerance is None else ('tolerance', tolerance))
+        strokes, closed = contours
+
+        return key, self._run('simplify', key, lambda: simplify_contours(strokes, detail_level, closed, tolerance))
+
+    def image_tolerance(self, img, tolerance):
+        """Đổi sai số từ điểm ảnh gốc sang điểm ảnh của ảnh đã đọc (có thể đã thu nhỏ)"""
+        if tolerance is None:
+            return None
+        return tolerance * max(img.shape[:2]) / max(self.full_shape)
+
+    # ===== Chạy toàn bộ pipeline =====
+    def _trace(self, enhance_key, img_blur, threshold, invert, method, detail_level, tolerance=None):
+        key, binary = self.binarize(enhance_key, img_blur, method, threshold, invert)
+        key, binary = self.morphology(key, binary, method)
+        key, contours = self.contours(key, binary, method)
+        _, drawing_path = self.simplify(key, contours, detail_level, tolerance)
+        return drawing_path
+
+    def run(self, image_path, threshold=128, invert=True, method="contour", detail_level=2.0, tolerance=None):
+        """Chạy pipeline, chỉ tính lại các giai đoạn có đầu vào thay đổi"""
+        self.recomputed = []
+        key, img = self.decode(image_path)
+        key, img_blur = self.enhance(key, img)
+        drawing_path = self._trace(key, img_blur, threshold, invert, method, detail_level,
+                                   self.image_tolerance(img, tolerance))
+        return img, self.to_full_resolution(img, drawing_path)
+
+    def extract(self, image_path, threshold=128, invert=True, method="contour", detail_level=2.0,
+                threshold_mode="manual", target_fraction=0.1, tolerance=None):
+        """Trích xuất đường nét; ngưỡng có thể chọn tự động từ histogram
+
+        Với chế độ "manual", nếu không tìm thấy đường nét thì thử các ngưỡng thấp hơn,
+        nhưng dùng lại ảnh đã làm mịn và loại trước các ngưỡng vô ích bằng histogram
+        thay vì chạy lại toàn bộ pipeline.
+
+        tolerance: sai số đơn giản hóa tuyệt đối (điểm ảnh của ảnh gốc); None thì dùng detail_level.
+        """
+        self.recomputed = []
+        key, img = self.decode(image_path)
+        key, img_blur = self.enhance(key, img)
+        tolerance = self.image_tolerance(img, tolerance)
+
+        start = time.perf_counter()
+        chosen = threshold
+        if threshold_mode != "manual" and method != "adaptive":
+            _, hist = self.histogram(key, img_blur)
+            chosen = pick_threshold(hist, threshold_mode, invert, target_fraction)
+        search_time = time.perf_counter() - start
+
+        drawing_path = self._trace(key, img_blur, chosen, invert, method, detail_level, tolerance)
+        tried = [chosen]
+
+        # Đảm bảo có đường nét để vẽ
+        if not drawing_path and method in GLOBAL_THRESHOLD_METHODS and threshold_mode == "manual":
+            start = time.perf_counter()
+            _, hist = self.histogram(key, img_blur)
+            for candidate in fallback_thresholds(hist, chosen, invert, self.min_contour_area):
+                print("Thử lại với ngưỡng thấp hơn:", candidate)
+                tried.append(candidate)
+                drawing_path = self._trace(key, img_blur, candidate, invert, method, detail_level, tolerance)
+                if drawing_path:
+                    chosen = candidate
+                    break
+            search_time += time.perf_counter() - start
+
+        self.threshold_info = {
+            'mode': threshold_mode,
+            'requested': threshold,
+            'chosen': chosen,
+            'tried': tried,
+            'seconds': search_time,
+        }
+
+        if not drawing_path:
+            raise ValueError("Không thể trích xuất đường nét từ ảnh. Hãy thử điều chỉnh ngưỡng hoặc phương pháp.")
+
+        return img, self.to_full_resolution(img, drawing_path)
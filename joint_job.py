@@ -0,0 +1,123 @@
+"""Chương trình vẽ đã dịch sang không gian khớp, tính xong trước khi robot bắt đầu chạy
+
+Vòng lặp điều khiển chỉ đọc lần lượt các bước đã chuẩn bị sẵn (góc khớp, trạng thái bút,
+có phải di chuyển dài hay không, thời điểm bắt đầu và thời gian của từng đoạn theo kế hoạch
+chuyển động), không còn tính toán xen giữa các lệnh gửi qua cổng serial.
+"""
+import numpy as np
+
+from kinematics import inverse_kinematics, forward_kinematics, choose_elbows, joint_travel, subdivide_joint_path, ELBOW_DOWN
+from motion_planner import plan_moves, MAX_JOINT_SPEED, MAX_JOINT_ACCEL, PEN_TIME
+from gcode import corner_speeds, DRAWING_SPEED, CORNER_ACCEL, JUNCTION_DEVIATION
+
+LONG_MOVE = 20.0  # mm - di chuyển nhấc bút xa hơn khoảng này được chia nhỏ thành animation
+HOME_ANGLES = (0.0, 0.0)  # góc khớp lúc bắt đầu (sau lệnh HOME)
+
+
+class JointJob:
+    """Mọi lệnh của một đường đi robot, dạng mảng theo thứ tự lệnh
+
+    path      : PathBuffer được vẽ - đường đi nguồn, hoặc bản đã chia nhỏ nếu có tolerance
+    x, y      : float64 (M,) - tọa độ đích (mm)
+    pen       : uint8 (M,)   - trạng thái bút
+    theta1/2  : float64 (M,) - góc khớp (độ), NaN nếu ngoài tầm với
+    elbow     : int8 (M,)    - cấu hình khuỷu (ELBOW_DOWN/ELBOW_UP), không đổi trong một nét
+    reachable : bool (M,)    - lệnh được thực hiện; lệnh ngoài tầm với bị bỏ qua
+    delta1/2  : float64 (M,) - độ thay đổi góc so với lệnh được thực hiện trước đó
+    long_move : bool (M,)    - di chuyển nhấc bút dài (tính từ lệnh được thực hiện trước đó)
+    start     : float64 (M,) - thời điểm bắt đầu đi đến lệnh này (giây từ lúc bắt đầu), NaN nếu bỏ qua
+    duration  : float64 (M,) - thời gian đi đến lệnh này theo kế hoạch (giây); sau lệnh nâng/hạ
+                bút, lệnh kế tiếp bắt đầu sau thêm pen_time
+    total_time: thời gian vẽ dự kiến (giây)
+    travel, travel_down : tổng quãng quay khớp (độ) của job và khi luôn dùng khuỷu xuống
+
+    auto_elbow: chọn cấu hình khuỷu cho từng nét để giảm quãng quay khớp; False = luôn khuỷu xuống.
+    tolerance : (mm) chia nhỏ các đoạn vẽ mà nội suy theo góc khớp làm cong quá khoảng này
+    (kinematics.subdivide_joint_path); None = giữ nguyên đường đi.
+    max_speed, max_accel: giới hạn tốc độ (độ/giây) và gia tốc (độ/giây^2) của từng khớp.
+    drawing_speed (mm/min), corner_accel, deviation: khi vẽ, đầu bút không vượt feedrate vẽ và
+    tốc độ qua góc kiểu junction deviation (gcode.corner_speeds) như trong G-code.
+    """
+
+    def __init__(self, path, L1, L2, long_move=LONG_MOVE, home=HOME_ANGLES, auto_elbow=True, tolerance=None,
+                 max_speed=MAX_JOINT_SPEED, max_accel=MAX_JOINT_ACCEL, pen_time=PEN_TIME,
+                 drawing_speed=DRAWING_SPEED, corner_accel=CORNER_ACCEL, deviation=JUNCTION_DEVIATION):
+        commands = path.commands().astype(np.float64)
+        x, y = commands[:, 0], commands[:, 1]
+        theta1, theta2, _ = inverse_kinematics(x, y, L1, L2)
+        self.travel_down = joint_travel(theta1, theta2, home)
+        command_lengths = np.diff(path.command_starts())
+        if auto_elbow:
+            # Đổi cấu hình chỉ giữa hai nét: nhóm theo nét của từng lệnh
+            groups = np.repeat(np.arange(path.num_strokes), command_lengths)
+            theta1, theta2, _, elbow = choose_elbows(x, y, groups, L1, L2, home)
+            self.travel = joint_travel(theta1, theta2, home)
+            stroke_elbows = np.maximum.reduceat(elbow, path.command_starts()[:-1]) if len(elbow) else elbow
+        else:
+            stroke_elbows = np.full(path.num_strokes, ELBOW_DOWN, np.int8)
+            self.travel = self.travel_down
+
+        # Các điểm chia thêm dùng cấu hình khuỷu của nét chứa nó, nên chỉ cần giải lại động học ngược
+        if tolerance:
+            path = subdivide_joint_path(path, L1, L2, stroke_elbows, tolerance)
+            command_lengths = np.diff(path.command_starts())
+            commands = path.commands().astype(np.float64)
+        self.path = path
+        self.x, self.y = commands[:, 0], commands[:, 1]
+        self.pen = commands[:, 2].astype(np.uint8)
+        self.elbow = np.repeat(stroke_elbows, command_lengths).astype(np.int8)
+        self.theta1, self.theta2, self.reachable = inverse_kinematics(self.x, self.y, L1, L2, self.elbow)
+
+        # Lệnh được thực hiện ngay trước mỗi lệnh (-1: đầu bút ở vị trí home)
+        home_x, home_y = (float(v) for v in forward_kinematics(*home, L1, L2)[2:])
+        index = np.where(self.reachable, np.arange(len(self.x)), -1)
+        prev = np.r_[-1, np.maximum.accumulate(index)[:-1]] if len(index) else index
+        at_home = prev < 0
+        prev_x = np.where(at_home, home_x, self.x[prev])
+        prev_y = np.where(at_home, home_y, self.y[prev])
+        prev_pen = np.where(at_home, 0, self.pen[prev])
+        self.delta1 = self.theta1 - np.where(at_home, home[0], self.theta1[prev])
+        self.delta2 = self.theta2 - np.where(at_home, home[1], self.theta2[prev])
+        self.long_move = ((prev_pen == 0) & (self.pen == 0)
+                          & (np.hypot(self.x - prev_x, self.y - prev_y) > long_move))
+
+        # Kế hoạch thời gian cho các lệnh được thực hiện. Giới hạn tốc độ đầu bút (mm/s) đổi sang
+        # tham số đường đi của không gian khớp bằng tỉ số độ dài góc khớp / độ dài mm của đoạn;
+        # tại đỉnh lấy tỉ số nhỏ hơn của hai đoạn kề để không đoạn nào vượt giới hạn
+        idx = np.flatnonzero(self.reachable)
+        x, y, pen = self.x[idx], self.y[idx], self.pen[idx]
+        joint_length = np.hypot(self.delta1[idx], self.delta2[idx])
+        cart_length = np.hypot(np.diff(np.r_[home_x, x]), np.diff(np.r_[home_y, y]))
+        ratio = np.where(cart_length > 0, joint_length / np.where(cart_length > 0, cart_length, 1), np.inf)
+        drawing = (pen == 1) & (np.r_[0, pen[:-1]] == 1)
+        move_speed = np.where(drawing, drawing_speed / 60 * ratio, np.inf)
+        corner = corner_speeds(x, y, pen, corner_accel, deviation)
+        vertex_ratio = np.minimum(ratio, np.r_[ratio[1:], np.inf])
+        vertex_ratio = np.where(np.isfinite(vertex_ratio), vertex_ratio, 0)
+        vertex_speed = np.where(np.isfinite(corner), corner * vertex_ratio, np.inf)
+        start, duration, _ = plan_moves(self.delta1[idx], self.delta2[idx], pen, max_speed, max_accel,
+                                        pen_time=pen_time, move_speed=move_speed, vertex_speed=vertex_speed)
+        self.start = np.full(len(self.x), np.nan)
+        self.duration = np.zeros(len(self.x))
+        self.start[idx] = start
+        self.duration[idx] = duration
+        # Tính cả thời gian chờ servo nếu lệnh cuối đổi trạng thái bút (nâng bút khi kết thúc)
+        self.total_time = (float(start[-1] + duration[-1] + pen_time * (pen[-1] != np.r_[0, pen][-2]))
+                           if len(idx) else 0.0)
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def skipped(self):
+        """Số lệnh ngoài tầm với"""
+        return int(len(self) - np.count_nonzero(self.reachable))
+
+    def steps(self):
+        """Các lệnh được thực hiện dưới dạng list tuple Python, sẵn để vòng lặp điều khiển đọc:
+        (chỉ số lệnh, x, y, bút, theta1, theta2, di chuyển dài, thời điểm bắt đầu, thời gian)
+        """
+        idx = np.flatnonzero(self.reachable)
+        return list(zip(idx.tolist(), self.x[idx].tolist(), self.y[idx].tolist(), self.pen[idx].tolist(),
+                        self.theta1[idx].tolist(), self.theta2[idx].tolist(), self.long_move[idx].tolist(),
+                        self.start[idx].tolist(), self.duration[idx].tolist()))
@@ -0,0 +1,363 @@
+"""Động học cánh tay hai khâu và vùng với: động học thuận/ngược theo mảng, chọn cấu hình khuỷu
+theo từng nét, chia nhỏ đoạn thẳng bị cong khi nội suy trong không gian khớp, tự co giãn/dời
+hình cho vừa vùng với, cắt phần ngoài tầm với
+
+Đầu bút với tới được các điểm trong hình vành khăn |L1 - L2| <= r <= L1 + L2 quanh gốc
+robot. Mọi phép tính làm trên toàn bộ mảng tọa độ cùng lúc.
+"""
+import numpy as np
+
+from path_buffer import PathBuffer, pen_down_length
+
+ARM_LENGTHS = (140, 120)  # Chiều dài link 1 và 2 (mm)
+REACH_MARGIN = 1.0  # mm - chừa lại ở hai biên để sai số làm tròn không đẩy điểm ra ngoài
+FIT_ANGLES = 24  # số hướng đặt tâm hình khi tìm vị trí tốt nhất
+FIT_RADII = 8  # số bán kính đặt tâm hình
+ELBOW_DOWN, ELBOW_UP = -1, 1  # dấu của theta2
+JOINT_TOLERANCE = 0.1  # mm - độ cong cho phép của một đoạn vẽ khi robot nội suy theo góc khớp
+MAX_BISECTIONS = 10  # số lần chia đôi tối đa mỗi đoạn (tối đa 1024 đoạn con)
+FIT_GRID = 1.0  # mm - gộp các điểm gần nhau khi tìm tỉ lệ (phần sai lệch nằm trong REACH_MARGIN)
+
+
+def reach_limits(L1, L2, margin=REACH_MARGIN):
+    """(bán kính trong, bán kính ngoài) của vùng với, đã trừ lề"""
+    return abs(L1 - L2) + margin, L1 + L2 - margin
+
+
+def reachable(coords, L1, L2, margin=REACH_MARGIN):
+    """Mặt nạ các điểm nằm trong vùng với"""
+    r_min, r_max = reach_limits(L1, L2, margin)
+    r = np.hypot(*np.asarray(coords, np.float64).reshape(-1, 2).T)
+    return (r >= r_min) & (r <= r_max)
+
+
+def inverse_kinematics(x, y, L1, L2, elbow=ELBOW_DOWN):
+    """Động học ngược cho cả mảng điểm: (theta1, theta2, với tới được), góc theo độ
+
+    elbow: ELBOW_DOWN (theta2 <= 0, mặc định như RobotArmController.inverse_kinematics),
+    ELBOW_UP, hoặc mảng dấu cho từng điểm. Điểm ngoài tầm với có góc NaN.
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    d = (x * x + y * y - L1 ** 2 - L2 ** 2) / (2 * L1 * L2)
+    ok = np.abs(d) <= 1
+    theta2 = np.where(np.asarray(elbow) < 0, -1.0, 1.0) * np.arccos(np.where(ok, d, np.nan))
+    theta1 = np.arctan2(y, x) - np.arctan2(L2 * np.sin(theta2), L1 + L2 * np.cos(theta2))
+    return np.degrees(theta1), np.degrees(theta2), ok
+
+
+def forward_kinematics(theta1, theta2, L1, L2):
+    """Vị trí khuỷu và đầu bút từ góc khớp (độ), tính cho cả mảng: (x1, y1, x2, y2)"""
+    t1 = np.radians(theta1)
+    t12 = t1 + np.radians(theta2)
+    x1 = L1 * np.cos(t1)
+    y1 = L1 * np.sin(t1)
+    return x1, y1, x1 + L2 * np.cos(t12), y1 + L2 * np.sin(t12)
+
+
+def joint_travel(theta1, theta2, home=(0.0, 0.0)):
+    """Tổng quãng quay của hai khớp (độ, |dtheta1| + |dtheta2|) từ home qua các lệnh, bỏ qua góc NaN"""
+    ok = ~(np.isnan(theta1) | np.isnan(theta2))
+    t1 = np.r_[home[0], np.asarray(theta1)[ok]]
+    t2 = np.r_[home[1], np.asarray(theta2)[ok]]
+    return float(np.abs(np.diff(t1)).sum() + np.abs(np.diff(t2)).sum())
+
+
+def choose_elbows(x, y, groups, L1, L2, home=(0.0, 0.0)):
+    """Chọn cấu hình khuỷu cho từng nhóm lệnh liên tiếp để tổng quãng quay khớp nhỏ nhất
+
+    groups: số nhóm (không giảm) của từng lệnh, thường là chỉ số nét - trong một nhóm không
+    bao giờ đổi cấu hình, chỉ đổi giữa hai nhóm (lúc bút đang nhấc).
+    Quãng quay trong từng nhóm của hai cấu hình tính theo mảng; việc chọn cho cả chuỗi nhóm
+    là quy hoạch động hai trạng thái (lượt đi một vòng qua các nhóm, không qua từng điểm).
+    Trả về (theta1, theta2, với tới được, dấu khuỷu của từng lệnh).
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    groups = np.asarray(groups, np.int64)
+    branches = [inverse_kinematics(x, y, L1, L2, elbow) for elbow in (ELBOW_DOWN, ELBOW_UP)]
+    ok = branches[0][2]
+    elbows = np.full(len(x), ELBOW_DOWN, np.int8)
+    idx = np.flatnonzero(ok)
+    if len(idx) == 0:
+        return branches[0][0], branches[0][1], ok, elbows
+
+    # Chỉ xét các lệnh với tới được; nhóm đánh số lại 0..G-1
+    g = groups[idx]
+    first = np.r_[True, g[1:] != g[:-1]]
+    gid = np.cumsum(first) - 1
+    starts = np.flatnonzero(first)
+    ends = np.r_[starts[1:], len(idx)] - 1
+    num_groups = len(starts)
+    inner = ~first[1:]
+
+    angles, cost = [], []
+    for theta1, theta2, _ in branches:
+        a = np.column_stack([theta1[idx], theta2[idx]])
+        step = np.abs(np.diff(a, axis=0)).sum(axis=1)
+        cost.append(np.bincount(gid[1:][inner], step[inner], minlength=num_groups).tolist())
+        angles.append(a)
+
+    # Quãng quay khi chuyển giữa hai nhóm liền nhau, cho cả 4 cặp cấu hình (trước, sau)
+    home = np.asarray(home, np.float64)
+    enter = [[np.abs(angles[b][starts[0]] - home).sum()] for b in (0, 1)]
+    switch = [[np.abs(angles[a][starts[1:]] - angles[b][ends[:-1]]).sum(axis=1).tolist() for b in (0, 1)]
+              for a in (0, 1)]
+
+    # Quy hoạch động: best[a] = quãng quay nhỏ nhất đến hết nhóm hiện tại khi nhóm đó dùng cấu hình a
+    best = [enter[a][0] + cost[a][0] for a in (0, 1)]
+    choice = []
+    for k in range(1, num_groups):
+        stay = [best[a] + switch[a][a][k - 1] for a in (0, 1)]
+        cross = [best[1 - a] + switch[a][1 - a][k - 1] for a in (0, 1)]
+        choice.append([stay[a] > cross[a] for a in (0, 1)])
+        best = [min(stay[a], cross[a]) + cost[a][k] for a in (0, 1)]
+    picked = [0] * num_groups
+    picked[-1] = int(best[1] < best[0])
+    for k in range(num_groups - 1, 0, -1):
+        picked[k - 1] = 1 - picked[k] if choice[k - 1][picked[k]] else picked[k]
+
+    up = np.asarray(picked, bool)[gid]
+    elbows[idx[up]] = ELBOW_UP
+    theta1 = np.where(elbows == ELBOW_UP, branches[1][0], branches[0][0])
+    theta2 = np.where(elbows == ELBOW_UP, branches[1][1], branches[0][1])
+    return theta1, theta2, ok, elbows
+
+
+def _joint_deviation(a, b, ta, tb, L1, L2):
+    """Khoảng cách (mm) từ đầu bút tại trung điểm góc khớp đến đoạn thẳng a-b"""
+    mid = forward_kinematics((ta[:, 0] + tb[:, 0]) / 2, (ta[:, 1] + tb[:, 1]) / 2, L1, L2)
+    p = np.column_stack(mid[2:])
+    d = b - a
+    t = np.clip(np.einsum('ij,ij->i', p - a, d) / np.maximum(np.einsum('ij,ij->i', d, d), 1e-12), 0, 1)
+    return np.hypot(*(a + t[:, None] * d - p).T)
+
+
+def subdivide_joint_path(buf, L1, L2, elbows=None, tolerance=JOINT_TOLERANCE, max_bisections=MAX_BISECTIONS):
+    """Chia nhỏ các đoạn vẽ mà robot (nội suy tuyến tính theo góc khớp) sẽ vẽ cong quá tolerance
+
+    Độ lệch đo bằng động học thuận tại trung điểm góc khớp của đoạn; đoạn lệch quá tolerance
+    được chia đôi (theo tọa độ Descartes) và kiểm tra lại, mỗi lượt tính cho mọi đoạn cùng lúc.
+    Chỉ thêm điểm ở đoạn cần thiết. elbows: dấu khuỷu của từng nét (mặc định khuỷu xuống).
+    Nét bút nhấc và đoạn có đầu mút ngoài tầm với giữ nguyên. Trả về PathBuffer mới.
+    """
+    if buf.num_strokes == 0 or not tolerance or tolerance <= 0:
+        return buf
+    lengths = buf.stroke_lengths()
+    if elbows is None:
+        elbows = np.full(buf.num_strokes, ELBOW_DOWN, np.int8)
+    coords = buf.coords.astype(np.float64)
+    point_elbow = np.repeat(np.asarray(elbows), lengths)
+    theta1, theta2, ok = inverse_kinematics(coords[:, 0], coords[:, 1], L1, L2, point_elbow)
+    angles = np.column_stack([theta1, theta2])
+
+    inner = np.ones(max(len(coords) - 1, 0), bool)
+    inner[buf.offsets[1:-1] - 1] = False
+    inner &= np.repeat(buf.pen != 0, lengths)[1:] & ok[:-1] & ok[1:]
+    seg = np.flatnonzero(inner)
+
+    # Các đoạn con đang xét: đoạn gốc, tham số t0/t1 trên đoạn gốc và góc khớp hai đầu
+    t0, t1 = np.zeros(len(seg)), np.ones(len(seg))
+    a, b = coords[seg], coords[seg + 1]
+    ta, tb = angles[seg], angles[seg + 1]
+    new_seg, new_t = [], []
+    for _ in range(max_bisections):
+        if len(seg) == 0:
+            break
+        split = _joint_deviation(a, b, ta, tb, L1, L2) > tolerance
+        seg, t0, t1, a, b, ta, tb = (v[split] for v in (seg, t0, t1, a, b, ta, tb))
+        m = (a + b) / 2
+        tm = np.column_stack(inverse_kinematics(m[:, 0], m[:, 1], L1, L2, point_elbow[seg])[:2])
+        tmid = (t0 + t1) / 2
+        new_seg.append(seg)
+        new_t.append(tmid)
+        # Mỗi đoạn bị chia thành hai nửa, cả hai được kiểm tra ở lượt sau
+        seg = np.r_[seg, seg]
+        t0, t1 = np.r_[t0, tmid], np.r_[tmid, t1]
+        a, b = np.vstack([a, m]), np.vstack([m, b])
+        ta, tb = np.vstack([ta, tm]), np.vstack([tm, tb])
+    if not new_seg or not sum(len(s) for s in new_seg):
+        return buf
+
+    # Chèn các điểm mới sau điểm đầu đoạn gốc, theo thứ tự t tăng dần
+    new_seg = np.concatenate(new_seg)
+    new_t = np.concatenate(new_t)
+    order = np.lexsort((new_t, new_seg))
+    new_seg, new_t = new_seg[order], new_t[order]
+    new_points = coords[new_seg] + new_t[:, None] * (coords[new_seg + 1] - coords[new_seg])
+    position = np.r_[np.arange(len(coords)), new_seg]
+    rank = np.r_[np.zeros(len(coords)), new_t]
+    merged = np.lexsort((rank, position))
+    added = np.bincount(np.repeat(np.arange(buf.num_strokes), lengths)[new_seg], minlength=buf.num_strokes)
+    offsets = buf.offsets + np.r_[0, np.cumsum(added)]
+    return PathBuffer(np.vstack([coords, new_points])[merged], offsets, buf.pen, buf.closed)
+
+
+def _segments(buf, pen_down_only=True):
+    """(điểm đầu, điểm cuối) của mọi đoạn thẳng bên trong các nét"""
+    coords = buf.coords.astype(np.float64)
+    inner = np.ones(max(len(coords) - 1, 0), bool)
+    inner[buf.offsets[1:-1] - 1] = False
+    if pen_down_only:
+        inner &= np.repeat(buf.pen != 0, buf.stroke_lengths())[1:]
+    idx = np.flatnonzero(inner)
+    return coords[idx], coords[idx + 1]
+
+
+def _segment_min_radius(a, b):
+    """Khoảng cách nhỏ nhất từ gốc tới từng đoạn thẳng a-b"""
+    d = b - a
+    length2 = np.einsum('ij,ij->i', d, d)
+    t = np.clip(-np.einsum('ij,ij->i', a, d) / np.maximum(length2, 1e-12), 0, 1)
+    return np.hypot(*(a + t[:, None] * d).T)
+
+
+def _max_scale(points, center, r_min, r_max):
+    """Tỉ lệ lớn nhất s để center + s * points nằm trong vành khăn (tính riêng cho từng tâm)
+
+    points: (N, 2) tương đối so với tâm hình; center: (C, 2). Trả về (C,).
+    Với mỗi điểm, |center + s v| là hàm lồi theo s: lấy nghiệm dương đầu tiên chạm
+    đường tròn ngoài hoặc đường tròn trong.
+    """
+    vv = np.einsum('ij,ij->i', points, points)[None, :]
+    ov = center @ points.T
+    oo = np.einsum('ij,ij->i', center, center)[:, None]
+    safe_vv = np.maximum(vv, 1e-12)
+    s_out = (-ov + np.sqrt(np.maximum(ov * ov - vv * (oo - r_max ** 2), 0))) / safe_vv
+    disc = ov * ov - vv * (oo - r_min ** 2)
+    s_in = (-ov - np.sqrt(np.maximum(disc, 0))) / safe_vv
+    s_in = np.where((disc >= 0) & (ov < 0) & (s_in > 0), s_in, np.inf)
+    s = np.minimum(s_out, s_in)
+    s[:, vv[0] == 0] = np.inf
+    s = s.min(axis=1)
+    # Tâm nằm ngoài vành khăn thì không dùng được
+    r = np.sqrt(oo[:, 0])
+    return np.where((r >= r_min) & (r <= r_max), s, 0.0)
+
+
+def fit_to_reach(buf, L1, L2, margin=REACH_MARGIN):
+    """Co giãn và dời hình (không xoay) để lớn nhất có thể mà mọi nét vẽ vẫn trong vùng với
+
+    Trả về (PathBuffer mới, hệ số co giãn so với hình cũ, tâm hình mới).
+    """
+    if buf.num_strokes == 0:
+        return buf, 1.0, (0.0, 0.0)
+    r_min, r_max = reach_limits(L1, L2, margin)
+    coords = buf.coords.astype(np.float64)
+    down = np.repeat(buf.pen != 0, buf.stroke_lengths())
+    drawn = coords[down] if down.any() else coords
+    lo, hi = drawn.min(axis=0), drawn.max(axis=0)
+    middle = (lo + hi) / 2
+    # Gộp các điểm gần nhau để việc tìm kiếm nhanh hơn; kiểm tra lại chính xác ở cuối
+    points = np.unique(np.round((drawn - middle) / FIT_GRID), axis=0) * FIT_GRID
+
+    # Tìm thô trên lưới tọa độ cực, rồi tinh chỉnh quanh tâm tốt nhất
+    angles = np.linspace(0, 2 * np.pi, FIT_ANGLES, endpoint=False)
+    radii = np.linspace(r_min, r_max, FIT_RADII + 2)[1:-1]
+    grid = np.stack(np.meshgrid(angles, radii), -1).reshape(-1, 2)
+    centers = np.c_[grid[:, 1] * np.cos(grid[:, 0]), grid[:, 1] * np.sin(grid[:, 0])]
+    scales = _max_scale(points, centers, r_min, r_max)
+    best = int(np.argmax(scales))
+    center, scale = centers[best], scales[best]
+    step = (r_max - r_min) / (FIT_RADII + 1)
+    directions = np.array([[1, 0], [-1, 0], [0, 1], [0, -1], [1, 1], [1, -1], [-1, 1], [-1, -1]], np.float64)
+    while step > 0.05:
+        trial = center + directions * step
+        trial_scales = _max_scale(points, trial, r_min, r_max)
+        k = int(np.argmax(trial_scales))
+        if trial_scales[k] > scale:
+            center, scale = trial[k], trial_scales[k]
+        else:
+            step /= 2
+
+    # Kiểm tra chính xác trên toàn bộ điểm và đoạn thẳng (đoạn có thể cắt qua vòng trong)
+    a, b = _segments(buf)
+    for _ in range(50):
+        fitted = center + (coords - middle) * scale
+        r = np.hypot(*fitted[down].T)
+        inner_ok = _segment_min_radius(center + (a - middle) * scale,
+                                       center + (b - middle) * scale) >= r_min - 1e-6
+        if r.max(initial=0) <= r_max + 1e-6 and r.min(initial=np.inf) >= r_min - 1e-6 and inner_ok.all():
+            break
+        scale *= 0.98
+    return buf.with_coords(fitted), float(scale), (float(center[0]), float(center[1]))
+
+
+def _circle_crossings(a, d, radius):
+    """Tham số t trong (0, 1) tại đó đoạn a + t d cắt đường tròn bán kính radius (NaN nếu không)"""
+    aa = np.einsum('ij,ij->i', a, a)
+    ad = np.einsum('ij,ij->i', a, d)
+    dd = np.maximum(np.einsum('ij,ij->i', d, d), 1e-12)
+    disc = ad * ad - dd * (aa - radius ** 2)
+    root = np.sqrt(np.maximum(disc, 0))
+    t = np.stack([(-ad - root) / dd, (-ad + root) / dd], axis=1)
+    t[(disc <= 0)[:, None] | (t <= 0) | (t >= 1)] = np.nan
+    return t
+
+
+def clip_to_reach(buf, L1, L2, margin=REACH_MARGIN):
+    """Cắt các nét tại biên vùng với; phần ngoài tầm với bị bỏ, mỗi phần còn lại thành một nét
+
+    Điểm cắt được chèn đúng trên biên. Nét nằm trọn trong vùng với giữ nguyên.
+    Trả về (PathBuffer mới, chiều dài nét vẽ bị bỏ).
+    """
+    if len(buf) == 0:
+        return buf, 0.0
+    r_min, r_max = reach_limits(L1, L2, margin)
+    coords = buf.coords.astype(np.float64)
+    inside = reachable(coords, L1, L2, margin)
+
+    # Đoạn i: điểm i -> i + 1 trong cùng một nét
+    lasts = buf.offsets[1:] - 1
+    is_last = np.zeros(len(coords), bool)
+    is_last[lasts] = True
+    nxt = np.minimum(np.arange(len(coords)) + 1, len(coords) - 1)
+    a = coords
+    d = np.where(is_last[:, None], 0.0, coords[nxt] - coords)
+    t = np.hstack([np.zeros((len(coords), 1)), _circle_crossings(a, d, r_min), _circle_crossings(a, d, r_max)])
+    crosses = ~np.isnan(t[:, 1:]).all(axis=1) & ~is_last
+    if inside.all() and not crosses.any():
+        return buf, 0.0
+
+    # Mỗi điểm sinh ra các khúc [t_k, t_k+1] trên đoạn phía sau nó, chia tại các giao điểm;
+    # điểm cuối nét sinh một khúc rỗng (chỉ chính nó)
+    t = np.sort(np.nan_to_num(t, nan=1.0), axis=1)
+    upper = np.hstack([t[:, 1:], np.ones((len(coords), 1))])
+    valid = upper > t
+    valid[is_last] = False
+    valid[is_last, 0] = True
+    point = np.repeat(np.arange(len(coords)), valid.sum(axis=1))
+    t0 = t[valid]
+    t1 = np.where(is_last[point], 0.0, upper[valid])
+    start = a[point] + t0[:, None] * d[point]
+    end = a[point] + t1[:, None] * d[point]
+    stroke = buf.stroke_ids()[point]
+
+    # Khúc có trung điểm trong tầm với được giữ; các khúc giữ liên tiếp của một nét nối thành nét mới
+    kept = np.flatnonzero(reachable((start + end) / 2, L1, L2, margin))
+    if len(kept) == 0:
+        return PathBuffer(), pen_down_length(buf)
+    new_stroke = np.r_[True, (np.diff(kept) > 1) | (stroke[kept[1:]] != stroke[kept[:-1]])]
+    # Mỗi nét mới: điểm đầu của khúc đầu tiên rồi điểm cuối của mọi khúc
+    counts = np.where(new_stroke, 2, 1)
+    pos = np.cumsum(counts) - counts
+    out = np.empty((int(counts.sum()), 2))
+    out[pos[new_stroke]] = start[kept[new_stroke]]
+    out[pos + counts - 1] = end[kept]
+    firsts = pos[new_stroke]
+    source = stroke[kept[new_stroke]]
+
+    # Bỏ điểm lặp (khúc rỗng ở cuối nét), rồi bỏ mẩu chỉ còn một điểm của nét vốn dài hơn
+    repeated = np.zeros(len(out), bool)
+    repeated[1:] = np.all(out[1:] == out[:-1], axis=1)
+    repeated[firsts] = False
+    offsets = np.r_[firsts, len(out)]
+    offsets = offsets - np.r_[0, np.cumsum(repeated)][offsets]
+    # Nét không bị cắt giữ cờ khép kín
+    untouched = np.ones(buf.num_strokes, bool)
+    untouched[buf.stroke_ids()[~inside | crosses]] = False
+    result = PathBuffer(out[~repeated], offsets, buf.pen[source], buf.closed[source] & untouched[source])
+    single = (result.stroke_lengths() == 1) & (buf.stroke_lengths()[source] > 1)
+    if single.any():
+        result = result.subset(np.flatnonzero(~single))
+    return result, pen_down_length(buf) - pen_down_length(result)
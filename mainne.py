@@ -1,14 +1,26 @@
+import time
+STARTUP_START = time.perf_counter()  # Mốc đo thời gian khởi động (đến khi cửa sổ hiện ra)
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import cv2
 import os
-import serial
-import time
 import threading
+# PIL, matplotlib và serial import chậm: chỉ import khi dùng lần đầu
+from path_cache import PathCache, make_key
+from path_buffer import (PathBuffer, close_strokes, interpolate_strokes, resample_strokes, image_to_robot,
+                         workspace_scale, pen_up_length, pen_down_length, RESAMPLE_MODES)
+from stroke_order import order_strokes, choose_entry_points
+from stroke_merge import merge_strokes, join_adjacent, MERGE_GAP
+from stroke_dedup import dedup_strokes, PEN_WIDTH
+from kinematics import ARM_LENGTHS, JOINT_TOLERANCE, fit_to_reach, clip_to_reach, forward_kinematics
+from kinematics import inverse_kinematics as solve_joint_angles
+from joint_job import JointJob
+from motion_planner import MAX_JOINT_SPEED, MAX_JOINT_ACCEL
+from gcode import generate_gcode
+from image_pipeline import ExtractionPipeline, METHODS, THRESHOLD_MODES, SIMPLIFY_MODES
+from tiled_extraction import TiledExtractor, image_pixel_count, image_dimensions
+from image_library import ImageLibrary
 
 class RobotArmController:
     def __init__(self, root):
@@ -27,7 +39,7 @@ class RobotArmController:
         self.stop_drawing = False
         
         # Robot parameters
-        self.L1, self.L2 = 140, 120  # Chiều dài link 1 và 2 (mm)
+        self.L1, self.L2 = ARM_LENGTHS  # Chiều dài link 1 và 2 (mm)
         self.image_size = 400
         self.workspace_size = 300
         self.scale = self.workspace_size / self.image_size
@@ -36,7 +48,8 @@ class RobotArmController:
         self.step_size = 5.0  # Kích thước bước (mm) - càng nhỏ càng mịn
         self.step_per_mm = 10  # Số bước/mm
         self.servo_delay = 0.02  # Thời gian chờ giữa các lệnh servo (giây)
-        self.motor_delay = 0.01  # Thời gian chờ giữa các lệnh động cơ (giây)
+        self.joint_speed = MAX_JOINT_SPEED  # Tốc độ tối đa của từng khớp (độ/giây)
+        self.joint_accel = MAX_JOINT_ACCEL  # Gia tốc tối đa của từng khớp (độ/giây^2)
         
         # COM port and baudrate
         self.com_port = tk.StringVar(value="COM14")
@@ -46,16 +59,51 @@ class RobotArmController:
         self.gcode_list = []
         self.use_gcode = tk.BooleanVar(value=False)
         
+        # Thư viện ảnh: chỉ mục làm mới tăng dần + ảnh thu nhỏ tạo ở nền, lưu trên đĩa
+        # (hash nội dung dùng chung với cache đường nét)
+        self.image_library = ImageLibrary(
+            '.', cache_dir=os.path.join('.', '.path_cache', 'thumbs'),
+            hasher=lambda image_path: self.path_cache.image_hash(image_path),
+            on_thumbnail=lambda name, thumb: self.root.after(0, lambda: self.thumbnail_ready(name))
+        )
+        self.preview_name = None  # ảnh đang hiển thị ở khung "Ảnh gốc"
+        
         # Ảnh mẫu - khởi tạo trước khi gọi setup_ui
         self.available_images = self.find_image_files()
         self.image_choice = tk.StringVar(value=self.available_images[0] if self.available_images else "")
         
         # Biến lưu ảnh và đường dẫn
         self.original_image = None
-        self.drawing_path = []
-        self.robot_path = []
+        self.image_shape = None
+        self.drawing_path = PathBuffer()
+        self.robot_path = PathBuffer()
         self.current_image = None
         self.prev_angles = [0, 0]
+        self.job = None  # JointJob của robot_path: góc khớp của mọi lệnh, tính trước khi vẽ
+        
+        # Cache kết quả trích xuất (RAM giới hạn theo byte + lưu trên đĩa)
+        self.path_cache = PathCache(max_bytes=64 * 1024 * 1024, disk_dir=os.path.join('.', '.path_cache'))
+        
+        # Pipeline trích xuất theo giai đoạn (giữ lại ảnh trung gian giữa các lần chạy)
+        self.pipeline = ExtractionPipeline()
+        self.target_fraction = 0.1  # Tỉ lệ điểm ảnh tiền cảnh mong muốn cho chế độ "fraction"
+        self.threshold_info = {}
+        
+        # Xem trước trên ảnh thu nhỏ khi đang kéo thanh trượt, xử lý đầy đủ khi giá trị ổn định
+        self.preview_pipeline = ExtractionPipeline(max_side=800)
+        self.preview_job = None
+        self.settle_job = None
+        self.settle_ms = 400
+        
+        # Xử lý ảnh trên luồng nền: chỉ tính bộ tham số mới nhất, bỏ kết quả của yêu cầu đã cũ
+        self.process_lock = threading.Lock()
+        self.process_request = None  # (số thứ tự, tham số) đang chờ luồng nền lấy
+        self.process_generation = 0
+        self.process_thread = None
+        
+        # Ảnh lớn hơn ngưỡng này được xử lý theo ô (memory-map + nhiều tiến trình)
+        self.tiled_min_pixels = 16_000_000
+        self.tiled_extractor = TiledExtractor(cache_dir=os.path.join('.', '.path_cache', 'tiles'))
         
         # Khởi tạo UI sau khi các biến đã được chuẩn bị
         self.setup_ui()
@@ -69,14 +117,8 @@ class RobotArmController:
         self.drawing_thread = None
         
     def find_image_files(self):
-        """Tìm tất cả các file ảnh trong thư mục hiện tại"""
-        extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.gif']
-        image_files = []
-        
-        for file in os.listdir('.'):
-            if any(file.lower().endswith(ext) for ext in extensions):
-                image_files.append(file)
-        
+        """Tìm tất cả các file ảnh trong thư mục hiện tại (chỉ đọc lại thông tin file đã thay đổi)"""
+        image_files = self.image_library.refresh()
         return image_files if image_files else ["sample.png"]
     
     def setup_ui(self):
@@ -138,39 +180,98 @@ class RobotArmController:
         
         ttk.Label(settings_frame, text="Ngưỡng cắt:").grid(row=0, column=0, sticky=tk.W, pady=2)
         self.threshold_var = tk.IntVar(value=100)  # Giảm ngưỡng để lấy được nhiều chi tiết hơn
-        threshold_slider = ttk.Scale(settings_frame, from_=0, to=255, variable=self.threshold_var, orient=tk.HORIZONTAL, length=150)
+        threshold_slider = ttk.Scale(settings_frame, from_=0, to=255, variable=self.threshold_var, orient=tk.HORIZONTAL, length=150,
+                                     command=self.schedule_preview)
         threshold_slider.grid(row=0, column=1, padx=5, pady=2)
-        threshold_slider.bind("<ButtonRelease-1>", self.process_current_image)
+        threshold_slider.bind("<ButtonRelease-1>", self.commit_current_image)
+        
+        # Chọn ngưỡng tự động từ histogram (otsu / triangle / tỉ lệ tiền cảnh)
+        ttk.Label(settings_frame, text="Chọn ngưỡng:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.threshold_mode_var = tk.StringVar(value="manual")
+        threshold_mode_combo = ttk.Combobox(settings_frame, textvariable=self.threshold_mode_var, state="readonly", width=15,
+                                            values=THRESHOLD_MODES)
+        threshold_mode_combo.grid(row=1, column=1, sticky=tk.W, pady=2)
+        threshold_mode_combo.bind("<<ComboboxSelected>>", self.process_current_image)
         
-        ttk.Label(settings_frame, text="Đảo màu:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        ttk.Label(settings_frame, text="Đảo màu:").grid(row=2, column=0, sticky=tk.W, pady=2)
         self.invert_var = tk.BooleanVar(value=True)
-        ttk.Checkbutton(settings_frame, variable=self.invert_var, command=self.process_current_image).grid(row=1, column=1, sticky=tk.W, pady=2)
+        ttk.Checkbutton(settings_frame, variable=self.invert_var, command=self.process_current_image).grid(row=2, column=1, sticky=tk.W, pady=2)
         
         # Cài đặt thuật toán 
-        ttk.Label(settings_frame, text="Phương pháp:").grid(row=2, column=0, sticky=tk.W, pady=2)
+        ttk.Label(settings_frame, text="Phương pháp:").grid(row=3, column=0, sticky=tk.W, pady=2)
         self.method_var = tk.StringVar(value="contour")
         method_combo = ttk.Combobox(settings_frame, textvariable=self.method_var, state="readonly", width=15, 
-                                    values=["contour", "canny", "adaptive"])
-        method_combo.grid(row=2, column=1, sticky=tk.W, pady=2)
+                                    values=METHODS)
+        method_combo.grid(row=3, column=1, sticky=tk.W, pady=2)
         method_combo.bind("<<ComboboxSelected>>", self.process_current_image)
         
         # Chất lượng đường
-        ttk.Label(settings_frame, text="Chi tiết:").grid(row=3, column=0, sticky=tk.W, pady=2)
+        ttk.Label(settings_frame, text="Chi tiết:").grid(row=4, column=0, sticky=tk.W, pady=2)
         self.detail_var = tk.DoubleVar(value=0.5)
-        detail_slider = ttk.Scale(settings_frame, from_=0.1, to=5.0, variable=self.detail_var, orient=tk.HORIZONTAL, length=150)
-        detail_slider.grid(row=3, column=1, padx=5, pady=2)
-        detail_slider.bind("<ButtonRelease-1>", self.process_current_image)
+        detail_slider = ttk.Scale(settings_frame, from_=0.1, to=5.0, variable=self.detail_var, orient=tk.HORIZONTAL, length=150,
+                                  command=self.schedule_preview)
+        detail_slider.grid(row=4, column=1, padx=5, pady=2)
+        detail_slider.bind("<ButtonRelease-1>", self.commit_current_image)
+        
+        # Đơn giản hóa theo chu vi (mức chi tiết) hoặc theo sai số tuyệt đối (mm trên giấy)
+        ttk.Label(settings_frame, text="Đơn giản hóa:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        self.simplify_mode_var = tk.StringVar(value="arc")
+        simplify_combo = ttk.Combobox(settings_frame, textvariable=self.simplify_mode_var, state="readonly", width=15,
+                                      values=SIMPLIFY_MODES)
+        simplify_combo.grid(row=5, column=1, sticky=tk.W, pady=2)
+        simplify_combo.bind("<<ComboboxSelected>>", self.process_current_image)
+        
+        ttk.Label(settings_frame, text="Sai số (mm):").grid(row=6, column=0, sticky=tk.W, pady=2)
+        self.tolerance_mm_var = tk.DoubleVar(value=0.2)
+        ttk.Entry(settings_frame, textvariable=self.tolerance_mm_var, width=8).grid(row=6, column=1, padx=5, pady=2)
+        
+        # Các nét có đầu mút cách nhau không quá khoảng này được vẽ nối, không nhấc bút
+        ttk.Label(settings_frame, text="Nối nét (mm):").grid(row=7, column=0, sticky=tk.W, pady=2)
+        self.merge_gap_var = tk.DoubleVar(value=MERGE_GAP)
+        ttk.Entry(settings_frame, textvariable=self.merge_gap_var, width=8).grid(row=7, column=1, padx=5, pady=2)
+        
+        # Đoạn nét nằm trong khoảng bề rộng bút của đường đã vẽ được bỏ (0 để tắt)
+        ttk.Label(settings_frame, text="Bề rộng bút (mm):").grid(row=8, column=0, sticky=tk.W, pady=2)
+        self.pen_width_var = tk.DoubleVar(value=PEN_WIDTH)
+        ttk.Entry(settings_frame, textvariable=self.pen_width_var, width=8).grid(row=8, column=1, padx=5, pady=2)
+        
+        # Lấy mẫu đều theo bước hoặc theo độ cong (đoạn thẳng chỉ giữ hai đầu)
+        ttk.Label(settings_frame, text="Lấy mẫu:").grid(row=9, column=0, sticky=tk.W, pady=2)
+        self.resample_var = tk.StringVar(value="uniform")
+        resample_combo = ttk.Combobox(settings_frame, textvariable=self.resample_var, state="readonly", width=15,
+                                      values=RESAMPLE_MODES)
+        resample_combo.grid(row=9, column=1, sticky=tk.W, pady=2)
+        resample_combo.bind("<<ComboboxSelected>>", self.process_current_image)
+        
+        ttk.Label(settings_frame, text="Sai số dây cung (mm):").grid(row=10, column=0, sticky=tk.W, pady=2)
+        self.chord_error_var = tk.DoubleVar(value=0.1)
+        ttk.Entry(settings_frame, textvariable=self.chord_error_var, width=8).grid(row=10, column=1, padx=5, pady=2)
         
         # Thêm tùy chỉnh gốc tọa độ
-        ttk.Label(settings_frame, text="Dịch X:").grid(row=4, column=0, sticky=tk.W, pady=2)
+        ttk.Label(settings_frame, text="Dịch X:").grid(row=11, column=0, sticky=tk.W, pady=2)
         self.offset_x = tk.DoubleVar(value=150)  # Dịch gốc tọa độ
-        ttk.Entry(settings_frame, textvariable=self.offset_x, width=8).grid(row=4, column=1, padx=5, pady=2)
+        ttk.Entry(settings_frame, textvariable=self.offset_x, width=8).grid(row=11, column=1, padx=5, pady=2)
         
-        ttk.Label(settings_frame, text="Dịch Y:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        ttk.Label(settings_frame, text="Dịch Y:").grid(row=12, column=0, sticky=tk.W, pady=2)
         self.offset_y = tk.DoubleVar(value=100)  # Dịch gốc tọa độ
-        ttk.Entry(settings_frame, textvariable=self.offset_y, width=8).grid(row=5, column=1, padx=5, pady=2)
+        ttk.Entry(settings_frame, textvariable=self.offset_y, width=8).grid(row=12, column=1, padx=5, pady=2)
+        
+        # Bỏ qua tỉ lệ/dịch ở trên, tự tìm tỉ lệ lớn nhất và vị trí để hình nằm trọn trong vùng với
+        ttk.Label(settings_frame, text="Tự vừa vùng với:").grid(row=13, column=0, sticky=tk.W, pady=2)
+        self.auto_fit_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame, variable=self.auto_fit_var, command=self.process_current_image).grid(row=13, column=1, sticky=tk.W, pady=2)
+        
+        # Cho phép khuỷu lên ở những nét mà cấu hình đó quay khớp ít hơn (không đổi giữa chừng một nét)
+        ttk.Label(settings_frame, text="Tự chọn khuỷu:").grid(row=14, column=0, sticky=tk.W, pady=2)
+        self.auto_elbow_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(settings_frame, variable=self.auto_elbow_var, command=self.process_current_image).grid(row=14, column=1, sticky=tk.W, pady=2)
         
-        ttk.Button(settings_frame, text="Áp dụng", command=self.process_current_image).grid(row=6, column=1, padx=5, pady=5)
+        # Robot nội suy theo góc khớp giữa hai lệnh: chia nhỏ đoạn nào bị cong quá sai số này (0 = tắt)
+        ttk.Label(settings_frame, text="Sai số khớp (mm):").grid(row=15, column=0, sticky=tk.W, pady=2)
+        self.joint_tolerance_var = tk.DoubleVar(value=JOINT_TOLERANCE)
+        ttk.Entry(settings_frame, textvariable=self.joint_tolerance_var, width=8).grid(row=15, column=1, padx=5, pady=2)
+        
+        ttk.Button(settings_frame, text="Áp dụng", command=self.process_current_image).grid(row=16, column=1, padx=5, pady=5)
         
         # Điều khiển vẽ
         draw_frame = ttk.LabelFrame(control_frame, text="Điều khiển vẽ", padding=5)
@@ -212,19 +313,19 @@ class RobotArmController:
         self.path_frame = ttk.LabelFrame(preview_frame, text="Đường nét trích xuất", padding=5)
         self.path_frame.grid(row=0, column=1, sticky=tk.NSEW, padx=5, pady=5)
         
-        self.fig_path = plt.Figure(figsize=(4, 4), dpi=100)
-        self.ax_path = self.fig_path.add_subplot(111)
-        self.canvas_path = FigureCanvasTkAgg(self.fig_path, master=self.path_frame)
-        self.canvas_path.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Figure matplotlib được tạo khi cần vẽ lần đầu (ensure_path_figure)
+        self.fig_path = None
+        self.path_placeholder = ttk.Label(self.path_frame, text="Chưa có đường nét", anchor=tk.CENTER)
+        self.path_placeholder.pack(fill=tk.BOTH, expand=True)
         
         # Tạo frame hiển thị mô phỏng
         self.robot_frame = ttk.LabelFrame(preview_frame, text="Mô phỏng robot", padding=5)
         self.robot_frame.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
         
-        self.fig_robot = plt.Figure(figsize=(8, 5), dpi=100)
-        self.ax_robot = self.fig_robot.add_subplot(111)
-        self.canvas_robot = FigureCanvasTkAgg(self.fig_robot, master=self.robot_frame)
-        self.canvas_robot.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Figure mô phỏng cũng chỉ tạo khi cần (ensure_robot_figure)
+        self.fig_robot = None
+        self.robot_placeholder = ttk.Label(self.robot_frame, text="Chưa mô phỏng", anchor=tk.CENTER)
+        self.robot_placeholder.pack(fill=tk.BOTH, expand=True)
         
         # Configure grid
         preview_frame.columnconfigure(0, weight=1)
@@ -253,12 +354,33 @@ class RobotArmController:
         self.points_var = tk.StringVar(value="Số điểm: 0")
         ttk.Label(drawing_info_frame, textvariable=self.points_var).pack(anchor=tk.W, pady=2)
         
+        self.travel_var = tk.StringVar(value="Nhấc bút: -")
+        ttk.Label(drawing_info_frame, textvariable=self.travel_var).pack(anchor=tk.W, pady=2)
+        
+        self.reach_var = tk.StringVar(value="Vùng với: -")
+        ttk.Label(drawing_info_frame, textvariable=self.reach_var).pack(anchor=tk.W, pady=2)
+        
+        self.joint_var = tk.StringVar(value="Quãng quay khớp: -")
+        ttk.Label(drawing_info_frame, textvariable=self.joint_var).pack(anchor=tk.W, pady=2)
+        
         self.progress_var = tk.StringVar(value="Tiến độ: 0%")
         ttk.Label(drawing_info_frame, textvariable=self.progress_var).pack(anchor=tk.W, pady=2)
         
         self.progress = ttk.Progressbar(drawing_info_frame, orient=tk.HORIZONTAL, length=200, mode='determinate')
         self.progress.pack(fill=tk.X, pady=5)
         
+        self.process_var = tk.StringVar(value="Xử lý: -")
+        ttk.Label(drawing_info_frame, textvariable=self.process_var).pack(anchor=tk.W, pady=2)
+        
+        self.preview_var = tk.StringVar(value="Xem trước: -")
+        ttk.Label(drawing_info_frame, textvariable=self.preview_var).pack(anchor=tk.W, pady=2)
+        
+        self.threshold_info_var = tk.StringVar(value="Ngưỡng: -")
+        ttk.Label(drawing_info_frame, textvariable=self.threshold_info_var).pack(anchor=tk.W, pady=2)
+        
+        self.cache_var = tk.StringVar(value=self.path_cache.stats_text())
+        ttk.Label(drawing_info_frame, textvariable=self.cache_var, wraplength=250).pack(anchor=tk.W, pady=2)
+        
         # Góc hiện tại
         angle_frame = ttk.LabelFrame(info_frame, text="Góc hiện tại", padding=5)
         angle_frame.pack(fill=tk.X, pady=5)
@@ -302,6 +424,9 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         self.available_images = self.find_image_files()
         self.image_combo['values'] = self.available_images
         
+        # Tạo trước ảnh thu nhỏ còn thiếu trên các luồng nền
+        self.image_library.request_missing()
+        
         if self.available_images and not self.image_choice.get():
             self.image_choice.set(self.available_images[0])
             self.show_image_preview()
@@ -319,6 +444,8 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             
             # Nếu file không trong thư mục hiện tại, sao chép vào
             if not os.path.exists(file_name):
+                from PIL import Image
+                
                 # Đọc file ảnh
                 img = Image.open(file_path)
                 # Lưu vào thư mục hiện tại
@@ -337,16 +464,16 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         
         if image_path and os.path.exists(image_path):
             try:
-                # Hiển thị ảnh gốc
-                img = Image.open(image_path).convert("L")
-                img = img.resize((250, 250), Image.LANCZOS)
-                img_tk = ImageTk.PhotoImage(img)
-                self.preview_label.configure(image=img_tk)
-                self.preview_label.image = img_tk
-                
                 # Lưu ảnh hiện tại
                 self.current_image = image_path
                 
+                # Hiển thị ảnh thu nhỏ nếu đã có; nếu chưa, ảnh thu nhỏ được tạo từ chính
+                # ảnh mà bước trích xuất giải mã (không đọc ảnh hai lần)
+                if not self.show_thumbnail(image_path):
+                    self.preview_label.configure(image='', text="Đang tải ảnh...")
+                    self.preview_label.image = None
+                    self.preview_name = None
+                
                 # Xử lý ảnh
                 self.process_current_image()
             except Exception as e:
@@ -355,315 +482,330 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         else:
             self.preview_label.configure(image=None, text="Không tìm thấy ảnh.")
     
+    def show_thumbnail(self, image_path):
+        """Hiển thị ảnh thu nhỏ đã lưu trên đĩa; trả về False nếu chưa có"""
+        thumb = self.image_library.thumbnail_path(image_path)
+        if thumb is None:
+            return False
+        img_tk = tk.PhotoImage(file=thumb)
+        self.preview_label.configure(image=img_tk, text="")
+        self.preview_label.image = img_tk
+        self.preview_name = image_path
+        return True
+    
+    def thumbnail_ready(self, image_path):
+        """Ảnh thu nhỏ vừa được tạo xong (chạy trên luồng giao diện)"""
+        if image_path == self.current_image and self.preview_name != image_path:
+            self.show_thumbnail(image_path)
+    
     def process_current_image(self, event=None):
-        """Xử lý ảnh hiện tại để trích xuất đường nét"""
+        """Gửi yêu cầu xử lý ảnh hiện tại cho luồng nền (không chặn giao diện)"""
         if not self.current_image or not os.path.exists(self.current_image):
             return
         
-        try:
-            # Trích xuất đường nét từ ảnh
-            threshold = self.threshold_var.get()
-            invert = self.invert_var.get()
-            method = self.method_var.get()
-            detail_level = self.detail_var.get()
-            
-            self.original_image, self.drawing_path = self.extract_drawing_path(
-                self.current_image, threshold, invert, method, detail_level
-            )
-            
-            # Tối ưu đường đi
-            self.drawing_path = self.optimize_path(self.drawing_path)
-            
-            # Chuyển sang tọa độ robot
-            _, self.robot_path = self.convert_to_robot_coords(self.drawing_path)
-            
-            # Tạo G-code
-            self.generate_gcode()
-            
-            # Hiển thị đường nét
-            self.show_drawing_path()
+        # Đọc biến Tk ngay trên luồng giao diện, luồng nền chỉ làm việc với bản sao này
+        params = {
+            'image_path': self.current_image,
+            'threshold': self.threshold_var.get(),
+            'invert': self.invert_var.get(),
+            'method': self.method_var.get(),
+            'detail_level': self.detail_var.get(),
+            'threshold_mode': self.threshold_mode_var.get(),
+            'tolerance_mm': self.tolerance_mm_var.get() if self.simplify_mode_var.get() == "mm" else None,
+            'merge_gap': self.merge_gap_var.get(),
+            'pen_width': self.pen_width_var.get(),
+            'chord_error_mm': self.chord_error_var.get() if self.resample_var.get() == "adaptive" else None,
+            'offset': (self.offset_x.get(), self.offset_y.get()),
+            'auto_fit': self.auto_fit_var.get(),
+            'auto_elbow': self.auto_elbow_var.get(),
+            'joint_tolerance_mm': self.joint_tolerance_var.get(),
+        }
+        
+        with self.process_lock:
+            # Yêu cầu mới thay thế yêu cầu đang chờ: chỉ bộ tham số cuối cùng được tính
+            self.process_generation += 1
+            self.process_request = (self.process_generation, params)
+            if self.process_thread is None:
+                self.process_thread = threading.Thread(target=self.process_worker, daemon=True)
+                self.process_thread.start()
+        
+        self.process_var.set("Xử lý: đang xử lý…")
+    
+    def is_stale(self, generation):
+        """Đã có yêu cầu xử lý mới hơn yêu cầu này chưa"""
+        return generation != self.process_generation
+    
+    def process_worker(self):
+        """Luồng nền: lấy yêu cầu mới nhất, tính toán rồi gửi kết quả về luồng giao diện"""
+        while True:
+            with self.process_lock:
+                if self.process_request is None:
+                    self.process_thread = None
+                    return
+                generation, params = self.process_request
+                self.process_request = None
+            
+            start = time.perf_counter()
+            try:
+                result = self.compute_drawing(generation, params)
+            except Exception as e:
+                result = e
+            elapsed = time.perf_counter() - start
             
-            # Cập nhật thông tin
-            self.points_var.set(f"Số điểm: {len(self.robot_path)}")
-            self.progress_var.set("Tiến độ: 0%")
-            self.progress['value'] = 0
-        except Exception as e:
-            messagebox.showerror("Lỗi", f"Không thể xử lý ảnh: {str(e)}")
+            # Kết quả của yêu cầu đã cũ bị bỏ qua, không cần vẽ lại
+            if result is not None and not self.is_stale(generation):
+                self.root.after(0, lambda g=generation, r=result, t=elapsed: self.apply_processing_result(g, r, t))
     
-    def extract_drawing_path(self, image_path, threshold=128, invert=True, method="contour", detail_level=2.0):
-        """Trích xuất đường nét từ ảnh với nhiều phương pháp khác nhau"""
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        
-        if img is None:
-            raise ValueError(f"Không thể đọc ảnh: {image_path}")
-        
-        # Áp dụng bộ lọc khử nhiễu (làm mịn)
-        img_blur = cv2.GaussianBlur(img, (5, 5), 0)
+    def compute_drawing(self, generation, params):
+        """Trích xuất -> tối ưu -> tọa độ robot -> G-code; trả về None nếu yêu cầu đã cũ"""
+        img, image_shape, drawing_path, threshold_text = self.get_drawing_path(
+            params['image_path'], params['threshold'], params['invert'], params['method'],
+            params['detail_level'], params['threshold_mode'],
+            self.tolerance_pixels(params['image_path'], params['tolerance_mm'])
+        )
+        # Ảnh thu nhỏ dùng lại ảnh vừa giải mã; nếu đường nét lấy từ cache thì tạo ở nền
+        if self.image_library.thumbnail_path(params['image_path']) is None:
+            if img is not None:
+                self.image_library.save_thumbnail(params['image_path'], img)
+            else:
+                self.image_library.request_thumbnail(params['image_path'], urgent=True)
         
-        # Áp dụng bộ lọc tăng cường cạnh trước khi phân ngưỡng
-        img_enhanced = cv2.Laplacian(img_blur, cv2.CV_8U, ksize=3)
-        img_blur = cv2.addWeighted(img_blur, 0.7, img_enhanced, 0.3, 0)
+        # Kiểm tra giữa các bước: bước đang chạy không dừng được, nhưng không làm tiếp việc thừa
+        if self.is_stale(generation):
+            return None
         
-        drawing_path = []
+        # Tối ưu đường đi (sai số dây cung đổi từ mm sang điểm ảnh)
+        chord_error = None
+        if params['chord_error_mm']:
+            height, width = image_shape
+            chord_error = params['chord_error_mm'] / workspace_scale(width, height, self.workspace_size)
+        drawing_path = self.optimize_path(drawing_path, chord_error)
+        if self.is_stale(generation):
+            return None
         
-        # Detail level ảnh hưởng đến epsilon trong approxPolyDP
-        epsilon_factor = 0.03 / detail_level  # Càng nhỏ càng chi tiết
+        # Chuyển sang tọa độ robot và tạo G-code
+        _, robot_path = self.convert_to_robot_coords(drawing_path, image_shape, params['offset'])
+        
+        # Đưa hình vào vùng với: tự co giãn/dời nếu được chọn, rồi cắt phần ngoài tầm với
+        # (thay vì bỏ qua từng điểm khi đang vẽ)
+        reach_text = "Vùng với: "
+        if params['auto_fit']:
+            robot_path, factor, center = fit_to_reach(robot_path, self.L1, self.L2)
+            reach_text += f"tự vừa x{factor:.2f}, tâm ({center[0]:.0f}, {center[1]:.0f}) mm, "
+        robot_path, clipped = clip_to_reach(robot_path, self.L1, self.L2)
+        reach_text += f"cắt {clipped:.0f} mm nét ngoài tầm với" if clipped > 0 else "trọn trong tầm với"
+        if self.is_stale(generation):
+            return None
         
-        if method == "contour":
-            # Phương pháp ngưỡng nhị phân và tìm đường viền
-            if invert:
-                _, binary = cv2.threshold(img_blur, threshold, 255, cv2.THRESH_BINARY_INV)
-            else:
-                _, binary = cv2.threshold(img_blur, threshold, 255, cv2.THRESH_BINARY)
-            
-            # Áp dụng phép toán hình thái học để nối các đường gần nhau
-            kernel = np.ones((2, 2), np.uint8)
-            binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-            
-            # Tìm tất cả các contour, bao gồm cả contour bên trong
-            contours, hierarchy = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-            
-        elif method == "canny":
-            # Phương pháp dùng Canny Edge Detection
-            edges = cv2.Canny(img_blur, threshold, threshold * 2)
-            # Áp dụng phép giãn nở để kết nối các cạnh bị đứt
-            kernel = np.ones((2, 2), np.uint8)
-            edges = cv2.dilate(edges, kernel, iterations=1)
-            contours, hierarchy = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-            
-        elif method == "adaptive":
-            # Phương pháp ngưỡng thích ứng
-            block_size = 11  # Kích thước block - cần là số lẻ
-            C = 2  # Hằng số hiệu chỉnh
-            
-            if invert:
-                binary = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                            cv2.THRESH_BINARY_INV, block_size, C)
-            else:
-                binary = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                            cv2.THRESH_BINARY, block_size, C)
-            
-            # Áp dụng phép toán hình thái học để nối các đường gần nhau
-            kernel = np.ones((2, 2), np.uint8)
-            binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-            
-            contours, hierarchy = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        # Bỏ các đoạn vẽ lại đường đã vẽ, nối các nét gần chạm nhau, sắp xếp lại thứ tự nét và
+        # chọn điểm vào từng nét để giảm quãng đường nhấc bút (bắt đầu từ gốc robot), rồi nối
+        # các nét liền nhau đã gần chạm
+        drawn_before = pen_down_length(robot_path)
+        robot_path = dedup_strokes(robot_path, params['pen_width'])
+        drawn_after = pen_down_length(robot_path)
+        # Bỏ nét trùng có thể tách nét, nên số lần nhấc bút và quãng nhấc bút đo sau bước này
+        travel_before = pen_up_length(robot_path)
+        lifts_before = robot_path.num_strokes
+        robot_path = merge_strokes(robot_path, params['merge_gap'])
+        robot_path = choose_entry_points(order_strokes(robot_path))
+        robot_path = join_adjacent(robot_path, params['merge_gap'])
+        travel_after = pen_up_length(robot_path)
+        if self.is_stale(generation):
+            return None
+        # Dịch sang góc khớp; đoạn vẽ bị cong khi nội suy theo góc khớp được chia nhỏ ngay tại đây
+        job = JointJob(robot_path, self.L1, self.L2, auto_elbow=params['auto_elbow'],
+                       tolerance=params['joint_tolerance_mm'] or None,
+                       max_speed=self.joint_speed, max_accel=self.joint_accel)
+        robot_path = job.path
+        return {
+            'image': img,
+            'image_shape': image_shape,
+            'drawing_path': drawing_path,
+            'robot_path': robot_path,
+            'job': job,
+            'gcode': generate_gcode(robot_path),
+            'threshold_text': threshold_text,
+            'reach_text': reach_text,
+            'joint_text': (f"Quãng quay khớp: {job.travel_down:.0f}° (khuỷu xuống) -> {job.travel:.0f}° "
+                           f"(-{100 * (1 - job.travel / job.travel_down) if job.travel_down else 0:.1f}%), "
+                           f"thời gian dự kiến {job.total_time:.0f} s"),
+            'travel_text': (f"Nhấc bút: {travel_before:.0f} -> {travel_after:.0f} mm "
+                            f"(-{100 * (1 - travel_after / travel_before) if travel_before else 0:.0f}%), "
+                            f"bỏ {lifts_before - robot_path.num_strokes} lần nhấc bút, "
+                            f"nét trùng -{100 * (1 - drawn_after / drawn_before) if drawn_before else 0:.1f}%"),
+        }
+    
+    def apply_processing_result(self, generation, result, elapsed):
+        """Cập nhật giao diện với kết quả xử lý (chạy trên luồng giao diện)"""
+        self.cache_var.set(self.path_cache.stats_text())
+        if self.is_stale(generation):
+            return
         
-        else:
-            raise ValueError(f"Phương pháp không hợp lệ: {method}")
+        if isinstance(result, Exception):
+            self.process_var.set(f"Xử lý: lỗi sau {elapsed:.2f} s")
+            messagebox.showerror("Lỗi", f"Không thể xử lý ảnh: {str(result)}")
+            return
         
-        # Sắp xếp contour theo kích thước (từ lớn đến nhỏ)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)
+        self.original_image = result['image']
+        self.image_shape = result['image_shape']
+        self.drawing_path = result['drawing_path']
+        self.robot_path = result['robot_path']
+        self.job = result['job']
+        self.gcode_list = result['gcode']
+        
+        # Hiển thị ảnh thu nhỏ (nếu vừa tạo) và đường nét
+        self.thumbnail_ready(self.current_image)
+        self.show_drawing_path()
+        
+        # Cập nhật thông tin
+        self.threshold_info_var.set(result['threshold_text'])
+        self.process_var.set(f"Xử lý: {elapsed:.2f} s")
+        self.points_var.set(f"Số điểm: {self.robot_path.num_commands}")
+        self.travel_var.set(result['travel_text'])
+        self.reach_var.set(result['reach_text'])
+        self.joint_var.set(result['joint_text'])
+        self.progress_var.set("Tiến độ: 0%")
+        self.progress['value'] = 0
+    
+    def schedule_preview(self, value=None):
+        """Gọi khi thanh trượt đang được kéo: xem trước ở độ phân giải thấp, hẹn xử lý đầy đủ"""
+        # Gộp các sự kiện kéo liên tiếp thành một lần xem trước mỗi vòng lặp sự kiện
+        if self.preview_job is None:
+            self.preview_job = self.root.after_idle(self.preview_current_image)
+        
+        # Xử lý độ phân giải đầy đủ khi giá trị đứng yên đủ lâu
+        if self.settle_job is not None:
+            self.root.after_cancel(self.settle_job)
+        self.settle_job = self.root.after(self.settle_ms, self.commit_current_image)
+    
+    def commit_current_image(self, event=None):
+        """Xử lý đầy đủ với giá trị hiện tại của thanh trượt"""
+        if self.settle_job is not None:
+            self.root.after_cancel(self.settle_job)
+            self.settle_job = None
+        self.process_current_image()
+    
+    def preview_current_image(self):
+        """Trích xuất trên ảnh thu nhỏ và hiển thị ngay"""
+        self.preview_job = None
+        if not self.current_image or not os.path.exists(self.current_image):
+            return
         
-        # Tạo danh sách điểm từ contours, ưu tiên contour lớn trước
-        for contour in contours:
-            # Bỏ qua contour quá nhỏ
-            if cv2.contourArea(contour) < 10:  # Giảm kích thước tối thiểu để bắt nhiều chi tiết hơn
-                continue
-            
-            # Độ chi tiết của đường viền phụ thuộc vào detail_level
-            epsilon = epsilon_factor * cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, epsilon, True)
-            
-            # Thêm điểm đánh dấu đường viền mới
-            if len(drawing_path) > 0:
-                drawing_path.append((-1, -1))  # Đánh dấu đường viền mới
-            
-            # Thêm các điểm từ đường viền này
-            for point in approx:
-                x, y = point[0]
-                drawing_path.append((x, y))
+        start = time.perf_counter()
+        tolerance_mm = self.tolerance_mm_var.get() if self.simplify_mode_var.get() == "mm" else None
+        try:
+            _, preview_path = self.preview_pipeline.extract(
+                self.current_image, self.threshold_var.get(), self.invert_var.get(), self.method_var.get(),
+                self.detail_var.get(), self.threshold_mode_var.get(), self.target_fraction,
+                self.tolerance_pixels(self.current_image, tolerance_mm)
+            )
+        except ValueError:
+            # Không có đường nét ở giá trị này - bỏ qua, chờ giá trị tiếp theo
+            return
         
-        # Đảm bảo có đường nét để vẽ
-        if not drawing_path:
-            # Nếu không tìm thấy đường viền với ngưỡng hiện tại, thử lại với ngưỡng thấp hơn
-            if method == "contour" and threshold > 50:
-                print("Thử lại với ngưỡng thấp hơn:", threshold - 30)
-                return self.extract_drawing_path(image_path, threshold - 30, invert, method, detail_level)
-            else:
-                raise ValueError("Không thể trích xuất đường nét từ ảnh. Hãy thử điều chỉnh ngưỡng hoặc phương pháp.")
+        self.show_drawing_path(preview_path)
+        self.preview_var.set(f"Xem trước: {(time.perf_counter() - start) * 1000:.0f} ms "
+                             f"({preview_path.num_strokes} nét)")
+    
+    def tolerance_pixels(self, image_path, tolerance_mm):
+        """Đổi sai số đơn giản hóa từ mm trên giấy sang điểm ảnh gốc (None: dùng mức chi tiết)"""
+        if tolerance_mm is None or tolerance_mm <= 0:
+            return None
+        width, height = image_dimensions(image_path)
+        return tolerance_mm / workspace_scale(width, height, self.workspace_size)
+    
+    def get_drawing_path(self, image_path, threshold, invert, method, detail_level, threshold_mode="manual",
+                         tolerance=None):
+        """Lấy đường nét từ cache nếu đã trích xuất với cùng ảnh và tham số, nếu không thì trích xuất mới
+        
+        Trả về (ảnh hoặc None, kích thước ảnh, đường nét, mô tả ngưỡng); không chạm vào biến Tk.
+        """
+        # Ở chế độ tự động, ngưỡng trên thanh trượt không ảnh hưởng đến kết quả
+        key_threshold = threshold if threshold_mode == "manual" else -1
+        key = make_key(self.path_cache.image_hash(image_path), key_threshold, invert, method, detail_level,
+                       threshold_mode, tolerance)
+        
+        cached = self.path_cache.get(key)
+        if cached is not None:
+            # Không cần giữ ảnh gốc, chỉ cần kích thước để chuyển tọa độ
+            image_shape, drawing_path = cached
+            return None, image_shape, drawing_path, "Ngưỡng: (từ cache)"
+        
+        img, drawing_path = self.extract_drawing_path(
+            image_path, threshold, invert, method, detail_level, threshold_mode, tolerance
+        )
         
+        info = self.threshold_info
+        threshold_text = (f"Ngưỡng: {info['chosen']} ({info['mode']}, {len(info['tried'])} lần thử, "
+                          f"{info['seconds'] * 1000:.1f} ms)")
+        image_shape = img.shape[:2]
+        self.path_cache.put(key, image_shape, drawing_path)
+        return img, image_shape, drawing_path, threshold_text
+    
+    def extract_drawing_path(self, image_path, threshold=128, invert=True, method="contour", detail_level=2.0,
+                             threshold_mode="manual", tolerance=None):
+        """Trích xuất đường nét từ ảnh với nhiều phương pháp khác nhau"""
+        # Pipeline giữ lại ảnh trung gian: đổi ngưỡng không phải đọc/làm mịn lại ảnh,
+        # đổi mức chi tiết chỉ chạy lại approxPolyDP
+        if self.tiled_extractor.supports(method) and image_pixel_count(image_path) >= self.tiled_min_pixels:
+            # Ảnh rất lớn: xử lý theo ô trên nhiều tiến trình, đọc từng ô từ file ảnh xám memory-map
+            img, drawing_path = self.tiled_extractor.extract(image_path, threshold, invert, method, detail_level,
+                                                             threshold_mode, self.target_fraction, tolerance)
+            self.threshold_info = self.tiled_extractor.threshold_info
+            return img, drawing_path
+        
+        img, drawing_path = self.pipeline.extract(image_path, threshold, invert, method, detail_level,
+                                                  threshold_mode, self.target_fraction, tolerance)
+        self.threshold_info = self.pipeline.threshold_info
         return img, drawing_path
     
-    def optimize_path(self, drawing_path):
-        """Tối ưu đường đi để có chuyển động mượt hơn"""
+    def optimize_path(self, drawing_path, chord_error=None):
+        """Tối ưu đường đi để có chuyển động mượt hơn
+        
+        chord_error (điểm ảnh): lấy mẫu theo độ cong thay cho nội suy đều theo step_size.
+        """
         if not drawing_path:
-            return []
-            
-        optimized_path = []
-        current_contour = []
-        
-        for point in drawing_path:
-            if point == (-1, -1):  # Đánh dấu đường viền mới
-                if current_contour:
-                    # Đóng đường viền (kết nối điểm đầu và cuối)
-                    if len(current_contour) > 1 and current_contour[0] != current_contour[-1]:
-                        current_contour.append(current_contour[0])
-                    
-                    # Thêm vào đường đi tối ưu
-                    optimized_path.extend(current_contour)
-                    
-                    # Đánh dấu bắt đầu đường viền mới
-                    if optimized_path:
-                        optimized_path.append((-1, -1))
-                        
-                current_contour = []
-            else:
-                current_contour.append(point)
+            return PathBuffer()
         
-        # Xử lý contour cuối cùng
-        if current_contour:
-            # Đóng đường viền nếu cần
-            if len(current_contour) > 1 and current_contour[0] != current_contour[-1]:
-                current_contour.append(current_contour[0])
-            
-            # Thêm vào đường đi tối ưu
-            optimized_path.extend(current_contour)
+        # Đóng đường viền (kết nối điểm đầu và cuối)
+        optimized_path = close_strokes(drawing_path)
+        
+        if chord_error:
+            return resample_strokes(optimized_path, chord_error)
         
         # Nội suy thêm điểm để đường đi mượt hơn
-        interpolated_path = []
-        for i in range(len(optimized_path)):
-            if optimized_path[i] == (-1, -1):
-                interpolated_path.append((-1, -1))
-                continue
-                
-            # Thêm điểm hiện tại
-            interpolated_path.append(optimized_path[i])
-            # Nội suy thêm điểm giữa điểm hiện tại và điểm tiếp theo
-            if i < len(optimized_path) - 1 and optimized_path[i+1] != (-1, -1) and optimized_path[i] != (-1, -1):
-                x1, y1 = optimized_path[i]
-                x2, y2 = optimized_path[i+1]
-                
-                # Tính khoảng cách giữa 2 điểm
-                distance = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-                
-                # Nếu khoảng cách đủ lớn, thêm điểm ở giữa
-                step = self.step_size
-                if distance > step * 2:
-                    num_points = int(distance / step) - 1
-                    for j in range(1, num_points + 1):
-                        ratio = j / (num_points + 1)
-                        x = x1 + (x2 - x1) * ratio
-                        y = y1 + (y2 - y1) * ratio
-                        interpolated_path.append((x, y))
-        
-        return interpolated_path
+        return interpolate_strokes(optimized_path, self.step_size)
     
-    def convert_to_robot_coords(self, drawing_path):
+    def convert_to_robot_coords(self, drawing_path, image_shape=None, offset=None):
         """Chuyển đường nét từ tọa độ ảnh sang tọa độ robot với việc xử lý nhấc/hạ bút tốt hơn"""
-        robot_coords = []
-        
         # Tìm kích thước ảnh
-        if self.original_image is not None:
-            height, width = self.original_image.shape
+        if image_shape is not None:
+            height, width = image_shape
+        elif self.original_image is not None:
+            height, width = self.original_image.shape[:2]
+        elif self.image_shape is not None:
+            height, width = self.image_shape
         else:
             height, width = self.image_size, self.image_size
         
         # Tỷ lệ chuyển đổi
-        scale = self.workspace_size / max(width, height) * 0.8  # thu nhỏ hình một chút
+        scale = workspace_scale(width, height, self.workspace_size)
         
-        # Lấy offset từ giao diện
-        offset_x = self.offset_x.get()
-        offset_y = self.offset_y.get()
+        # Lấy offset từ giao diện (luồng nền truyền vào giá trị đã đọc sẵn)
+        if offset is None:
+            offset = (self.offset_x.get(), self.offset_y.get())
+        offset_x, offset_y = offset
         
-        current_segments = []
-        current_segment = []
-        
-        # Tách các đoạn (khoảng cách -1, -1)
-        for point in drawing_path:
-            if point == (-1, -1):
-                if current_segment:
-                    current_segments.append(current_segment)
-                    current_segment = []
-            else:
-                current_segment.append(point)
-        
-        # Thêm đoạn cuối cùng nếu có
-        if current_segment:
-            current_segments.append(current_segment)
-        
-        # Nhấc bút lên ở vị trí bắt đầu
-        first_segment = True
-        
-        # Tạo đường đi robot với việc nhấc/hạ bút rõ ràng
-        for segment in current_segments:
-            if not segment:
-                continue
-            
-            # Chuyển đổi các điểm trong segment sang tọa độ robot
-            robot_segment = []
-            for point in segment:
-                x_img, y_img = point
-                x_robot = (x_img - width/2) * scale + offset_x
-                y_robot = (height/2 - y_img) * scale + offset_y
-                robot_segment.append((x_robot, y_robot))
-            
-            # Thêm lệnh nhấc bút và di chuyển đến điểm đầu tiên của segment
-            first_x, first_y = robot_segment[0]
-            
-            # Nhấc bút lên trước khi di chuyển đến vị trí mới
-            robot_coords.append((first_x, first_y, 0))  # Di chuyển với bút lên
-            
-            # Hạ bút xuống tại vị trí đầu của segment
-            robot_coords.append((first_x, first_y, 1))  # Hạ bút xuống
-            
-            # Thêm các điểm còn lại trong segment (đều với bút hạ xuống)
-            for x, y in robot_segment[1:]:
-                robot_coords.append((x, y, 1))  # Vẽ với bút xuống
-            
-            # Nhấc bút lên tại điểm cuối của segment
-            last_x, last_y = robot_segment[-1]
-            robot_coords.append((last_x, last_y, 0))  # Nhấc bút lên
+        # Giữ nguyên cấu trúc nét; việc nhấc/hạ bút ở đầu/cuối mỗi nét được
+        # sinh ra từ PathBuffer.commands() khi cần
+        robot_coords = image_to_robot(drawing_path, width, height, scale, offset_x, offset_y)
         
         return self.original_image, robot_coords
     
     def generate_gcode(self):
         """Tạo G-code từ đường đi robot"""
-        gcode = []
-        
-        # Thêm tiêu đề và các lệnh khởi tạo
-        gcode.append("; Generated G-code for drawing")
-        gcode.append("; Created by Robot Drawing Controller")
-        gcode.append("G21 ; Set units to millimeters")
-        gcode.append("G90 ; Use absolute coordinates")
-        gcode.append("G92 X0 Y0 Z0 ; Reset position")
-        gcode.append("G0 Z5 ; Lift pen to safe height")
-        gcode.append("G0 X0 Y0 ; Move to home position")
-        
-        # Feedrate (tốc độ di chuyển)
-        travel_speed = 3000  # mm/min khi di chuyển không vẽ
-        drawing_speed = 4000  # mm/min khi vẽ
-        
-        pen_up_position = 5  # mm
-        pen_down_position = 0  # mm
-        
-        prev_pen_state = 0  # Bắt đầu với bút lên
-        
-        for x, y, pen_state in self.robot_path:
-            # Nếu trạng thái bút thay đổi
-            if pen_state != prev_pen_state:
-                if pen_state == 1:  # Hạ bút xuống
-                    gcode.append(f"G0 Z{pen_down_position} ; Lower pen")
-                    gcode.append(f"G1 F{drawing_speed} ; Set drawing speed")
-                else:  # Nâng bút lên
-                    gcode.append(f"G0 Z{pen_up_position} ; Lift pen")
-                    gcode.append(f"G0 F{travel_speed} ; Set travel speed")
-                prev_pen_state = pen_state
-            
-            # Lệnh di chuyển
-            if pen_state == 1:
-                # Bút xuống - vẽ đường
-                gcode.append(f"G1 X{x:.2f} Y{y:.2f}")
-            else:
-                # Bút lên - di chuyển
-                gcode.append(f"G0 X{x:.2f} Y{y:.2f}")
-        
-        # Kết thúc với bút lên và về home
-        gcode.append("G0 Z5 ; Lift pen to safe height")
-        gcode.append("G0 X0 Y0 ; Return to home position")
-        
-        self.gcode_list = gcode
-        return gcode
+        self.gcode_list = generate_gcode(self.robot_path)
+        return self.gcode_list
     
     def save_gcode(self):
         """Lưu G-code vào file"""
@@ -715,111 +857,105 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         # Nút đóng
         ttk.Button(gcode_window, text="Đóng", command=gcode_window.destroy).pack(pady=10)
     
-    def show_drawing_path(self):
-        """Hiển thị đường nét trích xuất"""
-        self.ax_path.clear()
-        
-        if not self.drawing_path:
+    def ensure_path_figure(self):
+        """Tạo figure hiển thị đường nét ở lần vẽ đầu tiên"""
+        if self.fig_path is not None:
             return
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         
-        # Phân tách các đường viền để vẽ
-        segments = []
-        current_segment = []
+        self.path_placeholder.destroy()
+        self.fig_path = Figure(figsize=(4, 4), dpi=100)
+        self.ax_path = self.fig_path.add_subplot(111)
+        self.canvas_path = FigureCanvasTkAgg(self.fig_path, master=self.path_frame)
+        self.canvas_path.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    
+    def ensure_robot_figure(self):
+        """Tạo figure mô phỏng robot ở lần vẽ đầu tiên"""
+        if self.fig_robot is not None:
+            return
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         
-        for point in self.drawing_path:
-            if point == (-1, -1):
-                if current_segment:
-                    segments.append(current_segment)
-                    current_segment = []
-            else:
-                current_segment.append(point)
+        self.robot_placeholder.destroy()
+        self.fig_robot = Figure(figsize=(8, 5), dpi=100)
+        self.ax_robot = self.fig_robot.add_subplot(111)
+        self.canvas_robot = FigureCanvasTkAgg(self.fig_robot, master=self.robot_frame)
+        self.canvas_robot.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    
+    def show_drawing_path(self, drawing_path=None):
+        """Hiển thị đường nét trích xuất"""
+        self.ensure_path_figure()
+        self.ax_path.clear()
         
-        # Thêm đoạn cuối cùng nếu có
-        if current_segment:
-            segments.append(current_segment)
+        if drawing_path is None:
+            drawing_path = self.drawing_path
+        if not drawing_path:
+            return
         
         # Vẽ từng đoạn với màu khác nhau
         colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
-        
-        for i, segment in enumerate(segments):
-            color = colors[i % len(colors)]
-            
-            x_vals = [p[0] for p in segment]
-            y_vals = [p[1] for p in segment]
-            
-            self.ax_path.plot(x_vals, y_vals, f'{color}-', linewidth=1.2)
+        self.plot_strokes(self.ax_path, drawing_path, colors, linewidth=1.2)
         
         self.ax_path.set_aspect('equal')
         self.ax_path.axis('off')
         
         self.canvas_path.draw()
     
-    def simulate_robot_arm(self, robot_coords, frame_idx):
-        """Mô phỏng cánh tay robot và hiển thị quá trình vẽ"""
+    def plot_strokes(self, ax, path, colors, partial=None, **kwargs):
+        """Vẽ các nét của PathBuffer, mỗi màu chỉ một lệnh plot (các nét ngăn cách bằng NaN)"""
+        stroke_ids = np.arange(path.num_strokes)
+        for i, color in enumerate(colors):
+            points = path.nan_separated(stroke_ids[i::len(colors)])
+            if partial is not None and partial[0] % len(colors) == i:
+                points = np.vstack([points, [[np.nan, np.nan]], partial[1]])
+            if len(points):
+                ax.plot(points[:, 0], points[:, 1], color=color, **kwargs)
+    
+    def simulate_robot_arm(self, job, frame_idx):
+        """Mô phỏng cánh tay robot và hiển thị quá trình vẽ (job: JointJob đang được vẽ)"""
+        self.ensure_robot_figure()
         self.ax_robot.clear()
         
-        if not robot_coords or frame_idx >= len(robot_coords):
+        robot_coords = job.path
+        if not robot_coords or frame_idx >= robot_coords.num_commands:
             return
         
         # Vẽ lưới nhẹ làm nền
         self.ax_robot.grid(True, linestyle='--', alpha=0.3)
         
-        # Vẽ đường đã vẽ (chỉ những điểm có pen_state = 1)
-        path_x = []
-        path_y = []
-        
-        # Tách đường thành nhiều đoạn dựa vào trạng thái bút
-        drawing_segments = []
-        current_segment = []
-        pen_down = False
-        
-        for i, (x, y, pen) in enumerate(robot_coords[:frame_idx+1]):
-            if pen == 1:  # Bút đang hạ xuống
-                if not pen_down:  # Bút vừa được hạ xuống
-                    pen_down = True
-                    current_segment = [(x, y)]
-                else:  # Bút tiếp tục vẽ
-                    current_segment.append((x, y))
-                    # Thêm vào đường đã vẽ
-                    self.drawn_path_x.append(x)
-                    self.drawn_path_y.append(y)
-            else:  # Bút đang nhấc lên
-                if pen_down:  # Bút vừa được nhấc lên
-                    pen_down = False
-                    if len(current_segment) > 1:
-                        drawing_segments.append(current_segment)
-                    current_segment = []
-        
-        # Thêm đoạn cuối cùng nếu bút vẫn đang hạ xuống
-        if pen_down and len(current_segment) > 1:
-            drawing_segments.append(current_segment)
+        # Nét đang vẽ và số điểm đã vẽ của nét đó - các nét trước đã vẽ xong
+        stroke_idx, drawn_points = robot_coords.locate_command(frame_idx)
+        done = np.arange(stroke_idx)
+        done = done[(robot_coords.pen[done] == 1) & (robot_coords.stroke_lengths()[done] > 1)]
+        drawn = robot_coords.subset(done)
+        partial = None
+        if drawn_points > 1:
+            partial = (drawn.num_strokes, robot_coords.stroke(stroke_idx)[:drawn_points])
+        
+        # Lưu đường đã vẽ để hiển thị khi robot di chuyển dài
+        drawn_xy = drawn.nan_separated()
+        if partial is not None:
+            drawn_xy = np.vstack([drawn_xy, [[np.nan, np.nan]], partial[1]])
+        self.drawn_path_x, self.drawn_path_y = drawn_xy[:, 0], drawn_xy[:, 1]
         
         # Vẽ từng đoạn với màu khác nhau
         colors = ['green', 'blue', 'red', 'purple', 'orange', 'teal']
-        for i, segment in enumerate(drawing_segments):
-            color = colors[i % len(colors)]
-            segment_x = [p[0] for p in segment]
-            segment_y = [p[1] for p in segment]
-            self.ax_robot.plot(segment_x, segment_y, color=color, linewidth=1.5, zorder=2)
+        self.plot_strokes(self.ax_robot, drawn, colors, partial=partial, linewidth=1.5, zorder=2)
         
         # Lấy tọa độ và trạng thái bút hiện tại
-        x, y, pen = robot_coords[frame_idx]
+        x, y, pen = robot_coords.command(frame_idx)
         
-        # Tính góc từ tọa độ bằng động học ngược
-        angles = self.inverse_kinematics(x, y)
-        if not angles:
+        # Góc khớp đã tính sẵn trong job của lần vẽ này (không phụ thuộc kết quả xử lý mới hơn)
+        if not job.reachable[frame_idx]:
             return
         
-        theta1, theta2 = angles
+        theta1, theta2 = job.theta1[frame_idx], job.theta2[frame_idx]
         self.theta1_var.set(f"θ1: {theta1:.1f}°")
         self.theta2_var.set(f"θ2: {theta2:.1f}°")
         
         # Tính toán vị trí điểm nối và điểm cuối
-        x1 = self.L1 * np.cos(np.radians(theta1))
-        y1 = self.L1 * np.sin(np.radians(theta1))
-        
-        x2 = x1 + self.L2 * np.cos(np.radians(theta1 + theta2))
-        y2 = y1 + self.L2 * np.sin(np.radians(theta1 + theta2))
+        x1, y1, x2, y2 = forward_kinematics(theta1, theta2, self.L1, self.L2)
         
         # Vẽ cánh tay robot với độ dày và màu sắc rõ ràng hơn
         self.ax_robot.plot([0, x1], [0, y1], 'ro-', linewidth=4, markersize=8, zorder=3)  # Link 1
@@ -831,14 +967,15 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         
         # Hiển thị trạng thái bút
         pen_status = "Đang vẽ" if pen == 1 else "Nhấc lên"
-        self.ax_robot.set_title(f"Mô phỏng robot - Điểm {frame_idx+1}/{len(robot_coords)} - Bút: {pen_status}")
+        self.ax_robot.set_title(f"Mô phỏng robot - Điểm {frame_idx+1}/{robot_coords.num_commands} - Bút: {pen_status}")
         
         # Vẽ vùng làm việc
-        circle = plt.Circle((0, 0), self.L1 + self.L2, fill=False, color='gray', linestyle='--', alpha=0.5)
+        from matplotlib.patches import Circle
+        circle = Circle((0, 0), self.L1 + self.L2, fill=False, color='gray', linestyle='--', alpha=0.5)
         self.ax_robot.add_patch(circle)
         
         if abs(self.L1 - self.L2) > 1:
-            inner_circle = plt.Circle((0, 0), abs(self.L1 - self.L2), fill=False, color='gray', linestyle='--', alpha=0.5)
+            inner_circle = Circle((0, 0), abs(self.L1 - self.L2), fill=False, color='gray', linestyle='--', alpha=0.5)
             self.ax_robot.add_patch(inner_circle)
         
         # Vẽ trục tọa độ
@@ -855,18 +992,25 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         self.canvas_robot.draw()
     
     def inverse_kinematics(self, x, y):
-        """Tính động học ngược (x, y) -> (theta1, theta2)"""
-        d = (x**2 + y**2 - self.L1**2 - self.L2**2) / (2 * self.L1 * self.L2)
-        
-        if abs(d) > 1:  # Điểm ngoài tầm với
+        """Tính động học ngược (x, y) -> (theta1, theta2) cho một điểm; None nếu ngoài tầm với"""
+        theta1, theta2, ok = solve_joint_angles(x, y, self.L1, self.L2)
+        if not ok:
             return None
-            
-        # Sử dụng elbow-down configuration để được đường đi mượt hơn
-        theta2 = -np.arccos(d)  # Dấu trừ để cánh tay hướng xuống
-        theta1 = np.arctan2(y, x) - np.arctan2(self.L2 * np.sin(theta2), self.L1 + self.L2 * np.cos(theta2))
-        
-        # Chuyển từ radian sang độ
-        return np.degrees(theta1), np.degrees(theta2)
+        return float(theta1), float(theta2)
+    
+    def joint_job(self):
+        """JointJob của robot_path hiện tại; thường đã được luồng xử lý ảnh tính sẵn (kèm chia nhỏ
+        theo sai số khớp), chỉ tính lại khi thiếu"""
+        robot_path = self.robot_path
+        job = self.job
+        if job is None or job.path is not robot_path:
+            # Cùng tham số như compute_drawing (đường đi đã chia nhỏ thì gần như không đổi)
+            job = JointJob(robot_path, self.L1, self.L2, auto_elbow=self.auto_elbow_var.get(),
+                           tolerance=self.joint_tolerance_var.get() or None,
+                           max_speed=self.joint_speed, max_accel=self.joint_accel)
+            # Gán một lần: luồng vẽ và luồng giao diện có thể đọc cùng lúc
+            self.job = job
+        return job
     
     def toggle_connection(self):
         """Kết nối/ngắt kết nối với Arduino"""
@@ -881,6 +1025,8 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             port = self.com_port.get()
             baudrate = self.baudrate.get()
             try:
+                import serial
+                
                 self.arduino = serial.Serial(port, baudrate, timeout=1)
                 time.sleep(2)  # Chờ Arduino sẵn sàng
                 self.is_connected = True
@@ -981,8 +1127,12 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         except Exception as e:
             messagebox.showerror("Test Error", f"Error during motor test: {str(e)}")
 
-    def move_physical_robot(self, prev_angles, theta1, theta2, pen):
-        """Điều khiển robot thực tế với chuyển động mượt mà và đồng bộ với servo"""
+    def move_physical_robot(self, prev_angles, theta1, theta2, pen, duration=1.0):
+        """Điều khiển robot thực tế với chuyển động mượt mà và đồng bộ với servo
+
+        duration: thời gian của đoạn theo kế hoạch (giây) - chờ xác nhận từ Arduino không quá
+        khoảng này. Sau PU/PD luôn chờ servo xong; kế hoạch để sẵn khoảng chờ này trước lệnh sau.
+        """
         if not self.is_connected or not self.arduino:
             return False
         
@@ -997,35 +1147,32 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             # If changing from drawing to lifting, lift pen before moving
             if hasattr(self, 'current_pen') and self.current_pen == 1 and pen == 0:
                 self.send_command("PU")  # Lift pen first
-                time.sleep(self.servo_delay * 3)  # Wait longer to ensure pen is lifted
+                time.sleep(self.servo_delay * 3)  # Wait for the pen to be lifted before moving
                 self.current_pen = 0
             
             # Direct angle command - the Arduino code expects angles directly
             command = f"GOTO {theta1:.2f} {theta2:.2f}"
             success = self.send_command(command)
             
-            # Add a delay to ensure the command is processed
-            time.sleep(self.motor_delay * 2)
-            
             # Wait for a response to confirm movement is complete
             if success:
                 # Try to get a response
                 response = ""
                 start_time = time.time()
-                while time.time() - start_time < 1.0:  # Timeout after 1 second
+                while time.time() - start_time < duration:  # Timeout after the planned move time
                     if self.arduino.in_waiting > 0:
                         response += self.arduino.readline().decode().strip()
                         if "Moved to angle" in response:
                             break
-                    time.sleep(0.1)
+                    time.sleep(min(0.01, duration))
                 
-                if not response:
+                if not response and duration > 0:
                     print("Warning: No movement confirmation received")
             
             # If changing from lifting to drawing, lower pen after movement
             if (not hasattr(self, 'current_pen') or self.current_pen == 0) and pen == 1:
                 self.send_command("PD")  # Lower pen after reaching position
-                time.sleep(self.servo_delay * 3)  # Wait longer to ensure pen is down
+                time.sleep(self.servo_delay * 3)  # Wait for the pen to be down before drawing
                 self.current_pen = 1
                 
             return True
@@ -1056,8 +1203,9 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             
             self.prev_angles = [0, 0]
 
-            # Bắt đầu vẽ trong một thread riêng biệt
-            self.drawing_thread = threading.Thread(target=self.drawing_process)
+            # Bắt đầu vẽ trong một thread riêng biệt, với góc khớp đã tính xong cho mọi lệnh
+            self.drawing_thread = threading.Thread(target=self.drawing_process,
+                                                   args=(self.joint_job(),))
             self.drawing_thread.daemon = True
             self.drawing_thread.start()
             
@@ -1091,43 +1239,37 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             # Reset góc hiện tại
             self.prev_angles = [0, 0]
             
-            # Bắt đầu vẽ trong một thread riêng biệt
-            self.drawing_thread = threading.Thread(target=self.drawing_process)
+            # Bắt đầu vẽ trong một thread riêng biệt, với góc khớp đã tính xong cho mọi lệnh
+            self.drawing_thread = threading.Thread(target=self.drawing_process,
+                                                   args=(self.joint_job(),))
             self.drawing_thread.daemon = True
             self.drawing_thread.start()
     
-    def gcode_simulation_process(self):
+    def gcode_simulation_process(self, job):
         """Mô phỏng quá trình vẽ sử dụng G-code"""
         try:
-            total_points = len(self.robot_path)
+            total_points = len(job)
             print(f"Bắt đầu mô phỏng {total_points} điểm với G-code")
+            if job.skipped:
+                print(f"Bỏ qua {job.skipped} điểm ngoài tầm với")
             
-            # Lặp qua từng điểm trong đường đi robot
-            for i, (x, y, pen) in enumerate(self.robot_path):
+            # Lặp qua các bước đã tính sẵn trong job, theo nhịp thời gian của kế hoạch chuyển động
+            begin = time.perf_counter()
+            for i, x, y, pen, theta1, theta2, is_long_move, start, duration in job.steps():
                 # Kiểm tra dừng
                 if self.stop_drawing:
                     break
+                self.wait_until(begin + start)
                 
                 # Hiển thị mô phỏng
-                self.root.after(0, lambda idx=i: self.simulate_robot_arm(self.robot_path, idx))
-                
-                # Tính toán góc
-                angles = self.inverse_kinematics(x, y)
+                self.root.after(0, lambda idx=i: self.simulate_robot_arm(job, idx))
                 
-                if not angles:
-                    print(f"Bỏ qua điểm {i}: Ngoài tầm với ({x}, {y})")
-                    continue
-                
-                theta1, theta2 = angles
                 self.theta1_var.set(f"θ1: {theta1:.1f}°")
                 self.theta2_var.set(f"θ2: {theta2:.1f}°")
                 
                 # Cập nhật tiến độ
                 progress = (i + 1) / total_points * 100
                 self.root.after(0, lambda p=progress: self.update_progress(p))
-                
-                # Chờ một chút giữa các điểm
-                time.sleep(0.05)
             
         except Exception as e:
             self.root.after(0, lambda: messagebox.showerror("Lỗi", f"Lỗi trong quá trình mô phỏng: {str(e)}"))
@@ -1136,63 +1278,53 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             self.is_drawing = False
             self.root.after(0, self.reset_drawing_ui)
     
-    def drawing_process(self):
-        """Quá trình vẽ (chạy trong thread riêng) với animation di chuyển"""
+    def drawing_process(self, job):
+        """Quá trình vẽ (chạy trong thread riêng) với animation di chuyển
+        
+        job (JointJob) đã có sẵn góc khớp và loại di chuyển của mọi lệnh: vòng lặp chỉ gửi lệnh
+        và chờ, không tính toán xen giữa các lệnh.
+        """
         try:
-            total_points = len(self.robot_path)
+            total_points = len(job)
             print(f"Bắt đầu vẽ {total_points} điểm")
+            if job.skipped:
+                print(f"Bỏ qua {job.skipped} điểm ngoài tầm với")
             
-            # Lệnh về home trước khi bắt đầu
+            # Lệnh về home trước khi bắt đầu; chờ về home và nâng bút xong rồi mới tính giờ theo kế hoạch
             self.send_command("HOME")
             self.send_command("PU")  # Nâng bút lên
             time.sleep(1)
             
-            # Theo dõi chuyển động giữa các điểm
-            prev_x, prev_y, prev_pen = 0, 0, 0  # Giả sử bắt đầu từ gốc toạ độ
+            # Theo dõi chuyển động giữa các điểm, bắt đầu từ vị trí đầu bút ở home
+            prev_x, prev_y = forward_kinematics(*self.prev_angles, self.L1, self.L2)[2:]
             
-            # Lặp qua từng điểm trong đường đi robot
-            for i, (x, y, pen) in enumerate(self.robot_path):
+            # Lặp qua các bước đã tính sẵn trong job: mỗi lệnh được gửi đúng thời điểm bắt đầu đoạn
+            # theo kế hoạch chuyển động (bị trễ thì gửi ngay, không cộng dồn thời gian chờ)
+            begin = time.perf_counter()
+            for i, x, y, pen, theta1, theta2, is_long_move, start, duration in job.steps():
                 # Kiểm tra dừng
                 if self.stop_drawing:
                     break
-                
-                # Tính toán góc tại điểm đích
-                angles = self.inverse_kinematics(x, y)
-                if not angles:
-                    print(f"Bỏ qua điểm {i}: Ngoài tầm với ({x}, {y})")
-                    continue
-                
-                theta1, theta2 = angles
-                
-                # Kiểm tra xem đây có phải là chuyển động nhấc bút và dời xa không
-                is_long_move = False
-                if prev_pen == 0 and pen == 0:  # Cả hai điểm đều có bút nhấc lên
-                    distance = np.sqrt((x - prev_x)**2 + (y - prev_y)**2)
-                    if distance > 20:  # Nếu khoảng cách đủ xa
-                        is_long_move = True
+                self.wait_until(begin + start)
                 
                 if is_long_move:
-                    # Tạo animation cho chuyển động dài giữa các đoạn vẽ
-                    self.animate_long_move(prev_x, prev_y, x, y, self.prev_angles, [theta1, theta2])
+                    # Tạo animation cho chuyển động dài giữa các đoạn vẽ, trải đều trên thời gian của đoạn
+                    self.animate_long_move(prev_x, prev_y, x, y, self.prev_angles, [theta1, theta2], duration)
                 else:
                     # Điều khiển robot thực tế
-                    self.move_physical_robot(self.prev_angles, theta1, theta2, pen)
+                    self.move_physical_robot(self.prev_angles, theta1, theta2, pen, duration)
                     
                     # Hiển thị mô phỏng
-                    self.root.after(0, lambda idx=i: self.simulate_robot_arm(self.robot_path, idx))
+                    self.root.after(0, lambda idx=i: self.simulate_robot_arm(job, idx))
                 
                 # Cập nhật góc hiện tại
                 self.prev_angles = [theta1, theta2]
-                prev_x, prev_y, prev_pen = x, y, pen
+                prev_x, prev_y = x, y
                 
                 # Cập nhật tiến độ
                 progress = (i + 1) / total_points * 100
                 self.root.after(0, lambda p=progress: self.update_progress(p))
                 
-                # Chờ một chút giữa các điểm nếu pen_state = 1 (đang vẽ)
-                if pen == 1:
-                    time.sleep(self.step_size * 0.01)
-                
             # Nâng bút khi kết thúc
             self.send_command("PU")
             
@@ -1206,6 +1338,12 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             self.is_drawing = False
             self.root.after(0, self.reset_drawing_ui)
 
+    def wait_until(self, deadline):
+        """Ngủ đến thời điểm deadline (time.perf_counter); không chờ nếu đã trễ"""
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    
     def update_progress(self, progress):
         """Cập nhật thanh tiến độ"""
         self.progress_var.set(f"Tiến độ: {progress:.1f}%")
@@ -1291,8 +1429,8 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             self.is_drawing = False
             self.root.after(0, self.reset_drawing_ui)
 
-    def animate_long_move(self, start_x, start_y, end_x, end_y, start_angles, end_angles):
-        """Tạo animation cho chuyển động dài giữa các đoạn vẽ"""
+    def animate_long_move(self, start_x, start_y, end_x, end_y, start_angles, end_angles, duration=1.0):
+        """Tạo animation cho chuyển động dài giữa các đoạn vẽ, kéo dài duration giây"""
         # Số lượng bước cho animation
         num_steps = 20
         
@@ -1304,7 +1442,8 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         d_theta1 = (end_angles[0] - start_angles[0]) / num_steps
         d_theta2 = (end_angles[1] - start_angles[1]) / num_steps
         
-        # Thực hiện animation
+        # Thực hiện animation theo mốc thời gian của từng bước
+        begin = time.perf_counter()
         for step in range(num_steps + 1):
             # Tính toạ độ hiện tại
             current_x = start_x + dx * step
@@ -1325,11 +1464,12 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             if step % 4 == 0:  # Chỉ gửi lệnh sau mỗi 4 bước để tránh quá tải
                 self.move_physical_robot_smooth(current_theta1, current_theta2, 0)
             
-            # Chờ một khoảng thời gian ngắn
-            time.sleep(0.05)  # Tốc độ animation - càng thấp càng nhanh
+            # Chờ đến mốc của bước tiếp theo
+            self.wait_until(begin + duration * min(step + 1, num_steps) / num_steps)
 
     def simulate_arm_at_point(self, point, theta1, theta2):
         """Mô phỏng cánh tay robot tại một điểm cụ thể"""
+        self.ensure_robot_figure()
         self.ax_robot.clear()
         
         x, y, pen = point
@@ -1342,11 +1482,7 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
             self.ax_robot.plot(self.drawn_path_x, self.drawn_path_y, 'g-', linewidth=1.5, zorder=2)
         
         # Tính toán vị trí điểm nối và điểm cuối
-        x1 = self.L1 * np.cos(np.radians(theta1))
-        y1 = self.L1 * np.sin(np.radians(theta1))
-        
-        x2 = x1 + self.L2 * np.cos(np.radians(theta1 + theta2))
-        y2 = y1 + self.L2 * np.sin(np.radians(theta1 + theta2))
+        x1, y1, x2, y2 = forward_kinematics(theta1, theta2, self.L1, self.L2)
         
         # Vẽ cánh tay robot với độ dày và màu sắc rõ ràng hơn
         self.ax_robot.plot([0, x1], [0, y1], 'ro-', linewidth=4, markersize=8, zorder=3)  # Link 1
@@ -1362,11 +1498,12 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         
         # Thiết lập các thuộc tính khác của đồ thị
         # Vẽ vùng làm việc
-        circle = plt.Circle((0, 0), self.L1 + self.L2, fill=False, color='gray', linestyle='--', alpha=0.5)
+        from matplotlib.patches import Circle
+        circle = Circle((0, 0), self.L1 + self.L2, fill=False, color='gray', linestyle='--', alpha=0.5)
         self.ax_robot.add_patch(circle)
         
         if abs(self.L1 - self.L2) > 1:
-            inner_circle = plt.Circle((0, 0), abs(self.L1 - self.L2), fill=False, color='gray', linestyle='--', alpha=0.5)
+            inner_circle = Circle((0, 0), abs(self.L1 - self.L2), fill=False, color='gray', linestyle='--', alpha=0.5)
             self.ax_robot.add_patch(inner_circle)
         
         # Vẽ trục tọa độ
@@ -1412,6 +1549,19 @@ Chú ý: Đảm bảo robot đã ở vị trí home trước khi vẽ."""
         
 # Chạy ứng dụng
 if __name__ == "__main__":
+    import sys
+    
     root = tk.Tk()
     app = RobotArmController(root)
+    
+    def report_startup(event):
+        """--startup-time: in thời gian từ lúc chạy đến khi cửa sổ hiện ra rồi thoát"""
+        if event.widget is not root:
+            return
+        root.unbind("<Map>")
+        print(f"Khởi động: cửa sổ hiện ra sau {time.perf_counter() - STARTUP_START:.3f}s")
+        root.after(0, root.destroy)
+    
+    if "--startup-time" in sys.argv:
+        root.bind("<Map>", report_startup)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""Lập kế hoạch thời gian chuyển động trong không gian khớp (hình thang vận tốc, có nhìn trước)
+
+Mỗi lệnh là một đoạn thẳng trong không gian góc khớp (độ). Tốc độ tối đa và gia tốc của từng
+đoạn suy ra từ giới hạn của từng khớp theo hướng đoạn đó. Tại chỗ nối hai đoạn, tốc độ được
+giữ lại nếu độ thay đổi vận tốc của mỗi khớp không vượt quá junction_jump (hai đoạn gần thẳng
+hàng không phải giảm về 0); chỗ đổi trạng thái bút thì dừng hẳn. Có thể giới hạn thêm tốc độ
+của từng đoạn và tại từng đỉnh (ví dụ feedrate vẽ và tốc độ qua góc gcode.corner_speeds, đã
+đổi sang đơn vị góc khớp).
+
+Lượt lùi/lượt tiến kiểu GRBL được viết dưới dạng cộng dồn + min tích lũy trên bình phương tốc
+độ, nên cả đường đi tính bằng numpy, không có vòng lặp Python theo từng lệnh.
+"""
+import numpy as np
+
+from gcode import PEN_TIME
+
+MAX_JOINT_SPEED = (180.0, 180.0)  # độ/giây - tốc độ tối đa của khớp 1, 2
+MAX_JOINT_ACCEL = (720.0, 720.0)  # độ/giây^2 - gia tốc tối đa của khớp 1, 2
+JUNCTION_JUMP = (10.0, 10.0)  # độ/giây - thay đổi vận tốc tức thời cho phép tại chỗ nối hai đoạn
+
+
+def _per_move_limit(unit, limits):
+    """Giới hạn theo tham số đường đi của đoạn có vector hướng unit: min_j limit_j / |u_j|"""
+    ratio = np.abs(unit) / np.asarray(limits, np.float64)
+    worst = ratio.max(axis=1)
+    return np.where(worst > 0, 1.0 / np.maximum(worst, 1e-300), np.inf)
+
+
+def trapezoid_durations(length, v0, v1, vmax, accel):
+    """Thời gian đi hết từng đoạn với hình thang vận tốc (tăng tốc - chạy đều - giảm tốc)"""
+    peak = np.minimum(vmax, np.sqrt((2 * accel * length + v0 * v0 + v1 * v1) / 2))
+    accel_dist = (peak * peak - v0 * v0) / (2 * accel)
+    decel_dist = (peak * peak - v1 * v1) / (2 * accel)
+    cruise = np.maximum(length - accel_dist - decel_dist, 0) / np.where(peak > 0, peak, 1)
+    return np.where(length > 0, (peak - v0) / accel + (peak - v1) / accel + cruise, 0.0)
+
+
+def plan_moves(delta1, delta2, pen, max_speed=MAX_JOINT_SPEED, max_accel=MAX_JOINT_ACCEL,
+               junction_jump=JUNCTION_JUMP, pen_time=PEN_TIME, move_speed=None, vertex_speed=None):
+    """Thời điểm bắt đầu và thời gian của từng đoạn (giây), bắt đầu và kết thúc đứng yên
+
+    delta1/delta2: độ thay đổi góc của từng đoạn (độ), pen: trạng thái bút sau mỗi đoạn.
+    move_speed / vertex_speed: giới hạn thêm (độ/giây theo tham số đường đi) cho từng đoạn và
+    tại điểm cuối từng đoạn; inf = không giới hạn.
+    Trả về (start, duration, speed) với speed là tốc độ tại điểm cuối từng đoạn. Sau đoạn đổi
+    trạng thái bút, đoạn kế tiếp chỉ bắt đầu sau thời gian nâng/hạ bút pen_time.
+    """
+    d = np.column_stack([np.asarray(delta1, np.float64), np.asarray(delta2, np.float64)])
+    pen = np.asarray(pen)
+    n = len(d)
+    if n == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    length = np.hypot(d[:, 0], d[:, 1])
+    moving = length > 0
+    unit = d / np.where(moving, length, 1)[:, None]
+    vmax = np.where(moving, _per_move_limit(unit, max_speed), 0.0)
+    if move_speed is not None:
+        vmax = np.minimum(vmax, move_speed)
+    accel = np.where(moving, _per_move_limit(unit, max_accel), 1.0)
+
+    # Giới hạn bình phương tốc độ tại các đỉnh 0..n (đỉnh k + 1 là cuối đoạn k): dừng ở hai đầu,
+    # ở hai đầu đoạn đứng yên (nâng/hạ bút) và chỗ đổi trạng thái bút
+    cap = np.zeros(n + 1)
+    if n > 1:
+        jump = np.abs(unit[1:] - unit[:-1]) / np.asarray(junction_jump, np.float64)
+        junction = 1.0 / np.maximum(jump.max(axis=1), 1e-300)
+        junction = np.minimum(junction, np.minimum(vmax[1:], vmax[:-1]))
+        junction[~moving[1:] | ~moving[:-1] | (pen[1:] != pen[:-1])] = 0.0
+        if vertex_speed is not None:
+            junction = np.minimum(junction, np.asarray(vertex_speed, np.float64)[:-1])
+        cap[1:-1] = junction ** 2
+
+    # Lượt lùi: b[k] = min(cap[k], b[k + 1] + 2 a l) viết thành min tích lũy từ cuối
+    gain = 2 * accel * length
+    after = np.r_[np.cumsum(gain[::-1])[::-1], 0.0]
+    backward = after + np.minimum.accumulate((cap - after)[::-1])[::-1]
+    # Lượt tiến: f[k + 1] = min(b[k + 1], f[k] + 2 a l) viết thành min tích lũy từ đầu
+    before = np.r_[0.0, np.cumsum(gain)]
+    forward = before + np.minimum.accumulate(backward - before)
+    speed = np.sqrt(np.maximum(forward, 0))
+
+    duration = trapezoid_durations(length, speed[:-1], speed[1:], vmax, accel)
+    # Chờ servo sau mỗi lần đổi trạng thái bút (kể cả hạ bút ở lệnh đầu tiên), trước đoạn kế tiếp
+    dwell = np.where(pen != np.r_[0, pen[:-1]], pen_time, 0.0)
+    start = np.r_[0.0, np.cumsum(duration + dwell)[:-1]]
+    return start, duration, speed[1:]
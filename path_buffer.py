@@ -0,0 +1,400 @@
+"""Cấu trúc mảng gọn cho đường nét: một mảng tọa độ liên tục + mảng offset theo từng nét"""
+import numpy as np
+
+SENTINEL = (-1, -1)
+RESAMPLE_MODES = ["uniform", "adaptive"]
+CORNER_ANGLE = 60.0  # độ - đỉnh gãy hơn góc này được giữ là góc nhọn khi lấy mẫu theo độ cong
+MAX_SUBDIVISIONS = 64
+
+
+class PathBuffer:
+    """Danh sách nét vẽ dạng ragged array
+
+    coords  : float32 (N, 2) - tọa độ tất cả các điểm, nối liền nhau
+    offsets : int64 (S + 1,) - nét thứ i là coords[offsets[i]:offsets[i + 1]]
+    pen     : uint8 (S,)     - 1 = nét vẽ (bút hạ), 0 = chỉ di chuyển (bút nhấc)
+    closed  : bool (S,)      - nét là đường khép kín (contour) hay đường hở (skeleton)
+
+    Mỗi nét bút hạ tương ứng với chuỗi lệnh robot:
+    (p0, nhấc) -> (p0, hạ) -> p1..pn-1 (hạ) -> (pn-1, nhấc)
+    """
+
+    def __init__(self, coords=None, offsets=None, pen=None, closed=None):
+        self.coords = np.zeros((0, 2), np.float32) if coords is None else np.asarray(coords, np.float32).reshape(-1, 2)
+        self.offsets = np.zeros(1, np.int64) if offsets is None else np.asarray(offsets, np.int64)
+        num_strokes = len(self.offsets) - 1
+        self.pen = np.ones(num_strokes, np.uint8) if pen is None else np.asarray(pen, np.uint8)
+        self.closed = np.ones(num_strokes, bool) if closed is None else np.asarray(closed, bool)
+        self._command_starts = None
+
+    # ===== Tạo PathBuffer =====
+    @classmethod
+    def from_strokes(cls, strokes, pen=None, closed=None):
+        """Tạo từ danh sách mảng (n, 2), bỏ qua nét rỗng"""
+        strokes = [np.asarray(s, np.float32).reshape(-1, 2) for s in strokes]
+        keep = [i for i, s in enumerate(strokes) if len(s)]
+        if pen is not None:
+            pen = np.asarray(pen, np.uint8)[keep]
+        if closed is not None:
+            closed = np.asarray(closed, bool)[keep]
+        strokes = [strokes[i] for i in keep]
+        if not strokes:
+            return cls()
+        offsets = np.zeros(len(strokes) + 1, np.int64)
+        np.cumsum([len(s) for s in strokes], out=offsets[1:])
+        return cls(np.concatenate(strokes), offsets, pen, closed)
+
+    @classmethod
+    def from_sentinel_list(cls, path):
+        """Chuyển từ định dạng cũ: list tuple với (-1, -1) ngăn cách các nét"""
+        arr = np.asarray(path, np.float32).reshape(-1, 2)
+        is_break = (arr[:, 0] == -1) & (arr[:, 1] == -1)
+        # Tách theo vị trí sentinel, bỏ các nét rỗng
+        ids = np.cumsum(is_break)[~is_break]
+        coords = arr[~is_break]
+        if len(coords) == 0:
+            return cls()
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        return cls(coords, np.r_[starts, len(coords)])
+
+    def to_sentinel_list(self):
+        """Chuyển về định dạng cũ (chỉ dùng cho tương thích)"""
+        path = []
+        for stroke in self.strokes():
+            if path:
+                path.append(SENTINEL)
+            path.extend(map(tuple, stroke.tolist()))
+        return path
+
+    def with_coords(self, coords):
+        """PathBuffer mới cùng cấu trúc nét nhưng tọa độ khác"""
+        return PathBuffer(coords, self.offsets, self.pen, self.closed)
+
+    def subset(self, stroke_indices):
+        """PathBuffer chỉ gồm các nét được chọn (theo thứ tự cho trước)"""
+        stroke_indices = np.asarray(stroke_indices, np.int64)
+        starts = self.offsets[stroke_indices]
+        lengths = self.offsets[stroke_indices + 1] - starts
+        offsets = np.zeros(len(stroke_indices) + 1, np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Chỉ số điểm của từng nét, ghép liên tục mà không cần vòng lặp Python
+        idx = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return PathBuffer(self.coords[idx], offsets, self.pen[stroke_indices], self.closed[stroke_indices])
+
+    # ===== Truy cập =====
+    def __len__(self):
+        return len(self.coords)
+
+    @property
+    def num_strokes(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.offsets.nbytes + self.pen.nbytes + self.closed.nbytes
+
+    def stroke_lengths(self):
+        """Số điểm của mỗi nét"""
+        return np.diff(self.offsets)
+
+    def stroke(self, i):
+        """View (không sao chép) tới các điểm của nét thứ i"""
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def strokes(self):
+        """Duyệt qua view của từng nét"""
+        for i in range(self.num_strokes):
+            yield self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def stroke_ids(self):
+        """Chỉ số nét của từng điểm"""
+        return np.repeat(np.arange(self.num_strokes), self.stroke_lengths())
+
+    def nan_separated(self, stroke_indices=None):
+        """Ghép các nét thành một mảng với hàng NaN ngăn cách - vẽ bằng một lệnh plot"""
+        if stroke_indices is None:
+            stroke_indices = np.arange(self.num_strokes)
+        sub = self.subset(stroke_indices)
+        if len(sub) == 0:
+            return np.zeros((0, 2), np.float32)
+        out = np.full((len(sub) + sub.num_strokes - 1, 2), np.nan, np.float32)
+        out[np.arange(len(sub)) + sub.stroke_ids()] = sub.coords
+        return out
+
+    # ===== Chuỗi lệnh robot (x, y, pen) =====
+    def _command_lengths(self):
+        # Nét bút hạ: thêm điểm nhấc bút ở đầu và cuối; nét bút nhấc: mỗi điểm một lệnh
+        return self.stroke_lengths() + 2 * (self.pen != 0)
+
+    def command_starts(self):
+        """Chỉ số lệnh đầu tiên của mỗi nét (có thêm phần tử cuối = tổng số lệnh)"""
+        if self._command_starts is None:
+            starts = np.zeros(self.num_strokes + 1, np.int64)
+            np.cumsum(self._command_lengths(), out=starts[1:])
+            self._command_starts = starts
+        return self._command_starts
+
+    @property
+    def num_commands(self):
+        return int(self.command_starts()[-1])
+
+    def commands(self):
+        """Mảng (M, 3) gồm x, y, pen cho toàn bộ chuỗi lệnh robot"""
+        starts = self.command_starts()
+        out = np.empty((self.num_commands, 3), np.float64)
+        if self.num_strokes == 0:
+            return out
+
+        lengths = self.stroke_lengths()
+        down = self.pen != 0
+        # Vị trí của các điểm trong chuỗi lệnh: lệch thêm 1 với nét bút hạ
+        cmd_idx = np.arange(len(self.coords)) + np.repeat(starts[:-1] - self.offsets[:-1] + down, lengths)
+        out[cmd_idx, :2] = self.coords
+        out[cmd_idx, 2] = np.repeat(down, lengths)
+
+        # Điểm nhấc bút ở đầu và cuối mỗi nét bút hạ
+        first = self.offsets[:-1][down]
+        last = self.offsets[1:][down] - 1
+        out[starts[:-1][down], :2] = self.coords[first]
+        out[starts[:-1][down], 2] = 0
+        out[starts[1:][down] - 1, :2] = self.coords[last]
+        out[starts[1:][down] - 1, 2] = 0
+        return out
+
+    def locate_command(self, cmd_idx):
+        """Trả về (chỉ số nét, số điểm của nét đã vẽ xong) tại lệnh cmd_idx"""
+        starts = self.command_starts()
+        s = int(np.searchsorted(starts, cmd_idx, side='right') - 1)
+        local = cmd_idx - starts[s]
+        if not self.pen[s]:
+            return s, 0
+        n = self.offsets[s + 1] - self.offsets[s]
+        return s, int(min(max(local, 0), n))
+
+    def command(self, cmd_idx):
+        """Lệnh (x, y, pen) thứ cmd_idx mà không cần tạo toàn bộ mảng lệnh"""
+        s, _ = self.locate_command(cmd_idx)
+        local = cmd_idx - self.command_starts()[s]
+        start = self.offsets[s]
+        n = self.offsets[s + 1] - start
+        if not self.pen[s]:
+            x, y = self.coords[start + local]
+            return float(x), float(y), 0
+        if local == 0:
+            x, y = self.coords[start]
+            return float(x), float(y), 0
+        if local == n + 1:
+            x, y = self.coords[start + n - 1]
+            return float(x), float(y), 0
+        x, y = self.coords[start + local - 1]
+        return float(x), float(y), 1
+
+
+# ===== Các phép xử lý trên PathBuffer =====
+def close_strokes(buf):
+    """Đóng các nét khép kín (nối điểm cuối về điểm đầu) nếu chưa nối"""
+    if buf.num_strokes == 0:
+        return buf
+    lengths = buf.stroke_lengths()
+    first = buf.coords[buf.offsets[:-1]]
+    last = buf.coords[buf.offsets[1:] - 1]
+    need = buf.closed & (lengths > 1) & np.any(first != last, axis=1)
+    if not need.any():
+        return buf
+    # Chèn điểm đầu của nét vào ngay sau điểm cuối của nét đó
+    coords = np.insert(buf.coords, buf.offsets[1:][need], first[need], axis=0)
+    offsets = buf.offsets + np.r_[0, np.cumsum(need)]
+    return PathBuffer(coords, offsets, buf.pen, buf.closed)
+
+
+def reverse_strokes(buf, mask):
+    """Đảo chiều các nét có mask[i] = True (điểm đầu thành điểm cuối)"""
+    mask = np.asarray(mask, bool)
+    if not mask.any():
+        return buf
+    idx = np.arange(len(buf.coords))
+    ids = buf.stroke_ids()
+    flip = mask[ids]
+    idx[flip] = buf.offsets[ids[flip]] + buf.offsets[ids[flip] + 1] - 1 - idx[flip]
+    return buf.with_coords(buf.coords[idx])
+
+
+def simplify_strokes(buf, tolerance):
+    """Douglas-Peucker với sai số tuyệt đối (cùng đơn vị với tọa độ)
+
+    Giữ lại mọi điểm cách đường nối hai điểm giữ lại kề nó quá tolerance. Mỗi vòng xử lý
+    đồng thời tất cả các đoạn đang xét của mọi nét, nên số vòng lặp Python bằng độ sâu
+    đệ quy chứ không phải số điểm.
+    """
+    if len(buf) == 0:
+        return buf
+    coords = buf.coords.astype(np.float64)
+    keep = np.zeros(len(coords), bool)
+    keep[buf.offsets[:-1]] = True
+    keep[buf.offsets[1:] - 1] = True
+
+    # Các đoạn (lo, hi) còn điểm ở giữa cần xét
+    lo, hi = buf.offsets[:-1], buf.offsets[1:] - 1
+    active = hi - lo > 1
+    lo, hi = lo[active], hi[active]
+    while len(lo):
+        counts = hi - lo - 1
+        group_starts = np.zeros(len(lo), np.int64)
+        np.cumsum(counts[:-1], out=group_starts[1:])
+        seg = np.repeat(np.arange(len(lo)), counts)
+        idx = np.arange(counts.sum()) - group_starts[seg] + lo[seg] + 1
+
+        # Khoảng cách từ điểm tới đường thẳng qua hai đầu đoạn (tới điểm đầu nếu hai đầu trùng nhau)
+        a = coords[lo][seg]
+        ab = coords[hi][seg] - a
+        ap = coords[idx] - a
+        chord = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0])
+        dist = np.where(chord > 0, cross / np.where(chord > 0, chord, 1), np.hypot(ap[:, 0], ap[:, 1]))
+
+        # Điểm xa nhất của mỗi đoạn (điểm đầu tiên khi bằng nhau)
+        farthest = np.maximum.reduceat(dist, group_starts)
+        hit = np.flatnonzero(dist == farthest[seg])
+        far = idx[hit[np.r_[True, seg[hit[1:]] != seg[hit[:-1]]]]]
+
+        split = farthest > tolerance
+        far = far[split]
+        keep[far] = True
+        lo, hi = np.r_[lo[split], far], np.r_[far, hi[split]]
+        active = hi - lo > 1
+        lo, hi = lo[active], hi[active]
+
+    offsets = np.zeros(len(coords) + 1, np.int64)
+    np.cumsum(keep, out=offsets[1:])
+    return PathBuffer(buf.coords[keep], offsets[buf.offsets], buf.pen, buf.closed)
+
+
+def interpolate_strokes(buf, step):
+    """Nội suy thêm điểm giữa hai điểm liên tiếp cách nhau hơn 2 * step
+
+    Đoạn dài d được chia đều bằng int(d / step) - 1 điểm chèn; tính cho toàn bộ
+    các đoạn cùng lúc, không có vòng lặp Python theo điểm.
+    """
+    if len(buf) == 0:
+        return buf
+    coords = buf.coords.astype(np.float64)
+    delta = np.zeros_like(coords)
+    delta[:-1] = coords[1:] - coords[:-1]
+    # Đoạn nối điểm cuối nét này với điểm đầu nét sau không được nội suy
+    delta[buf.offsets[1:] - 1] = 0
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    extra = np.where(distance > step * 2, np.floor(distance / step) - 1, 0).astype(np.int64)
+
+    # Mỗi điểm gốc sinh ra chính nó và extra điểm chèn phía sau
+    counts = extra + 1
+    source = np.repeat(np.arange(len(coords)), counts)
+    firsts = np.zeros(len(coords) + 1, np.int64)
+    np.cumsum(counts, out=firsts[1:])
+    j = np.arange(firsts[-1]) - firsts[source]
+    ratio = j / counts[source]
+    out = coords[source] + delta[source] * ratio[:, None]
+    return PathBuffer(out, firsts[buf.offsets], buf.pen, buf.closed)
+
+
+def resample_strokes(buf, max_error, corner_angle=CORNER_ANGLE, max_subdivisions=MAX_SUBDIVISIONS):
+    """Lấy mẫu lại theo độ cong: đoạn thẳng chỉ còn hai đầu, đoạn cong được chia theo sai số dây cung
+
+    Trước hết bỏ các đỉnh gần thẳng hàng (Douglas-Peucker với cùng sai số). Sau đó mỗi đoạn
+    giữa hai đỉnh được thay bằng đường cong Hermite đi qua hai đỉnh, tiếp tuyến theo hướng của
+    hai đỉnh kề (Catmull-Rom); tại đỉnh gãy hơn corner_angle (độ) tiếp tuyến theo chính đoạn đó
+    nên góc được giữ nguyên. Số khúc chia của một đoạn đủ để dây cung lệch khỏi đường cong không
+    quá max_error: với đạo hàm bậc hai (vuông góc với dây cung) lớn nhất K thì n khúc lệch tối
+    đa K / (8 n^2).
+    """
+    if len(buf) == 0 or max_error <= 0:
+        return buf
+    buf = simplify_strokes(buf, max_error)
+    coords = buf.coords.astype(np.float64)
+    num_points = len(coords)
+    lengths = buf.stroke_lengths()
+    firsts = buf.offsets[:-1]
+    lasts = buf.offsets[1:] - 1
+    index = np.arange(num_points)
+    prev = index - 1
+    nxt = index + 1
+    prev[firsts] = firsts
+    nxt[lasts] = lasts
+    # Vòng khép kín (điểm cuối lặp lại điểm đầu): đỉnh đầu/cuối nối vòng qua nhau
+    loop = buf.closed & (lengths > 3) & np.all(coords[firsts] == coords[lasts], axis=1)
+    prev[firsts[loop]] = lasts[loop] - 1
+    nxt[lasts[loop]] = firsts[loop] + 1
+
+    incoming = coords - coords[prev]
+    outgoing = coords[nxt] - coords
+    norm_in = np.hypot(*incoming.T)
+    norm_out = np.hypot(*outgoing.T)
+    cos_turn = np.einsum('ij,ij->i', incoming, outgoing) / np.maximum(norm_in * norm_out, 1e-12)
+    corner = (norm_in > 0) & (norm_out > 0) & (cos_turn < np.cos(np.radians(corner_angle)))
+    tangent = coords[nxt] - coords[prev]
+    tangent /= np.maximum(np.hypot(*tangent.T), 1e-12)[:, None]
+
+    # Đoạn i: đỉnh i -> i + 1 (không tính đoạn nối sang nét sau)
+    seg = np.zeros(num_points, bool)
+    seg[:-1] = True
+    seg[lasts] = False
+    nxt_point = np.minimum(index + 1, num_points - 1)
+    d = coords[nxt_point] - coords
+    chord = np.hypot(*d.T)
+    chord_dir = d / np.maximum(chord, 1e-12)[:, None]
+    u0 = np.where(corner[:, None], chord_dir, tangent)
+    u1 = np.where(corner[nxt_point, None], chord_dir, tangent[nxt_point])
+    m0 = u0 * chord[:, None]
+    m1 = u1 * chord[:, None]
+    # Thành phần vuông góc với dây cung của C''(0) = 6d - 4m0 - 2m1 và C''(1) = -6d + 2m0 + 4m1
+    perp0 = chord_dir[:, 0] * m0[:, 1] - chord_dir[:, 1] * m0[:, 0]
+    perp1 = chord_dir[:, 0] * m1[:, 1] - chord_dir[:, 1] * m1[:, 0]
+    bend = np.maximum(np.abs(4 * perp0 + 2 * perp1), np.abs(2 * perp0 + 4 * perp1))
+    counts = np.ceil(np.sqrt(bend / (8 * max_error)))
+    counts = np.where(seg, np.clip(counts, 1, max_subdivisions), 1).astype(np.int64)
+
+    source = np.repeat(index, counts)
+    out_firsts = np.zeros(num_points + 1, np.int64)
+    np.cumsum(counts, out=out_firsts[1:])
+    t = ((np.arange(out_firsts[-1]) - out_firsts[source]) / counts[source])[:, None]
+    # Đa thức Hermite bậc ba
+    h00 = 2 * t ** 3 - 3 * t ** 2 + 1
+    h10 = t ** 3 - 2 * t ** 2 + t
+    h01 = -2 * t ** 3 + 3 * t ** 2
+    h11 = t ** 3 - t ** 2
+    out = (h00 * coords[source] + h10 * m0[source] + h01 * coords[nxt_point[source]] + h11 * m1[source])
+    return PathBuffer(out, out_firsts[buf.offsets], buf.pen, buf.closed)
+
+
+def pen_down_length(buf):
+    """Tổng chiều dài các nét vẽ"""
+    if len(buf) < 2:
+        return 0.0
+    seg = np.hypot(*np.diff(buf.coords.astype(np.float64), axis=0).T)
+    # Bỏ các đoạn nối giữa hai nét liên tiếp và các nét bút nhấc
+    same_stroke = np.ones(len(seg), bool)
+    same_stroke[buf.offsets[1:-1] - 1] = False
+    down = np.repeat(buf.pen != 0, buf.stroke_lengths())[1:]
+    return float(seg[same_stroke & down].sum())
+
+
+def pen_up_length(buf, start=(0.0, 0.0)):
+    """Tổng quãng đường di chuyển khi nhấc bút giữa các nét (bắt đầu từ start)"""
+    if buf.num_strokes == 0:
+        return 0.0
+    firsts = buf.coords[buf.offsets[:-1]].astype(np.float64)
+    lasts = buf.coords[buf.offsets[1:] - 1].astype(np.float64)
+    prev = np.vstack([np.asarray(start, np.float64).reshape(1, 2), lasts[:-1]])
+    return float(np.hypot(*(firsts - prev).T).sum())
+
+
+def workspace_scale(width, height, workspace_size, margin=0.8):
+    """Tỷ lệ điểm ảnh -> mm để ảnh vừa vùng làm việc (thu nhỏ hình một chút)"""
+    return workspace_size / max(width, height) * margin
+
+
+def image_to_robot(buf, width, height, scale, offset_x, offset_y):
+    """Chuyển tọa độ ảnh sang tọa độ robot (mm) - trục y ảnh hướng xuống"""
+    coords = np.empty_like(buf.coords)
+    coords[:, 0] = (buf.coords[:, 0] - width / 2) * scale + offset_x
+    coords[:, 1] = (height / 2 - buf.coords[:, 1]) * scale + offset_y
+    return buf.with_coords(coords)
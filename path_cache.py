@@ -0,0 +1,149 @@
+"""Bộ nhớ đệm hai tầng (RAM + đĩa) cho kết quả trích xuất đường nét"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from path_buffer import PathBuffer
+
+
+def hash_file(image_path, chunk_size=1 << 20):
+    """Tính hash nội dung file ảnh (không phụ thuộc tên file)"""
+    h = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(image_hash, threshold, invert, method, detail_level, threshold_mode="manual", tolerance=None):
+    """Tạo khóa cache từ hash ảnh và các tham số trích xuất"""
+    key = (f"{image_hash}|{int(threshold)}|{int(bool(invert))}|{method}|{float(detail_level):.3f}"
+           f"|{threshold_mode}")
+    if tolerance is not None:
+        # Sai số tuyệt đối (điểm ảnh) thay cho mức chi tiết
+        key += f"|tol{float(tolerance):.4f}"
+    return key
+
+
+class PathCache:
+    """Cache LRU giới hạn theo số byte trong RAM, kèm tầng lưu trên đĩa (tùy chọn)"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (shape, PathBuffer)
+        self._lock = threading.Lock()
+        self._file_hashes = {}  # (path, size, mtime) -> hash
+        self.current_bytes = 0
+
+        # Bộ đếm thống kê
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def image_hash(self, image_path):
+        """Lấy hash nội dung ảnh, chỉ đọc lại file khi kích thước/mtime thay đổi"""
+        st = os.stat(image_path)
+        stamp = (os.path.abspath(image_path), st.st_size, st.st_mtime_ns)
+        digest = self._file_hashes.get(stamp)
+        if digest is None:
+            digest = hash_file(image_path)
+            self._file_hashes[stamp] = digest
+        return digest
+
+    def _disk_file(self, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.disk_dir, name + ".npz")
+
+    def get(self, key):
+        """Trả về (image_shape, PathBuffer) hoặc None nếu chưa có"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.disk_dir:
+            file_path = self._disk_file(key)
+            if os.path.exists(file_path):
+                try:
+                    with np.load(file_path) as data:
+                        shape = tuple(int(v) for v in data['shape'])
+                        buf = PathBuffer(data['coords'], data['offsets'], data['pen'], data['closed'])
+                except Exception as e:
+                    print(f"Không đọc được cache trên đĩa {file_path}: {str(e)}")
+                else:
+                    with self._lock:
+                        self.disk_hits += 1
+                    self._put_memory(key, shape, buf)
+                    return shape, buf
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, image_shape, drawing_path):
+        """Lưu kết quả trích xuất vào RAM và (nếu có) ra đĩa"""
+        shape = tuple(int(v) for v in image_shape[:2])
+        self._put_memory(key, shape, drawing_path)
+
+        if self.disk_dir:
+            file_path = self._disk_file(key)
+            tmp_path = file_path + ".tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, shape=np.array(shape), coords=drawing_path.coords,
+                             offsets=drawing_path.offsets, pen=drawing_path.pen, closed=drawing_path.closed)
+                os.replace(tmp_path, file_path)
+            except Exception as e:
+                print(f"Không ghi được cache ra đĩa: {str(e)}")
+
+    def _put_memory(self, key, shape, buf):
+        size = buf.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1].nbytes
+            self._entries[key] = (shape, buf)
+            self.current_bytes += size
+
+            # Loại bỏ các mục ít dùng nhất khi vượt giới hạn
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Xóa toàn bộ cache trong RAM (giữ nguyên tầng đĩa)"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Thống kê hit/miss/eviction để chọn kích thước cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def stats_text(self):
+        """Chuỗi thống kê ngắn để hiển thị trên giao diện"""
+        s = self.stats()
+        return (f"Cache: {s['hits']} hit / {s['disk_hits']} đĩa / {s['misses']} miss / "
+                f"{s['evictions']} loại bỏ ({s['bytes'] / 2**20:.1f}/{s['max_bytes'] / 2**20:.0f} MB)")
@@ -0,0 +1,123 @@
+"""Bỏ các đoạn nét vẽ lặp lại đường đã vẽ (hai mép của nét mảnh, contour lồng nhau)
+
+Mọi nét được lấy mẫu dày (cách nhau nửa bề rộng bút) và đưa vào lưới chiếm chỗ ô cạnh bằng
+bề rộng bút. Nét dài được ưu tiên giữ: mỗi ô thuộc về mẫu có thứ tự ưu tiên cao nhất rơi vào ô đó.
+Một mẫu bị coi là đã được vẽ nếu trong 3x3 ô quanh nó có mẫu ưu tiên cao hơn cách nó không
+quá bề rộng bút (thuộc nét khác, hoặc cùng nét nhưng cách xa theo chiều dài nét). Chỉ bỏ
+các đoạn bị che liên tục dài ít nhất min_run để chỗ hai nét cắt nhau không bị cắt vụn.
+Toàn bộ tính bằng numpy (một lần sắp xếp + tra bảng), gần tuyến tính theo số mẫu.
+"""
+import numpy as np
+
+from path_buffer import PathBuffer
+
+PEN_WIDTH = 0.5  # mm - hai đường gần nhau hơn khoảng này coi như trùng nhau
+MIN_RUN_WIDTHS = 4  # chỉ bỏ đoạn bị che dài ít nhất chừng này lần bề rộng bút
+MAX_GRID_SIDE = 4096  # số ô tối đa theo mỗi chiều của lưới
+
+_NEIGHBOURS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def _runs(values, stroke):
+    """Chỉ số bắt đầu các đoạn liên tiếp có cùng giá trị và cùng nét"""
+    change = np.r_[True, (values[1:] != values[:-1]) | (stroke[1:] != stroke[:-1])]
+    return np.flatnonzero(change)
+
+
+def dedup_strokes(buf, width=PEN_WIDTH, min_run=None):
+    """Bỏ/cắt bớt các phần nét đã được nét khác (hoặc chính nó) vẽ qua; trả về PathBuffer mới
+
+    Nét bút nhấc giữ nguyên. Nét bị cắt thành nhiều đoạn thành các nét hở.
+    """
+    if buf.num_strokes == 0 or width <= 0 or not (buf.pen == 1).any():
+        return buf
+    if min_run is None:
+        min_run = MIN_RUN_WIDTHS * width
+
+    coords = buf.coords.astype(np.float64)
+    num_points = len(coords)
+    lengths = buf.stroke_lengths()
+    ids = buf.stroke_ids()
+    last = np.zeros(num_points, bool)
+    last[buf.offsets[1:] - 1] = True
+
+    # Lấy mẫu: mỗi đoạn thẳng chia thành các khúc không dài quá width / 2, cộng điểm cuối nét
+    nxt = np.minimum(np.arange(num_points) + 1, num_points - 1)
+    seg = np.where(last, 0.0, np.hypot(*(coords[nxt] - coords).T))
+    counts = np.where(last, 1, np.maximum(np.ceil(seg / (width / 2)), 1)).astype(np.int64)
+    point = np.repeat(np.arange(num_points), counts)
+    t = (np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[point]
+    samples = coords[point] + t[:, None] * (coords[nxt[point]] - coords[point])
+    stroke = ids[point]
+    # Vị trí theo chiều dài nét (mm) của từng mẫu
+    cum = np.cumsum(seg) - seg
+    arc = cum[point] - cum[buf.offsets[:-1]][stroke] + t * seg[point]
+
+    # Thứ tự ưu tiên: nét bút hạ dài trước, trong một nét theo chiều vẽ
+    stroke_length = np.bincount(ids, seg, minlength=buf.num_strokes)
+    rank = np.empty(buf.num_strokes, np.int64)
+    rank[np.argsort(-stroke_length, kind='stable')] = np.arange(buf.num_strokes)
+    prio = np.empty(len(samples), np.int64)
+    prio[np.lexsort((np.arange(len(samples)), rank[stroke]))] = np.arange(len(samples))
+    drawn = buf.pen[stroke] == 1
+
+    # Lưới ô phủ kín vùng vẽ (ô lớn hơn width khi vùng vẽ quá rộng - vẫn đúng, chỉ chậm hơn)
+    origin = samples.min(axis=0)
+    cell = max(width, float(np.ptp(samples, axis=0).max()) / MAX_GRID_SIDE)
+    keys = np.floor((samples - origin) / cell).astype(np.int64) + 1
+    grid_width = int(keys[:, 0].max()) + 2
+    cells = keys[:, 0] + keys[:, 1] * grid_width
+
+    # Chủ của mỗi ô: mẫu bút hạ có ưu tiên cao nhất (prio nhỏ nhất) trong ô
+    candidates = np.flatnonzero(drawn)
+    by_cell = candidates[np.lexsort((prio[candidates], cells[candidates]))]
+    first = np.r_[True, cells[by_cell[1:]] != cells[by_cell[:-1]]]
+    owner = np.full(grid_width * (int(keys[:, 1].max()) + 2), -1, np.int64)
+    owner[cells[by_cell[first]]] = by_cell[first]
+
+    # Mẫu ở ô không có chủ (nét bút nhấc) xếp sau mọi mẫu khác
+    owner_prio = np.r_[prio, np.iinfo(np.int64).max]
+    sx, sy = samples.T
+    covered = np.zeros(len(samples), bool)
+    for dx, dy in _NEIGHBOURS:
+        o = owner[cells + dx + dy * grid_width]
+        hit = np.flatnonzero(owner_prio[o] < prio)
+        o = o[hit]
+        near = (sx[hit] - sx[o]) ** 2 + (sy[hit] - sy[o]) ** 2 <= width * width
+        near &= (stroke[o] != stroke[hit]) | (arc[hit] - arc[o] > min_run)
+        covered[hit[near]] = True
+    covered &= drawn
+    if not covered.any():
+        return buf
+
+    # Đoạn bị che quá ngắn (chỗ giao nhau) vẫn giữ lại
+    starts = _runs(covered, stroke)
+    ends = np.r_[starts[1:], len(samples)] - 1
+    short = covered[starts] & (arc[ends] - arc[starts] < min_run)
+    covered[np.repeat(short, ends - starts + 1)] = False
+    if not covered.any():
+        return buf
+
+    # Các đoạn còn lại: giữ đỉnh gốc và hai mẫu ở hai đầu mỗi đoạn
+    keep = np.flatnonzero(~covered)
+    kept_stroke = stroke[keep]
+    new_piece = np.r_[True, (np.diff(keep) > 1) | (kept_stroke[1:] != kept_stroke[:-1])]
+    piece = np.cumsum(new_piece) - 1
+    piece_start = np.flatnonzero(new_piece)
+    piece_end = np.r_[piece_start[1:], len(keep)] - 1
+    chosen = t[keep] == 0
+    chosen[piece_start] = True
+    chosen[piece_end] = True
+
+    # Đoạn chỉ còn một điểm (của nét vốn dài hơn một điểm) bị bỏ
+    sizes = np.bincount(piece[chosen], minlength=len(piece_start))
+    piece_stroke = kept_stroke[piece_start]
+    valid = (sizes >= 2) | (lengths[piece_stroke] == 1)
+    chosen &= valid[piece]
+    piece_stroke = piece_stroke[valid]
+
+    # Nét không bị cắt giữ nguyên cờ khép kín
+    intact = (np.bincount(kept_stroke, minlength=buf.num_strokes)[piece_stroke]
+              == np.bincount(stroke, minlength=buf.num_strokes)[piece_stroke])
+    offsets = np.r_[0, np.cumsum(sizes[valid])]
+    return PathBuffer(samples[keep[chosen]], offsets, buf.pen[piece_stroke], buf.closed[piece_stroke] & intact)
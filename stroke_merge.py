@@ -0,0 +1,186 @@
+"""Nối các nét có đầu mút gần chạm nhau để bỏ bớt lần nhấc/hạ bút
+
+merge_strokes: tìm các cặp đầu mút (của nét hở) cách nhau không quá gap bằng lưới băm
+không gian ô cạnh gap, nối các cặp gần nhất trước thành chuỗi (không tạo vòng), mỗi chuỗi
+thành một nét bút hạ liên tục. Chạy trước khi sắp xếp thứ tự nét.
+
+join_adjacent: sau khi đã sắp xếp và chọn điểm vào, nối hai nét liền nhau nếu điểm vào
+của nét sau cách điểm ra của nét trước không quá gap (kể cả đường khép kín).
+"""
+import numpy as np
+
+from stroke_order import stroke_endpoints
+from path_buffer import PathBuffer
+
+MERGE_GAP = 0.5  # mm - khoảng hở tối đa được vẽ nối luôn thay vì nhấc bút
+
+# Nửa lân cận 3x3: mỗi cặp ô kề nhau chỉ được xét một lần
+_HALF_NEIGHBOURS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+def near_pairs(points, radius):
+    """Mọi cặp (i, j), i < j, có khoảng cách không quá radius; trả về (i, j, khoảng cách)"""
+    points = np.asarray(points, np.float64)
+    empty = np.zeros(0, np.int64)
+    if len(points) < 2 or radius <= 0:
+        return empty, empty, np.zeros(0)
+
+    keys = np.floor((points - points.min(axis=0)) / radius).astype(np.int64) + 1
+    width = int(keys[:, 0].max()) + 2
+    cells = keys[:, 0] + keys[:, 1] * width
+    order = np.argsort(cells, kind='stable')
+    sorted_cells = cells[order]
+
+    all_i, all_j = [], []
+    for dx, dy in _HALF_NEIGHBOURS:
+        # Tra cứu theo thứ tự đã sắp xếp: các ô cần tìm cũng tăng dần nên searchsorted nhanh hơn
+        target = sorted_cells + dx + dy * width
+        lo = np.searchsorted(sorted_cells, target, 'left')
+        counts = np.searchsorted(sorted_cells, target, 'right') - lo
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        i = np.repeat(order, counts)
+        j = order[np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)]
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        all_i.append(i)
+        all_j.append(j)
+    if not all_i:
+        return empty, empty, np.zeros(0)
+
+    i = np.concatenate(all_i)
+    j = np.concatenate(all_j)
+    dist = np.hypot(*(points[i] - points[j]).T)
+    keep = dist <= radius
+    i, j = i[keep], j[keep]
+    return np.minimum(i, j), np.maximum(i, j), dist[keep]
+
+
+def _assemble(buf, piece_stroke, piece_reversed, group_sizes, closed):
+    """Ghép các nét (có thể đảo chiều) theo thứ tự thành các nhóm, mỗi nhóm một nét
+
+    Điểm đầu của một nét trùng với điểm cuối của nét trước trong cùng nhóm bị bỏ.
+    """
+    lengths = buf.stroke_lengths()[piece_stroke]
+    firsts = buf.offsets[:-1][piece_stroke]
+    piece = np.repeat(np.arange(len(piece_stroke)), lengths)
+    local = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    src = firsts[piece] + np.where(piece_reversed[piece], lengths[piece] - 1 - local, local)
+    coords = buf.coords[src]
+
+    piece_starts = np.cumsum(lengths) - lengths
+    group_first = np.r_[True, np.zeros(len(piece_stroke) - 1, bool)]
+    group_first[np.cumsum(group_sizes)[:-1]] = True
+    junction = piece_starts[~group_first]
+    repeated = np.zeros(len(coords), bool)
+    repeated[junction] = np.all(coords[junction] == coords[junction - 1], axis=1)
+
+    piece_offsets = np.r_[piece_starts, len(coords)]
+    offsets = piece_offsets[np.r_[0, np.cumsum(group_sizes)]]
+    offsets = offsets - np.r_[0, np.cumsum(repeated)][offsets]
+    pen = buf.pen[piece_stroke[group_first]]
+    return PathBuffer(coords[~repeated], offsets, pen, closed)
+
+
+def merge_strokes(buf, gap=MERGE_GAP):
+    """Nối các nét hở có đầu mút cách nhau không quá gap thành nét liên tục
+
+    Các cặp đầu mút gần nhất được nối trước; mỗi đầu mút nối tối đa một lần và không nối
+    hai đầu của cùng một chuỗi (tránh tạo vòng). Nét khép kín và nét bút nhấc giữ nguyên.
+    """
+    n = buf.num_strokes
+    if n < 2 or gap <= 0:
+        return buf
+    starts, ends = stroke_endpoints(buf)
+    ids = np.flatnonzero((buf.pen == 1) & ~buf.closed)
+    m = len(ids)
+    if m < 2:
+        return buf
+
+    # Nút k < m là điểm đầu, nút k + m là điểm cuối của nét ids[k]
+    i, j, dist = near_pairs(np.vstack([starts[ids], ends[ids]]), gap)
+    other = (i % m) != (j % m)
+    i, j, dist = i[other], j[other], dist[other]
+    if len(i) == 0:
+        return buf
+
+    link = np.full(2 * m, -1, np.int64)
+    parent = list(range(m))
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    # Ghép tham lam theo khoảng cách tăng dần, làm theo từng lượt: mỗi lượt nhận mọi cặp mà
+    # hai đầu mút là điểm gần nhất của nhau (kết quả như duyệt lần lượt từng cặp, nhưng
+    # vòng lặp Python chỉ chạy trên các cặp được nhận)
+    nearest_first = np.argsort(dist, kind='stable')
+    i, j = i[nearest_first], j[nearest_first]
+    while len(i):
+        best = np.full(2 * m, len(i), np.int64)
+        rank = np.arange(len(i))
+        np.minimum.at(best, i, rank)
+        np.minimum.at(best, j, rank)
+        mutual = (best[i] == rank) & (best[j] == rank)
+        for a, b in zip(i[mutual].tolist(), j[mutual].tolist()):
+            ra, rb = find(a % m), find(b % m)
+            if ra == rb:
+                continue
+            parent[ra] = rb
+            link[a] = b
+            link[b] = a
+        # Bỏ các cặp đã xét và các cặp có đầu mút đã được nối
+        keep = ~mutual & (link[i] < 0) & (link[j] < 0)
+        i, j = i[keep], j[keep]
+    if not (link >= 0).any():
+        return buf
+
+    # Đi dọc từng chuỗi từ một đầu tự do; nhóm theo nét có chỉ số nhỏ nhất để giữ gần thứ tự cũ
+    link_list = link.tolist()
+    stroke_ids = ids.tolist()
+    visited = [False] * m
+    groups = {}
+    for k in range(m):
+        if visited[k] or (link_list[k] >= 0 and link_list[k + m] >= 0):
+            continue
+        cur, rev = k, link_list[k] >= 0
+        chain = []
+        while True:
+            visited[cur] = True
+            chain.append((stroke_ids[cur], rev))
+            nxt = link_list[cur if rev else cur + m]
+            if nxt < 0:
+                break
+            cur, rev = nxt % m, nxt >= m
+        groups[min(s for s, _ in chain)] = chain
+    for s in np.flatnonzero(~np.isin(np.arange(n), ids)).tolist():
+        groups[s] = [(s, False)]
+
+    chains = [groups[s] for s in sorted(groups)]
+    piece_stroke = np.array([s for chain in chains for s, _ in chain], np.int64)
+    piece_reversed = np.array([r for chain in chains for _, r in chain], bool)
+    group_sizes = np.array([len(chain) for chain in chains], np.int64)
+    firsts = np.cumsum(group_sizes) - group_sizes
+    closed = buf.closed[piece_stroke[firsts]] & (group_sizes == 1)
+    return _assemble(buf, piece_stroke, piece_reversed, group_sizes, closed)
+
+
+def join_adjacent(buf, gap=MERGE_GAP):
+    """Giữ thứ tự nét, nối nét sau vào nét trước khi điểm vào cách điểm ra không quá gap"""
+    n = buf.num_strokes
+    if n < 2 or gap <= 0:
+        return buf
+    starts, ends = stroke_endpoints(buf)
+    join = ((np.hypot(*(starts[1:] - ends[:-1]).T) <= gap)
+            & (buf.pen[1:] == 1) & (buf.pen[:-1] == 1))
+    if not join.any():
+        return buf
+
+    keep = np.r_[True, ~join]
+    group_sizes = np.diff(np.r_[np.flatnonzero(keep), n])
+    closed = buf.closed[keep] & (group_sizes == 1)
+    return _assemble(buf, np.arange(n), np.zeros(n, bool), group_sizes, closed)
@@ -0,0 +1,333 @@
+"""Sắp xếp thứ tự nét vẽ để giảm quãng đường di chuyển khi nhấc bút
+
+Bước 1: tham lam theo điểm gần nhất, tra cứu bằng lưới băm không gian trên điểm đầu
+các nét. Bước 2: cải thiện bằng 2-opt (đảo một đoạn của hành trình, các nét trong đoạn
+được vẽ theo chiều ngược lại) và Or-opt (chuyển 1-3 nét liên tiếp sang vị trí khác)
+trong một cửa sổ trượt, tính đồng thời cho mọi vị trí bằng numpy.
+
+Khi có rất nhiều nét, bước tham lam (vòng lặp Python) được chia theo các dải của mặt
+phẳng và chạy song song trên nhiều tiến trình; các dải được nối theo kiểu zig-zag rồi
+cải thiện chung trên toàn hành trình.
+
+Sau khi có thứ tự, choose_entry_points chọn điểm vào cho từng nét: đường khép kín được
+xoay để bắt đầu tại đỉnh gần vị trí bút nhất, đường hở được đảo chiều nếu đầu kia gần hơn.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from path_buffer import reverse_strokes
+
+PARTITION_SIZE = 20000  # số nét tối đa cho một dải khi chạy song song
+WINDOW = 32  # khoảng cách tối đa (theo thứ tự vẽ) giữa hai vị trí của một bước 2-opt
+OR_OPT_WINDOW = 16  # như trên cho Or-opt (mỗi độ dài đoạn tính riêng nên đắt hơn)
+MAX_PASSES = 8
+MIN_GAIN = 0.005  # dừng khi một lượt giảm ít hơn 0,5% quãng đường nhấc bút
+MAX_ENTRY_ROUNDS = 20
+
+
+def stroke_endpoints(buf):
+    """(điểm đầu, điểm cuối) của từng nét, float64"""
+    starts = buf.coords[buf.offsets[:-1]].astype(np.float64)
+    ends = buf.coords[buf.offsets[1:] - 1].astype(np.float64)
+    return starts, ends
+
+
+class GridIndex:
+    """Lưới băm không gian để tìm điểm gần nhất, có xóa điểm đã dùng"""
+
+    def __init__(self, points):
+        self.points = np.asarray(points, np.float64)
+        self.alive = np.ones(len(self.points), bool)
+        self._build(np.arange(len(self.points)))
+
+    def _build(self, ids):
+        pts = self.points[ids]
+        lo, hi = pts.min(axis=0), pts.max(axis=0)
+        w, h = hi - lo
+        # Trung bình khoảng 2 điểm một ô; tránh ô quá nhỏ khi các điểm gần thẳng hàng
+        self.cell = max(math.sqrt(w * h / len(ids) * 2), max(w, h) / len(ids), 1e-6)
+        self.origin = lo
+        keys = np.floor((pts - lo) / self.cell).astype(np.int64)
+        self.size = keys.max(axis=0) + 1
+        self.cells = {}
+        for i, key in zip(ids.tolist(), map(tuple, keys.tolist())):
+            self.cells.setdefault(key, []).append(i)
+        self.remaining = len(ids)
+        self.built_with = len(ids)
+
+    def pop_nearest(self, x, y):
+        """Chỉ số điểm gần (x, y) nhất, đồng thời xóa điểm đó khỏi lưới"""
+        cx = int((x - self.origin[0]) // self.cell)
+        cy = int((y - self.origin[1]) // self.cell)
+        r_max = max(abs(cx), abs(cx - self.size[0]), abs(cy), abs(cy - self.size[1])) + 1
+        points, alive, cells = self.points, self.alive, self.cells
+        best, best_dist = -1, math.inf
+        for r in range(r_max + 1):
+            if r == 0:
+                ring = [(cx, cy)]
+            else:
+                ring = [(cx + d, cy - r) for d in range(-r, r + 1)] + [(cx + d, cy + r) for d in range(-r, r + 1)]
+                ring += [(cx - r, cy + d) for d in range(-r + 1, r)] + [(cx + r, cy + d) for d in range(-r + 1, r)]
+            for key in ring:
+                members = cells.get(key)
+                if not members:
+                    continue
+                for i in members:
+                    if alive[i]:
+                        dist = math.hypot(points[i, 0] - x, points[i, 1] - y)
+                        if dist < best_dist:
+                            best, best_dist = i, dist
+            # Các điểm ở vòng r + 1 cách (x, y) ít nhất r ô
+            if best >= 0 and best_dist <= r * self.cell:
+                break
+
+        self.alive[best] = False
+        self.remaining -= 1
+        # Khi phần lớn điểm đã dùng, dựng lại lưới thưa hơn để vòng tìm kiếm không lan rộng
+        if self.remaining > 16 and self.remaining * 4 < self.built_with:
+            self._build(np.flatnonzero(self.alive))
+        return best
+
+
+def greedy_order(starts, ends, start_point):
+    """Thứ tự tham lam: luôn đi tới nét có điểm đầu gần vị trí bút hiện tại nhất"""
+    index = GridIndex(starts)
+    order = np.empty(len(starts), np.int64)
+    x, y = start_point
+    for k in range(len(starts)):
+        i = index.pop_nearest(x, y)
+        order[k] = i
+        x, y = ends[i]
+    return order
+
+
+def greedy_block(args):
+    """greedy_order cho một dải (chạy ở tiến trình con)"""
+    return greedy_order(*args)
+
+
+def partition_strips(starts, partition_size):
+    """Chia các nét thành các dải song song theo trục dài hơn, trả về list chỉ số nét"""
+    axis = int(np.ptp(starts[:, 1]) > np.ptp(starts[:, 0]))
+    count = math.ceil(len(starts) / partition_size)
+    return np.array_split(np.argsort(starts[:, axis], kind='stable'), count), axis
+
+
+def _dist(p, q):
+    # Khoảng cách tới nút "kết thúc" (tọa độ NaN) bằng 0: hành trình không cần quay về
+    return np.nan_to_num(np.hypot(p[:, 0] - q[:, 0], p[:, 1] - q[:, 1]), copy=False)
+
+
+def _pick_moves(delta, lo, hi):
+    """Chọn các bước cải thiện không chồng lấn nhau, tốt nhất trước
+
+    delta[k] < 0 là bước cải thiện tác động lên các vị trí lo[k]..hi[k].
+    """
+    candidates = np.flatnonzero(delta < -1e-9)
+    candidates = candidates[np.argsort(delta[candidates], kind='stable')]
+    used = np.zeros(int(hi.max()) + 2 if len(hi) else 1, bool)
+    chosen = []
+    for k in candidates.tolist():
+        if not used[lo[k]:hi[k] + 1].any():
+            used[lo[k]:hi[k] + 1] = True
+            chosen.append(k)
+    return chosen
+
+
+def _tour_points(tour, flip, starts, ends, start_point):
+    """Điểm vào (A) và điểm ra (B) theo vị trí trong hành trình
+
+    Vị trí 0 là điểm xuất phát, vị trí n + 1 là nút kết thúc (NaN).
+    """
+    a = np.where(flip[:, None], ends[tour], starts[tour])
+    b = np.where(flip[:, None], starts[tour], ends[tour])
+    head = np.asarray(start_point, np.float64).reshape(1, 2)
+    tail = np.full((1, 2), np.nan)
+    return np.vstack([head, a, tail]), np.vstack([head, b, tail])
+
+
+def two_opt_pass(tour, flip, starts, ends, start_point, window=WINDOW):
+    """Một lượt 2-opt: đảo một đoạn của hành trình (các nét đổi chiều) nếu giảm quãng đường nhấc bút"""
+    n = len(tour)
+    A, B = _tour_points(tour, flip, starts, ends, start_point)
+    cost = _dist(B[:-1], A[1:])  # cost[k]: từ vị trí k sang k + 1
+    best_delta = np.zeros(n)
+    best_j = np.zeros(n, np.int64)
+    # Đảo các vị trí i + 1..j (j = i + d) với i = 0..m - 1; dùng lát cắt thay cho chỉ số mảng
+    for d in range(1, min(window, n) + 1):
+        m = n - d + 1
+        delta = _dist(B[:m], B[d:d + m]) + _dist(A[1:m + 1], A[d + 1:d + 1 + m]) - cost[:m] - cost[d:d + m]
+        better = delta < best_delta[:m]
+        best_delta[:m][better] = delta[better]
+        best_j[:m][better] = np.flatnonzero(better) + d
+
+    chosen = _pick_moves(best_delta, np.arange(n), best_j + 1)
+    for k in chosen:
+        # Vị trí i + 1..j trong A/B tương ứng tour[i..j - 1]
+        lo, hi = k, best_j[k]
+        tour[lo:hi] = tour[lo:hi][::-1]
+        flip[lo:hi] = ~flip[lo:hi][::-1]
+    return float(best_delta[chosen].sum()) if chosen else 0.0
+
+
+def or_opt_pass(tour, flip, starts, ends, start_point, window=OR_OPT_WINDOW, max_segment=3):
+    """Một lượt Or-opt: chuyển 1..max_segment nét liên tiếp ra sau, có thể đổi chiều cả đoạn"""
+    n = len(tour)
+    A, B = _tour_points(tour, flip, starts, ends, start_point)
+    cost = _dist(B[:-1], A[1:])
+    # Với mỗi vị trí đầu đoạn i chỉ giữ bước tốt nhất: (delta, vị trí cuối đoạn e, vị trí chèn p, đảo chiều)
+    best_delta = np.zeros(n + 1)
+    best_e = np.zeros(n + 1, np.int64)
+    best_p = np.zeros(n + 1, np.int64)
+    best_rev = np.zeros(n + 1, bool)
+    for length in range(1, max_segment + 1):
+        # Đoạn i..e (vị trí 1..n, e = i + length - 1): quãng đường giảm được khi bỏ đoạn ra
+        m = n - length + 1
+        if m < 1:
+            break
+        removed = cost[:m] + cost[length:length + m] - _dist(B[:m], A[length + 1:length + 1 + m])
+        for d in range(1, window + 1):
+            # Chèn vào giữa p và p + 1 với p = e + d <= n
+            m = n - length - d + 1
+            if m < 1:
+                break
+            p = length + d  # vị trí chèn ứng với i = 1
+            forward = _dist(B[p:p + m], A[1:m + 1]) + _dist(B[length:length + m], A[p + 1:p + 1 + m])
+            backward = _dist(B[p:p + m], B[length:length + m]) + _dist(A[1:m + 1], A[p + 1:p + 1 + m])
+            delta = np.minimum(forward, backward) - cost[p:p + m] - removed[:m]
+            better = delta < best_delta[1:m + 1]
+            idx = np.flatnonzero(better) + 1
+            best_delta[idx] = delta[better]
+            best_e[idx] = idx + length - 1
+            best_p[idx] = idx + length - 1 + d
+            best_rev[idx] = (backward < forward)[better]
+
+    i = np.arange(n + 1)
+    chosen = _pick_moves(best_delta, i - 1, best_p + 1)
+    for k in chosen:
+        # Vị trí v trong A/B tương ứng tour[v - 1]
+        lo, mid, hi = k - 1, best_e[k], best_p[k]
+        segment, segment_flip = tour[lo:mid].copy(), flip[lo:mid].copy()
+        if best_rev[k]:
+            segment, segment_flip = segment[::-1], ~segment_flip[::-1]
+        tour[lo:hi - (mid - lo)] = tour[mid:hi]
+        flip[lo:hi - (mid - lo)] = flip[mid:hi]
+        tour[hi - (mid - lo):hi] = segment
+        flip[hi - (mid - lo):hi] = segment_flip
+    return float(best_delta[chosen].sum()) if chosen else 0.0
+
+
+def tour_length(tour, flip, starts, ends, start_point):
+    """Quãng đường nhấc bút của hành trình"""
+    A, B = _tour_points(tour, flip, starts, ends, start_point)
+    return float(_dist(B[:-1], A[1:]).sum())
+
+
+def refine_order(tour, flip, starts, ends, start_point, window=WINDOW, max_passes=MAX_PASSES):
+    """Xen kẽ 2-opt và Or-opt đến khi một lượt không còn giảm đáng kể"""
+    length = tour_length(tour, flip, starts, ends, start_point)
+    for _ in range(max_passes):
+        gain = two_opt_pass(tour, flip, starts, ends, start_point, window)
+        gain += or_opt_pass(tour, flip, starts, ends, start_point)
+        length += gain
+        if -gain <= MIN_GAIN * length:
+            break
+    return tour, flip
+
+
+def order_strokes(buf, start_point=(0.0, 0.0), workers=None, partition_size=PARTITION_SIZE,
+                  window=WINDOW, max_passes=MAX_PASSES):
+    """PathBuffer với thứ tự (và chiều) nét giảm quãng đường nhấc bút, bắt đầu từ start_point"""
+    n = buf.num_strokes
+    if n < 2:
+        return buf
+    starts, ends = stroke_endpoints(buf)
+
+    if n <= partition_size:
+        tour = greedy_order(starts, ends, start_point)
+    else:
+        # Các dải nối kiểu zig-zag: dải chẵn bắt đầu từ đầu thấp, dải lẻ từ đầu cao của trục còn lại
+        strips, axis = partition_strips(starts, partition_size)
+        jobs = []
+        for k, ids in enumerate(strips):
+            entry = starts[ids].min(axis=0) if k % 2 == 0 else starts[ids].max(axis=0)
+            entry[axis] = starts[ids, axis].min()
+            if k == 0:
+                entry = np.asarray(start_point, np.float64)
+            jobs.append((starts[ids], ends[ids], tuple(entry)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            orders = list(executor.map(greedy_block, jobs))
+        tour = np.concatenate([ids[order] for ids, order in zip(strips, orders)])
+
+    flip = np.zeros(n, bool)
+    tour, flip = refine_order(tour, flip, starts, ends, start_point, window, max_passes)
+
+    ordered = buf.subset(tour)
+    return reverse_strokes(ordered, flip)
+
+
+def choose_entry_points(buf, start_point=(0.0, 0.0), max_rounds=MAX_ENTRY_ROUNDS):
+    """Giữ thứ tự nét, chọn điểm vào cho từng nét để giảm quãng đường nhấc bút
+
+    Nét khép kín (closed) được xoay vòng để bắt đầu (và kết thúc) tại đỉnh tốt nhất, nét
+    hở được đảo chiều khi đầu kia tốt hơn. Chi phí của một lựa chọn là khoảng cách từ vị
+    trí bút trước đó tới điểm vào cộng khoảng cách từ điểm ra tới điểm vào của nét sau.
+    Lần lượt tối ưu các nét chẵn rồi các nét lẻ (mỗi nét chỉ phụ thuộc hai nét kề nên tính
+    đồng thời trên toàn bộ đỉnh được), lặp đến khi không đổi; quãng đường không bao giờ tăng.
+    """
+    n = buf.num_strokes
+    if n == 0:
+        return buf
+    coords = buf.coords.astype(np.float64)
+    lengths = buf.stroke_lengths()
+    firsts = buf.offsets[:-1]
+    lasts = buf.offsets[1:] - 1
+    ids = buf.stroke_ids()
+    local = np.arange(len(coords)) - firsts[ids]
+
+    # Vòng khép kín có điểm cuối lặp lại điểm đầu: chỉ xét các đỉnh trừ điểm cuối
+    loop = buf.closed & (lengths > 2)
+    repeated = loop & np.all(coords[firsts] == coords[lasts], axis=1)
+    ring = lengths - repeated
+    candidate = np.where(loop[ids], local < ring[ids], (local == 0) | (local == lengths[ids] - 1))
+    # Điểm ra khi vào tại từng đỉnh: chính đỉnh đó (vòng) hoặc đầu còn lại (nét hở)
+    exit_points = np.where(loop[ids, None], coords, coords[firsts[ids] + lengths[ids] - 1 - local])
+    group_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+
+    entry = np.zeros(n, np.int64)  # chỉ số (trong nét) của điểm vào
+    head = np.asarray(start_point, np.float64).reshape(1, 2)
+    tail = np.full((1, 2), np.nan)  # sau nét cuối không phải đi tiếp
+    parity = np.arange(n) % 2
+    for _ in range(max_rounds):
+        changed = False
+        for side in (0, 1):
+            entries = coords[firsts + entry]
+            exits = exit_points[firsts + entry]
+            prev = np.vstack([head, exits[:-1]])[ids]
+            following = np.vstack([entries[1:], tail])[ids]
+            cost = (np.hypot(*(coords - prev).T)
+                    + np.nan_to_num(np.hypot(*(exit_points - following).T)))
+            cost[~candidate] = np.inf
+            # Đỉnh rẻ nhất của mỗi nét (chỉ số nhỏ hơn khi bằng nhau để kết quả ổn định)
+            hit = np.flatnonzero(cost == np.minimum.reduceat(cost, group_starts)[ids])
+            best = local[hit[np.r_[True, ids[hit[1:]] != ids[hit[:-1]]]]]
+            update = (parity == side) & (best != entry)
+            # Chỉ đổi khi thực sự rẻ hơn (tránh dao động vì sai số làm tròn)
+            current = cost[firsts + entry]
+            update &= cost[firsts + best] < current - 1e-9
+            if update.any():
+                entry[update] = best[update]
+                changed = True
+        if not changed:
+            break
+
+    if not entry.any():
+        return buf
+    # Chỉ số nguồn cho từng điểm sau khi xoay/đảo chiều
+    e = entry[ids]
+    rotated = np.where(local < ring[ids], (local + e) % ring[ids], e)
+    reversed_ = lengths[ids] - 1 - local
+    src = firsts[ids] + np.where(loop[ids], rotated, np.where(e > 0, reversed_, local))
+    return buf.with_coords(buf.coords[src])
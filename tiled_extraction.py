@@ -0,0 +1,293 @@
+"""Trích xuất đường nét theo từng ô (tile) cho ảnh rất lớn
+
+Ảnh được chuyển một lần sang file .npy và memory-map, các tiến trình con chỉ đọc
+cửa sổ của ô mình xử lý (các trang của file map được chia sẻ qua page cache của hệ
+điều hành), nên khi xử lý bộ nhớ của mỗi tiến trình phụ thuộc vào kích thước ô chứ
+không phải kích thước ảnh. Lần chuyển đổi đầu tiên vẫn giải mã cả ảnh xám (rộng x cao
+byte) vì PNG/JPEG chỉ giải mã được trọn cả ảnh; với ảnh quá lớn cho bộ nhớ, truyền
+thẳng file .npy ảnh xám uint8 để bỏ qua bước này. Các ô chồng lên nhau TILE_OVERLAP điểm ảnh để các bộ lọc cục bộ cho kết quả
+giống như khi xử lý toàn ảnh; contour cắt ngang đường nối giữa các ô được ghép lại
+bằng cách nối các điểm đầu/cuối gần nhau.
+"""
+import os
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from path_buffer import PathBuffer
+from image_pipeline import (image_size, enhance_image, binarize_image, morphology_image, simplify_contours,
+                            gray_histogram, pick_threshold, fallback_thresholds)
+
+TILE_SIZE = 1024
+TILE_OVERLAP = 32
+# Đường tâm (skeleton) chưa ghép được qua đường nối giữa các ô
+TILED_METHODS = ("contour", "canny", "adaptive")
+
+
+def image_dimensions(image_path):
+    """(rộng, cao) của ảnh hoặc file .npy, chỉ đọc phần header của file"""
+    if image_path.lower().endswith('.npy'):
+        shape = np.load(image_path, mmap_mode='r').shape
+        return int(shape[1]), int(shape[0])
+    return image_size(image_path)
+
+
+def image_pixel_count(image_path):
+    """Số điểm ảnh, chỉ đọc phần header của file"""
+    width, height = image_dimensions(image_path)
+    return width * height
+
+
+def open_gray_memmap(image_path, cache_dir):
+    """Trả về (đường dẫn .npy, ảnh xám memory-map); chuyển đổi một lần nếu cần
+
+    File .npy được dùng trực tiếp. Ảnh thường được giải mã trọn một lần sang ảnh xám để ghi
+    ra file cache (cần rộng x cao byte bộ nhớ), các lần sau chỉ memory-map file cache.
+    """
+    if image_path.lower().endswith('.npy'):
+        img = np.load(image_path, mmap_mode='r')
+        if img.ndim != 2 or img.dtype != np.uint8:
+            raise ValueError(f"File .npy phải là ảnh xám uint8 2 chiều: {image_path}")
+        return image_path, img
+
+    st = os.stat(image_path)
+    stamp = f"{os.path.abspath(image_path)}|{st.st_size}|{st.st_mtime_ns}"
+    npy_path = os.path.join(cache_dir, hashlib.sha1(stamp.encode()).hexdigest() + ".gray.npy")
+
+    if not os.path.exists(npy_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError(f"Không thể đọc ảnh: {image_path}")
+        tmp_path = npy_path + ".tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=img.shape)
+        out[:] = img
+        out.flush()
+        del out, img
+        os.replace(tmp_path, npy_path)
+
+    return npy_path, np.load(npy_path, mmap_mode='r')
+
+
+def make_tiles(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Danh sách (vùng lõi, cửa sổ đọc) dạng (y0, y1, x0, x1) phủ kín ảnh"""
+    height, width = shape[:2]
+    tiles = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+            window = (max(y0 - overlap, 0), min(y1 + overlap, height),
+                      max(x0 - overlap, 0), min(x1 + overlap, width))
+            tiles.append(((y0, y1, x0, x1), window))
+    return tiles
+
+
+def read_window(npy_path, window):
+    """Đọc cửa sổ của một ô từ file memory-map"""
+    img = np.load(npy_path, mmap_mode='r')
+    wy0, wy1, wx0, wx1 = window
+    return np.ascontiguousarray(img[wy0:wy1, wx0:wx1])
+
+
+def tile_histogram(args):
+    """Histogram của vùng lõi ảnh đã làm mịn trong một ô (chạy ở tiến trình con)"""
+    npy_path, core, window = args
+    img_blur = enhance_image(read_window(npy_path, window))
+    y0, y1, x0, x1 = core
+    wy0, _, wx0, _ = window
+    return gray_histogram(np.ascontiguousarray(img_blur[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]))
+
+
+def trace_tile(args):
+    """Tìm contour trong một ô (chạy ở tiến trình con)
+
+    Trả về (các contour nằm trọn trong vùng lõi, các đoạn contour bị cắt bởi biên
+    vùng lõi), tọa độ theo toàn ảnh.
+    """
+    npy_path, core, window, method, threshold, invert = args
+    binary = morphology_image(binarize_image(enhance_image(read_window(npy_path, window)),
+                                             method, threshold, invert), method)
+    # CHAIN_APPROX_NONE: các điểm liên tiếp cách nhau tối đa 1 điểm ảnh, nên hai đầu
+    # của một contour bị cắt ở hai bên đường nối luôn nằm sát nhau
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+    y0, y1, x0, x1 = core
+    wy0, _, wx0, _ = window
+    shift = np.array([wx0, wy0], np.int32)
+    closed, runs = [], []
+    for contour in contours:
+        pts = contour.reshape(-1, 2) + shift
+        inside = (pts[:, 0] >= x0) & (pts[:, 0] < x1) & (pts[:, 1] >= y0) & (pts[:, 1] < y1)
+        if inside.all():
+            closed.append(pts)
+            continue
+        if not inside.any():
+            continue
+
+        # Xoay vòng để điểm đầu nằm ngoài vùng lõi, rồi tách các đoạn liên tiếp nằm trong
+        k = int(np.argmin(inside))
+        pts = np.roll(pts, -k, axis=0)
+        inside = np.roll(inside, -k).astype(np.int8)
+        change = np.diff(inside)
+        starts = np.flatnonzero(change == 1) + 1
+        ends = np.flatnonzero(change == -1) + 1
+        if len(ends) < len(starts):
+            ends = np.r_[ends, len(pts)]
+        runs.extend(pts[a:b] for a, b in zip(starts, ends))
+    return closed, runs
+
+
+def stitch_runs(runs, run_tiles, tol=1.5):
+    """Nối các đoạn contour ở các ô kề nhau thành contour hoàn chỉnh
+
+    Trả về list (điểm, khép kín?).
+    """
+    n = len(runs)
+    if n == 0:
+        return []
+    starts = np.array([r[0] for r in runs], np.float64)
+    ends = np.array([r[-1] for r in runs], np.float64)
+
+    # Băm không gian các điểm đầu để tìm nhanh điểm đầu gần điểm cuối
+    cell = 2.0
+    grid = {}
+    for i, (x, y) in enumerate(starts):
+        grid.setdefault((int(x // cell), int(y // cell)), []).append(i)
+
+    next_run = np.full(n, -1, np.int64)
+    taken = np.zeros(n, bool)
+    for i, (x, y) in enumerate(ends):
+        cx, cy = int(x // cell), int(y // cell)
+        best, best_dist = -1, tol
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for j in grid.get((gx, gy), ()):
+                    # Đoạn tiếp theo phải thuộc ô khác (đoạn kết thúc vì đi ra khỏi vùng lõi)
+                    if taken[j] or run_tiles[j] == run_tiles[i]:
+                        continue
+                    dist = np.hypot(starts[j, 0] - x, starts[j, 1] - y)
+                    if dist <= best_dist:
+                        best, best_dist = j, dist
+        if best >= 0:
+            next_run[i] = best
+            taken[best] = True
+
+    chains = []
+    visited = np.zeros(n, bool)
+    # Chuỗi hở (không nối được) trước, sau đó là các vòng khép kín
+    for i in list(np.flatnonzero(~taken)) + list(range(n)):
+        if visited[i]:
+            continue
+        chain = []
+        j = i
+        while j >= 0 and not visited[j]:
+            visited[j] = True
+            chain.append(runs[j])
+            j = next_run[j]
+        chains.append((np.concatenate(chain), j == i))
+    return chains
+
+
+class TiledExtractor:
+    """Trích xuất đường nét theo ô, chạy song song trên nhiều tiến trình"""
+
+    def __init__(self, cache_dir, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_workers=None,
+                 min_contour_area=10):
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_workers = max_workers
+        self.min_contour_area = min_contour_area
+        self._executor = None
+        self.threshold_info = {}
+        self.timings = {}
+
+    def supports(self, method):
+        """Phương pháp có xử lý theo ô được không"""
+        return method in TILED_METHODS
+
+    def map(self, fn, jobs):
+        """Chạy fn trên các ô; dùng process pool khi có nhiều hơn một ô"""
+        if len(jobs) <= 1 or self.max_workers == 1:
+            return [fn(job) for job in jobs]
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return list(self._executor.map(fn, jobs, chunksize=max(1, len(jobs) // 32)))
+
+    def close(self):
+        """Dừng các tiến trình con"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def histogram(self, npy_path, tiles):
+        """Histogram toàn ảnh đã làm mịn, cộng từ histogram của từng ô"""
+        hists = self.map(tile_histogram, [(npy_path, core, window) for core, window in tiles])
+        return np.sum(hists, axis=0)
+
+    def trace(self, npy_path, tiles, method, threshold, invert, detail_level, tolerance=None):
+        """Tìm contour trên tất cả các ô, ghép lại qua đường nối và đơn giản hóa"""
+        start = time.perf_counter()
+        results = self.map(trace_tile, [(npy_path, core, window, method, threshold, invert)
+                                        for core, window in tiles])
+        self.timings['trace'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        contours = [(c, True) for closed, _ in results for c in closed]
+        runs = [r for _, tile_runs in results for r in tile_runs]
+        run_tiles = [t for t, (_, tile_runs) in enumerate(results) for _ in tile_runs]
+        contours.extend(stitch_runs(runs, run_tiles))
+        self.timings['stitch'] = time.perf_counter() - start
+
+        # Bỏ contour quá nhỏ và sắp xếp từ lớn đến nhỏ như khi xử lý toàn ảnh
+        areas = [cv2.contourArea(c) for c, _ in contours]
+        order = [i for i in sorted(range(len(contours)), key=lambda i: areas[i], reverse=True)
+                 if areas[i] >= self.min_contour_area]
+        return simplify_contours([contours[i][0] for i in order], detail_level,
+                                 closed=[contours[i][1] for i in order], tolerance=tolerance)
+
+    def extract(self, image_path, threshold=128, invert=True, method="contour", detail_level=2.0,
+                threshold_mode="manual", target_fraction=0.1, tolerance=None):
+        """Giống ExtractionPipeline.extract nhưng xử lý theo ô; trả về (ảnh memory-map, PathBuffer)"""
+        npy_path, img = open_gray_memmap(image_path, self.cache_dir)
+        tiles = make_tiles(img.shape, self.tile_size, self.overlap)
+
+        start = time.perf_counter()
+        hist = None
+        chosen = threshold
+        if threshold_mode != "manual" and method != "adaptive":
+            hist = self.histogram(npy_path, tiles)
+            chosen = pick_threshold(hist, threshold_mode, invert, target_fraction)
+        search_time = time.perf_counter() - start
+
+        drawing_path = self.trace(npy_path, tiles, method, chosen, invert, detail_level, tolerance)
+        tried = [chosen]
+
+        if not drawing_path and method == "contour" and threshold_mode == "manual":
+            start = time.perf_counter()
+            if hist is None:
+                hist = self.histogram(npy_path, tiles)
+            for candidate in fallback_thresholds(hist, chosen, invert, self.min_contour_area):
+                print("Thử lại với ngưỡng thấp hơn:", candidate)
+                tried.append(candidate)
+                drawing_path = self.trace(npy_path, tiles, method, candidate, invert, detail_level, tolerance)
+                if drawing_path:
+                    chosen = candidate
+                    break
+            search_time += time.perf_counter() - start
+
+        self.threshold_info = {
+            'mode': threshold_mode,
+            'requested': threshold,
+            'chosen': chosen,
+            'tried': tried,
+            'seconds': search_time,
+        }
+
+        if not drawing_path:
+            raise ValueError("Không thể trích xuất đường nét từ ảnh. Hãy thử điều chỉnh ngưỡng hoặc phương pháp.")
+
+        return img, drawing_path